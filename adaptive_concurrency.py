@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+AIMD (additive-increase / multiplicative-decrease) concurrency control for S3 copies.
+Each source bucket gets its own in-flight limit that grows while copies complete cleanly
+and shrinks when S3 throttles (SlowDown/503) or copy latency degrades. The latency baseline
+follows slow samples too, more slowly, so a lasting latency shift becomes the new normal
+instead of pinning the limit at its minimum.
+"""
+import time
+import logging
+import threading
+from typing import Dict, Optional
+
+from config import (ADAPTIVE_CONCURRENCY_INITIAL, ADAPTIVE_CONCURRENCY_MIN, ADAPTIVE_CONCURRENCY_MAX,
+                    ADAPTIVE_CONCURRENCY_BACKOFF, ADAPTIVE_LATENCY_TOLERANCE)
+
+logger = logging.getLogger(__name__)
+
+# Copy latency grows with object size; latencies are normalised per this many bytes
+# so that a large file is not mistaken for a congested bucket.
+_LATENCY_SIZE_UNIT = 16 * 1024 * 1024
+# At most one decrease per this many seconds, so a burst of throttles from the same
+# congestion event only backs off once.
+_DECREASE_COOLDOWN_SECONDS = 1.0
+_BASELINE_SMOOTHING = 0.05
+# Slow samples pull the baseline up at this rate, so it converges on a lasting latency shift.
+_BASELINE_DRIFT = 0.02
+
+
+class _BucketState:
+    def __init__(self, initial: float):
+        self.limit = initial
+        self.baseline_latency: Optional[float] = None
+        self.last_decrease = 0.0
+        self.throttled = 0
+
+
+class AimdConcurrencyLimiter:
+    """Per-key AIMD limit on in-flight requests, fed with the latency and throttle outcome of each request."""
+
+    def __init__(self, initial: int = ADAPTIVE_CONCURRENCY_INITIAL, minimum: int = ADAPTIVE_CONCURRENCY_MIN,
+                 maximum: int = ADAPTIVE_CONCURRENCY_MAX, backoff: float = ADAPTIVE_CONCURRENCY_BACKOFF,
+                 latency_tolerance: float = ADAPTIVE_LATENCY_TOLERANCE):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self._states: Dict[str, _BucketState] = {}
+        self._lock = threading.Lock()
+
+    def limit(self, key: str) -> int:
+        """Current whole-number in-flight limit for a key."""
+        with self._lock:
+            return int(self._state(key).limit)
+
+    def record(self, key: str, latency: float, throttled: bool, size: Optional[int] = None, ok: bool = True):
+        """
+        Feeds one completed request back into the controller. A request that failed without being
+        throttled says nothing about congestion, so it neither grows the limit nor moves the baseline.
+        """
+        normalised = latency / (1 + (size or 0) / _LATENCY_SIZE_UNIT)
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(key)
+            if not ok and not throttled:
+                return
+            slow = (state.baseline_latency is not None
+                    and normalised > state.baseline_latency * self.latency_tolerance)
+            if throttled or slow:
+                if throttled:
+                    state.throttled += 1
+                else:
+                    state.baseline_latency += _BASELINE_DRIFT * (normalised - state.baseline_latency)
+                if now - state.last_decrease >= _DECREASE_COOLDOWN_SECONDS:
+                    previous = state.limit
+                    state.limit = max(self.minimum, state.limit * self.backoff)
+                    state.last_decrease = now
+                    logger.info(f"Copy concurrency for '{key}' lowered {int(previous)} -> {int(state.limit)} "
+                                f"({'throttled' if throttled else 'latency degraded'})")
+                return
+            # Additive increase: roughly +1 once a full window of requests has completed cleanly.
+            state.limit = min(self.maximum, state.limit + 1.0 / state.limit)
+            if state.baseline_latency is None:
+                state.baseline_latency = normalised
+            else:
+                state.baseline_latency += _BASELINE_SMOOTHING * (normalised - state.baseline_latency)
+
+    def snapshot(self) -> Dict[str, int]:
+        """Current limits for every key seen so far."""
+        with self._lock:
+            return {key: int(state.limit) for key, state in self._states.items()}
+
+    def _state(self, key: str) -> _BucketState:
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _BucketState(float(self.initial))
+        return state
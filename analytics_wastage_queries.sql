@@ -5,13 +5,12 @@ CREATE OR REPLACE TEMPORARY TABLE ec2_payer_max_date as
 select
 bill_payer_account_id as bill_payeraccountid,
 DATEADD(SECOND, -1, max(line_item_usage_start_date)) AS MAX_DATE
-from analytics_application_table_#startyear_#startmonth t,
-      LATERAL FLATTEN(input => t.product:key_value) f
+from analytics_application_table_#startyear_#startmonth t
 WHERE
 t.line_item_line_item_type = 'DiscountedUsage' 
-and f.value:key in ('product_name')
-AND f.value:value = 'Amazon Elastic Compute Cloud'
+AND t.product_product_name = 'Amazon Elastic Compute Cloud'
 and bill_payer_account_id in (#payers_ids)
+and t.payer_partition in (#payers_ids)
 group by 1;
 
 
@@ -91,8 +90,8 @@ SELECT DISTINCT
                                 then SPLIT_PART(instance_type, '.', 1)
                                 else instance_type
                                 end as MYCLOUD_FAMILY_FLEXIBLE,
-    MAX(CASE WHEN f.value:key = 'region' THEN f.value:value::STRING END) AS region_code,
-    MAX(CASE WHEN f.value:key = 'product_name' THEN f.value:value::STRING END) AS product_productname,
+    MAX(t.product_region) AS region_code,
+    MAX(t.product_product_name) AS product_productname,
       (case 
                 WHEN region_code like 'us-east-2%' OR LINE_ITEM_USAGE_TYPE like '%USE2-%' 
                 THEN 'Ohio'
@@ -152,12 +151,12 @@ SELECT DISTINCT
         end) as mycloud_region,
     t.bill_payer_account_id,
     t.line_item_usage_account_id,
-FROM analytics_application_table_#startyear_#startmonth t,
-     LATERAL FLATTEN(input => t.product:key_value) f
+FROM analytics_application_table_#startyear_#startmonth t
 WHERE t.line_item_line_item_type IN ('RIFee')
 AND extract(month from t.line_item_usage_start_date) = #startmonth
 and extract(year from t.line_item_usage_start_date) = #startyear
 and bill_payer_account_id in (#payers_ids)
+and t.payer_partition in (#payers_ids)
 
 GROUP BY 
     t.reservation_reservation_a_r_n,
@@ -166,7 +165,7 @@ GROUP BY
     t.line_item_operation,
     t.bill_payer_account_id,
     t.line_item_usage_account_id
-HAVING MAX(CASE WHEN f.value:key = 'product_name' THEN f.value:value::STRING END) = 'Amazon Elastic Compute Cloud'
+HAVING MAX(t.product_product_name) = 'Amazon Elastic Compute Cloud'
 
 )
 
@@ -250,6 +249,7 @@ WHERE
    and m.line_item_line_item_type IN ('RIFee', 'DiscountedUsage', 'VDiscountedUsage')
     AND m.line_item_line_item_type NOT IN ('Credit', 'Tax', 'Refund')
     and m.bill_payer_account_id in (#payers_ids)
+    and m.payer_partition in (#payers_ids)
 GROUP BY ALL;
 
 
@@ -303,6 +303,8 @@ from
 cross join hourSequence wtp
 
     join (select * from payer_billdesk_config.account) a on split_part(a2.reservation_reservationarn, ':', 5) =a.account_id
+    join #payer_watermarks w on w.payer_id = a2.bill_payeraccountid
+        and DATEADD(hour, wtp.seq, date_from_parts(#startyear,#startmonth,1)) >= w.watermark
 
 where
 		mycloud_startmonth= #startmonth
@@ -329,8 +331,11 @@ where
 
 DELETE
 FROM ck_analytics_application_ri_wastage_hourly
+USING #payer_watermarks w
 WHERE
-extract(month from lineitem_usagestartdate) = #startmonth
+bill_payeraccountid = w.payer_id
+and lineitem_usagestartdate >= w.watermark
+and extract(month from lineitem_usagestartdate) = #startmonth
 and extract(year from lineitem_usagestartdate) = #startyear
 and bill_payeraccountid in (#payers_ids)
 and product_name = 'EC2(RIs)';
@@ -388,13 +393,12 @@ CREATE OR REPLACE TEMPORARY TABLE rds_payer_max_date as
 select
 bill_payer_account_id as bill_payeraccountid,
 DATEADD(SECOND, -1, max(line_item_usage_start_date)) AS MAX_DATE
-from analytics_application_table_#startyear_#startmonth t,
-      LATERAL FLATTEN(input => t.product:key_value) f
+from analytics_application_table_#startyear_#startmonth t
 WHERE
 t.line_item_line_item_type = 'DiscountedUsage' 
-and f.value:key in ('product_name')
-AND f.value:value = 'Amazon Relational Database Service'
+AND t.product_product_name = 'Amazon Relational Database Service'
 and bill_payer_account_id in (#payers_ids)
+and t.payer_partition in (#payers_ids)
 group by 1;
 
 
@@ -546,8 +550,8 @@ WITH rifee_data AS (
                                 then SPLIT_PART(instance_type, '.', 2)
                                 else instance_type
                                 end as mycloud_family_flexible,
-        MAX(CASE WHEN f.value:key = 'region' THEN f.value:value::STRING END) AS region_code,
-        MAX(CASE WHEN f.value:key = 'product_name' THEN f.value:value::STRING END) AS product_productname,
+        MAX(t.product_region) AS region_code,
+        MAX(t.product_product_name) AS product_productname,
     case
 	WHEN region_code like 'us-east-2%' OR LINE_ITEM_USAGE_TYPE like '%USE2-%' 
 	THEN 'Ohio'
@@ -608,12 +612,12 @@ WITH rifee_data AS (
     t.bill_payer_account_id,
     t.line_item_usage_account_id
     FROM
-        analytics_application_table_#startyear_#startmonth t,
-     LATERAL FLATTEN(input => t.product:key_value) f
+        analytics_application_table_#startyear_#startmonth t
 WHERE t.line_item_line_item_type IN ('RIFee')
 AND extract(month from t.line_item_usage_start_date) = #startmonth
 and extract(year from t.line_item_usage_start_date) = #startyear
 and bill_payer_account_id in (#payers_ids)
+and t.payer_partition in (#payers_ids)
 GROUP BY 
     t.reservation_reservation_a_r_n,
     t.LINE_ITEM_USAGE_TYPE,
@@ -621,7 +625,7 @@ GROUP BY
     t.line_item_operation,
     t.bill_payer_account_id,
     t.line_item_usage_account_id
-HAVING MAX(CASE WHEN f.value:key = 'product_name' THEN f.value:value::STRING END) = 'Amazon Relational Database Service'
+HAVING MAX(t.product_product_name) = 'Amazon Relational Database Service'
 )
 	select
         split_part(m.RESERVATION_RESERVATION_A_R_N, ':', 7) as reservation_id,
@@ -700,7 +704,7 @@ WHERE
  
     extract(month from m.line_item_usage_start_date) = #startmonth
    and extract(year from m.line_item_usage_start_date) = #startyear 
-    and m.bill_payer_account_id in (#payers_ids) and
+    and m.bill_payer_account_id in (#payers_ids) and m.payer_partition in (#payers_ids) and
 		 line_item_line_item_type not in ('Credit','Tax','Refund')
 		and line_item_line_item_type  in ('DiscountedUsage','VDiscountedUsage','RIFee')
 	group by all;
@@ -757,6 +761,8 @@ from
 	cross join hourSequence wtp
 
     join (select * from payer_billdesk_config.account) a on split_part(a2.reservation_reservationarn, ':', 5) =a.account_id
+    join #payer_watermarks w on w.payer_id = a2.bill_payeraccountid
+        and DATEADD(hour, wtp.seq, date_from_parts(#startyear,#startmonth,1)) >= w.watermark
 
 where 
 		mycloud_startmonth= #startmonth
@@ -783,8 +789,11 @@ group by all;
 
 DELETE
 FROM ck_analytics_application_ri_wastage_hourly
+USING #payer_watermarks w
 WHERE
-extract(month from lineitem_usagestartdate) = #startmonth
+bill_payeraccountid = w.payer_id
+and lineitem_usagestartdate >= w.watermark
+and extract(month from lineitem_usagestartdate) = #startmonth
 and extract(year from lineitem_usagestartdate) = #startyear
  and bill_payeraccountid in (#payers_ids)
 and product_name = 'RDS';
@@ -841,13 +850,12 @@ CREATE OR REPLACE TEMPORARY TABLE Elasticache_payer_max_date as
 select
 bill_payer_account_id as bill_payeraccountid,
 DATEADD(SECOND, -1, max(line_item_usage_start_date)) AS MAX_DATE
-from analytics_application_table_#startyear_#startmonth t,
-      LATERAL FLATTEN(input => t.product:key_value) f
+from analytics_application_table_#startyear_#startmonth t
 WHERE
 t.line_item_line_item_type = 'DiscountedUsage' 
-and f.value:key in ('product_name')
-AND f.value:value = 'Amazon ElastiCache'
+AND t.product_product_name = 'Amazon ElastiCache'
 and bill_payer_account_id in (#payers_ids)
+and t.payer_partition in (#payers_ids)
 group by 1;
 
 
@@ -884,8 +892,8 @@ WITH rifee_data AS (
     		WHEN line_item_operation = 'CreateCacheCluster:Valkey' THEN 'Valkey' 
         end as mycloud_operatingsystem,
         instance_type as  MYCLOUD_FAMILY_FLEXIBLE,
-            MAX(CASE WHEN f.value:key = 'region' THEN f.value:value::STRING END) AS region_code,
-                MAX(CASE WHEN f.value:key = 'product_name' THEN f.value:value::STRING END) AS product_productname,
+            MAX(t.product_region) AS region_code,
+                MAX(t.product_product_name) AS product_productname,
         	case
 	WHEN region_code like 'us-east-2%' OR LINE_ITEM_USAGE_TYPE like '%USE2-%' 
 	THEN 'Ohio'
@@ -946,14 +954,14 @@ WITH rifee_data AS (
     t.bill_payer_account_id,
     t.line_item_usage_account_id,
     FROM
-        analytics_application_table_#startyear_#startmonth t,
-      LATERAL FLATTEN(input => t.product:key_value) f
+        analytics_application_table_#startyear_#startmonth t
 
     WHERE
  extract(month from t.line_item_usage_start_date) = #startmonth
 and extract(year from t.line_item_usage_start_date) = #startyear
 	and line_item_line_item_type  in ('RIFee')
     and bill_payer_account_id in (#payers_ids)
+    and t.payer_partition in (#payers_ids)
 
 GROUP BY 
     t.reservation_reservation_a_r_n,
@@ -962,7 +970,7 @@ GROUP BY
     t.line_item_operation,
     t.bill_payer_account_id,
     t.line_item_usage_account_id
-HAVING MAX(CASE WHEN f.value:key = 'product_name' THEN f.value:value::STRING END) = 'Amazon ElastiCache'
+HAVING MAX(t.product_product_name) = 'Amazon ElastiCache'
 	
 )
 
@@ -1041,6 +1049,7 @@ WHERE
    extract(month from m.line_item_usage_start_date) = #startmonth
    and extract(year from m.line_item_usage_start_date) = #startyear	
     and m.bill_payer_account_id in (#payers_ids)
+    and m.payer_partition in (#payers_ids)
     and lineitem_lineitemtype  in ('DiscountedUsage','VDiscountedUsage','RIFee')
 	group by all;
 
@@ -1097,6 +1106,8 @@ from
 cross join hourSequence wtp
 
     join (select * from payer_billdesk_config.account) a on split_part(a2.reservation_reservationarn, ':', 5) =a.account_id
+    join #payer_watermarks w on w.payer_id = a2.bill_payeraccountid
+        and DATEADD(hour, wtp.seq, date_from_parts(#startyear,#startmonth,1)) >= w.watermark
 where
 		mycloud_startmonth= #startmonth
 	AND mycloud_startyear= #startyear
@@ -1123,8 +1134,11 @@ where
 
 DELETE
 FROM ck_analytics_application_ri_wastage_hourly
+USING #payer_watermarks w
 WHERE
-extract(month from lineitem_usagestartdate) = #startmonth
+bill_payeraccountid = w.payer_id
+and lineitem_usagestartdate >= w.watermark
+and extract(month from lineitem_usagestartdate) = #startmonth
 and extract(year from lineitem_usagestartdate) = #startyear
 and bill_payeraccountid in (#payers_ids)
 and product_name = 'ElastiCache';
@@ -1178,13 +1192,12 @@ CREATE OR REPLACE TEMPORARY TABLE ElasticSearch_payer_max_date as
 select
 bill_payer_account_id as bill_payeraccountid,
 DATEADD(SECOND, -1, max(line_item_usage_start_date)) AS MAX_DATE
-from analytics_application_table_#startyear_#startmonth t,
-      LATERAL FLATTEN(input => t.product:key_value) f
+from analytics_application_table_#startyear_#startmonth t
 WHERE
 t.line_item_line_item_type = 'DiscountedUsage' 
-and f.value:key in ('product_name')
-AND f.value:value in ('Amazon Elasticsearch Service','Amazon OpenSearch Service')
+AND t.product_product_name in ('Amazon Elasticsearch Service','Amazon OpenSearch Service')
 and bill_payer_account_id in (#payers_ids)
+and t.payer_partition in (#payers_ids)
 group by 1;
 
 
@@ -1217,8 +1230,8 @@ WITH rifee_data AS (
                             end as nfactor_used,
        '' mycloud_operatingsystem,
         instance_type as  MYCLOUD_FAMILY_FLEXIBLE,
-            MAX(CASE WHEN f.value:key = 'region' THEN f.value:value::STRING END) AS region_code,
-                MAX(CASE WHEN f.value:key = 'product_name' THEN f.value:value::STRING END) AS product_productname,
+            MAX(t.product_region) AS region_code,
+                MAX(t.product_product_name) AS product_productname,
         	case
 	WHEN region_code like 'us-east-2%' OR LINE_ITEM_USAGE_TYPE like '%USE2-%' 
 	THEN 'Ohio'
@@ -1279,14 +1292,14 @@ WITH rifee_data AS (
     t.bill_payer_account_id,
     t.line_item_usage_account_id,
     FROM
-        analytics_application_table_#startyear_#startmonth t,
-      LATERAL FLATTEN(input => t.product:key_value) f
+        analytics_application_table_#startyear_#startmonth t
 
     WHERE
  extract(month from t.line_item_usage_start_date) = #startmonth
 and extract(year from t.line_item_usage_start_date) = #startyear
 	and line_item_line_item_type  in ('RIFee')
     and bill_payer_account_id in (#payers_ids)
+    and t.payer_partition in (#payers_ids)
 
 GROUP BY 
     t.reservation_reservation_a_r_n,
@@ -1295,7 +1308,7 @@ GROUP BY
     t.line_item_operation,
     t.bill_payer_account_id,
     t.line_item_usage_account_id
-HAVING MAX(CASE WHEN f.value:key = 'product_name' THEN f.value:value::STRING END) in ('Amazon Elasticsearch Service','Amazon OpenSearch Service')
+HAVING MAX(t.product_product_name) in ('Amazon Elasticsearch Service','Amazon OpenSearch Service')
 	
 )
 
@@ -1376,6 +1389,7 @@ WHERE
    extract(month from m.line_item_usage_start_date) = #startmonth
    and extract(year from m.line_item_usage_start_date) = #startyear	
     and m.bill_payer_account_id in (#payers_ids)
+    and m.payer_partition in (#payers_ids)
 	and lineitem_lineitemtype  in ('DiscountedUsage','VDiscountedUsage','RIFee')
 	group by all;
 
@@ -1434,6 +1448,8 @@ from
 	
 
     join (select * from payer_billdesk_config.account) a on split_part(a2.reservation_reservationarn, ':', 5) =a.account_id
+    join #payer_watermarks w on w.payer_id = a2.bill_payeraccountid
+        and DATEADD(hour, wtp.seq, date_from_parts(#startyear,#startmonth,1)) >= w.watermark
 
 where 
 		mycloud_startmonth= #startmonth
@@ -1460,8 +1476,11 @@ group by all;
 
 DELETE
 FROM ck_analytics_application_ri_wastage_hourly
+USING #payer_watermarks w
 WHERE
-extract(month from lineitem_usagestartdate) = #startmonth
+bill_payeraccountid = w.payer_id
+and lineitem_usagestartdate >= w.watermark
+and extract(month from lineitem_usagestartdate) = #startmonth
 and extract(year from lineitem_usagestartdate) = #startyear
 and bill_payeraccountid in  (#payers_ids)
 and product_name = 'OpenSearch';
@@ -1516,13 +1535,12 @@ CREATE OR REPLACE TEMPORARY TABLE Redshift_payer_max_date as
 select
 bill_payer_account_id as bill_payeraccountid,
 DATEADD(SECOND, -1, max(line_item_usage_start_date)) AS MAX_DATE
-from analytics_application_table_#startyear_#startmonth t,
-      LATERAL FLATTEN(input => t.product:key_value) f
+from analytics_application_table_#startyear_#startmonth t
 WHERE
 t.line_item_line_item_type = 'DiscountedUsage' 
-and f.value:key in ('product_name')
-AND f.value:value in ('Amazon Redshift')
+AND t.product_product_name in ('Amazon Redshift')
 and bill_payer_account_id in (#payers_ids)
+and t.payer_partition in (#payers_ids)
 group by 1;
 
 
@@ -1555,8 +1573,8 @@ WITH rifee_data AS (
                             end as nfactor_used,
        '' mycloud_operatingsystem,
         instance_type as  MYCLOUD_FAMILY_FLEXIBLE,
-            MAX(CASE WHEN f.value:key = 'region' THEN f.value:value::STRING END) AS region_code,
-                MAX(CASE WHEN f.value:key = 'product_name' THEN f.value:value::STRING END) AS product_productname,
+            MAX(t.product_region) AS region_code,
+                MAX(t.product_product_name) AS product_productname,
         	case
 	WHEN region_code like 'us-east-2%' OR LINE_ITEM_USAGE_TYPE like '%USE2-%' 
 	THEN 'Ohio'
@@ -1617,14 +1635,14 @@ WITH rifee_data AS (
     t.bill_payer_account_id,
     t.line_item_usage_account_id,
     FROM
-        analytics_application_table_#startyear_#startmonth t,
-      LATERAL FLATTEN(input => t.product:key_value) f
+        analytics_application_table_#startyear_#startmonth t
 
     WHERE
  extract(month from t.line_item_usage_start_date) = #startmonth
 and extract(year from t.line_item_usage_start_date) = #startyear
 	and line_item_line_item_type  in ('RIFee')
     and bill_payer_account_id in (#payers_ids)
+    and t.payer_partition in (#payers_ids)
 
 GROUP BY 
     t.reservation_reservation_a_r_n,
@@ -1633,7 +1651,7 @@ GROUP BY
     t.line_item_operation,
     t.bill_payer_account_id,
     t.line_item_usage_account_id
-HAVING MAX(CASE WHEN f.value:key = 'product_name' THEN f.value:value::STRING END) = 'Amazon Redshift'
+HAVING MAX(t.product_product_name) = 'Amazon Redshift'
 	
 )
 
@@ -1714,6 +1732,7 @@ WHERE
    extract(month from m.line_item_usage_start_date) = #startmonth
    and extract(year from m.line_item_usage_start_date) = #startyear 	
     and m.bill_payer_account_id in (#payers_ids)
+    and m.payer_partition in (#payers_ids)
 	and lineitem_lineitemtype  in ('DiscountedUsage','VDiscountedUsage','RIFee')
 	group by all;
 
@@ -1771,6 +1790,8 @@ from
 	cross join hourSequence wtp
 
     join (select * from payer_billdesk_config.account) a on split_part(a2.reservation_reservationarn, ':', 5) =a.account_id
+    join #payer_watermarks w on w.payer_id = a2.bill_payeraccountid
+        and DATEADD(hour, wtp.seq, date_from_parts(#startyear,#startmonth,1)) >= w.watermark
 
 where 
 		mycloud_startmonth= #startmonth
@@ -1797,8 +1818,11 @@ group by all;
 
 DELETE
 FROM ck_analytics_application_ri_wastage_hourly
+USING #payer_watermarks w
 WHERE
-extract(month from lineitem_usagestartdate) = #startmonth
+bill_payeraccountid = w.payer_id
+and lineitem_usagestartdate >= w.watermark
+and extract(month from lineitem_usagestartdate) = #startmonth
 and extract(year from lineitem_usagestartdate) = #startyear
 and bill_payeraccountid in (#payers_ids)
 and product_name = 'Redshift';
@@ -1914,6 +1938,8 @@ unused_units = (case
                                 then UNUSED_NU
                                 else UNUSED_NU/NFAPPLIED
                                 end )
-where mycloud_startmonth = #startmonth and mycloud_startyear = #startyear;
+#total_units_watermarks_from
+where mycloud_startmonth = #startmonth and mycloud_startyear = #startyear
+#total_units_watermarks_filter;
 
 end;
\ No newline at end of file
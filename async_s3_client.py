@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+"""
+Asyncio S3 engine.
+Drop-in alternative to S3Client backed by an aiobotocore client running on one event loop
+thread. The synchronous S3Client methods are kept so existing callers work unchanged, and
+copy_files() runs a batch of server-side copies on a bounded pool of worker coroutines that
+pull tasks lazily from the caller's iterator, so thousands of copies can be in flight without an
+OS thread per request, and an optional AIMD limiter caps the copies in flight per source bucket.
+"""
+import os
+import asyncio
+import logging
+import threading
+import contextvars
+from contextlib import AsyncExitStack
+from typing import Dict, Any, Optional, List, Iterable, Iterator, AsyncIterator
+
+from botocore.exceptions import ClientError
+from config import (S3_CONFIG, ASYNC_COPY_CONCURRENCY, MULTIPART_COPY_THRESHOLD, MULTIPART_COPY_PART_WORKERS,
+                    LISTING_SHARD_WORKERS, DELETE_BATCH_WORKERS)
+from adaptive_concurrency import AimdConcurrencyLimiter
+from s3_client import (S3Client, MAX_SINGLE_COPY_SIZE, MAX_DELETE_BATCH_SIZE, THROTTLE_ERROR_CODES,
+                       CACHEABLE_BUCKET_ERROR_CODES, SOURCE_ETAG_METADATA_KEY)
+
+try:
+    from aiobotocore.session import get_session
+    from aiobotocore.config import AioConfig
+    AIOBOTOCORE_AVAILABLE = True
+except ImportError:
+    AIOBOTOCORE_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Throttled attempts seen by the copy coroutine currently running (a one-element list per copy).
+_throttle_counter: contextvars.ContextVar = contextvars.ContextVar('throttle_counter', default=None)
+
+# Marks the end of a sharded listing in the page queue.
+_LISTING_DONE = object()
+
+
+class AsyncS3Client:
+    """S3Client interface on top of an asyncio (aiobotocore) client."""
+    def __init__(self, region_name=None, endpoint_url: Optional[str] = None):
+        if not AIOBOTOCORE_AVAILABLE:
+            raise ImportError("aiobotocore is required for the asyncio S3 engine (pip install aiobotocore).")
+        self.region = region_name or S3_CONFIG.get('region_name', 'us-east-2')
+        self.endpoint_url = endpoint_url
+        self.s3_client = None
+        self._throttle_stats = threading.local()
+        # Only touched from the event loop, so plain dicts and asyncio locks are enough.
+        self._bucket_info: Dict[str, Dict[str, Any]] = {}
+        self._bucket_locks: Dict[str, asyncio.Lock] = {}
+        self._regional_clients: Dict[str, Any] = {}
+        self._exit_stack = AsyncExitStack()
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name="s3-event-loop", daemon=True)
+        self._loop_thread.start()
+        self._run(self._init_s3_client())
+
+    async def _init_s3_client(self):
+        """Open the aiobotocore client with a connection pool sized for ASYNC_COPY_CONCURRENCY."""
+        try:
+            self.s3_client = await self._create_client(self.region)
+            self._regional_clients[self.region] = self.s3_client
+            logger.info(f"Async S3 client initialized for region '{self.region}' with connection pool size: {ASYNC_COPY_CONCURRENCY}")
+        except Exception as e:
+            logger.error(f"Failed to initialize async S3 client: {str(e)}")
+            raise
+
+    async def _create_client(self, region: str):
+        client_config = AioConfig(
+            s3={
+                'addressing_style': S3_CONFIG['addressing_style'],
+                'use_accelerate_endpoint': S3_CONFIG['use_accelerate_endpoint'],
+                'use_dualstack_endpoint': S3_CONFIG['use_dualstack_endpoint']
+            },
+            signature_version=S3_CONFIG['signature_version'],
+            retries={'max_attempts': S3_CONFIG['max_attempts']},
+            max_pool_connections=ASYNC_COPY_CONCURRENCY
+        )
+        client = await self._exit_stack.enter_async_context(
+            get_session().create_client('s3', region_name=region, endpoint_url=self.endpoint_url, config=client_config)
+        )
+        client.meta.events.register_first('needs-retry.s3', self._observe_attempt)
+        return client
+
+    async def _client_for(self, bucket: str):
+        """Returns the client for the bucket's own region, so requests skip the cross-region redirect."""
+        region = (await self._get_bucket_info(bucket))['region'] or self.region
+        client = self._regional_clients.get(region)
+        if client is None:
+            logger.info(f"Creating async S3 client for region '{region}' (bucket '{bucket}')")
+            client = self._regional_clients[region] = await self._create_client(region)
+        return client
+
+    def _run(self, coro):
+        """Runs a coroutine on the engine's event loop and waits for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def close(self):
+        """Closes the client and stops the event loop."""
+        if self._loop.is_running():
+            self._run(self._exit_stack.aclose())
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop_thread.join()
+
+    def _observe_attempt(self, response=None, **kwargs):
+        """'needs-retry' hook: counts throttled attempts against the copy that made them. Never decides on retries."""
+        counter = _throttle_counter.get()
+        if response is None or counter is None:
+            return None
+        http_response, parsed = response
+        error_code = parsed.get('Error', {}).get('Code') if isinstance(parsed, dict) else None
+        if error_code in THROTTLE_ERROR_CODES or getattr(http_response, 'status_code', None) == 503:
+            counter[0] += 1
+        return None
+
+    def pop_throttle_count(self) -> int:
+        """Returns and resets the number of throttled S3 attempts made by copies from the calling thread."""
+        count = getattr(self._throttle_stats, 'count', 0)
+        self._throttle_stats.count = 0
+        return count
+
+    def can_access_bucket(self, bucket_name: str) -> bool:
+        """Checks if the role has s3:ListBucket permission on a bucket."""
+        return self.get_bucket_info(bucket_name)['accessible']
+
+    def get_bucket_info(self, bucket_name: str) -> Dict[str, Any]:
+        """Returns {'accessible': bool, 'region': Optional[str]} for a bucket, probing it only once."""
+        return self._run(self._get_bucket_info(bucket_name))
+
+    async def _get_bucket_info(self, bucket_name: str) -> Dict[str, Any]:
+        info = self._bucket_info.get(bucket_name)
+        if info is not None:
+            return info
+        async with self._bucket_locks.setdefault(bucket_name, asyncio.Lock()):
+            info = self._bucket_info.get(bucket_name)
+            if info is None:
+                info, cacheable = await self._probe_bucket(bucket_name)
+                if cacheable:
+                    self._bucket_info[bucket_name] = info
+        return info
+
+    async def _probe_bucket(self, bucket_name: str):
+        try:
+            response = await self.s3_client.head_bucket(Bucket=bucket_name)
+            logger.debug(f"Access to bucket '{bucket_name}' confirmed.")
+            return {'accessible': True, 'region': S3Client._bucket_region(response)}, True
+        except ClientError as e:
+            error_code = e.response['Error']['Code']
+            if error_code in ('403', 'AccessDenied'):
+                logger.warning(f"Access DENIED for bucket '{bucket_name}'.")
+            else:
+                logger.error(f"Error checking access for bucket '{bucket_name}': {e}")
+            return ({'accessible': False, 'region': S3Client._bucket_region(e.response)},
+                    error_code in CACHEABLE_BUCKET_ERROR_CODES)
+        except Exception as e:
+            logger.error(f"Unexpected error checking bucket access for '{bucket_name}': {e}")
+            return {'accessible': False, 'region': None}, False
+
+    def list_objects_with_metadata(self, bucket: str, prefix: str, since=None,
+                                   parallel: bool = False) -> Dict[str, Dict[str, Any]]:
+        """Lists all objects under a prefix as full_key -> {'ETag', 'Size', 'LastModified'}."""
+        objects_map = {}
+        for page_objects in self.iter_objects_with_metadata(bucket, prefix, since=since, parallel=parallel):
+            objects_map.update(page_objects)
+        logger.debug(f"Found {len(objects_map)} objects with metadata in s3://{bucket}/{prefix}")
+        return objects_map
+
+    def iter_objects_with_metadata(self, bucket: str, prefix: str, since=None,
+                                   parallel: bool = False) -> Iterator[Dict[str, Dict[str, Any]]]:
+        """Yields one full_key -> metadata map per listing page, fetched on the event loop."""
+        pages = self._iter_pages(bucket, prefix, parallel)
+        try:
+            while True:
+                try:
+                    page = self._run(pages.__anext__())
+                except StopAsyncIteration:
+                    return
+                page_objects = {}
+                for obj in page.get('Contents', []):
+                    if since and obj['LastModified'] <= since:
+                        continue
+                    full_key = obj['Key']
+                    if full_key and not full_key.endswith('/'):
+                        page_objects[full_key] = {
+                            'ETag': obj['ETag'].strip('"'),
+                            'Size': obj['Size'],
+                            'LastModified': obj['LastModified']
+                        }
+                if page_objects:
+                    yield page_objects
+        except ClientError as e:
+            logger.error(f"Failed to list objects in s3://{bucket}/{prefix}: {e}")
+            raise
+        finally:
+            self._run(pages.aclose())
+
+    def list_common_prefixes(self, bucket: str, prefix: str) -> List[str]:
+        """Lists the immediate sub-prefixes ('folders') under a prefix."""
+        return self._run(self._list_common_prefixes(bucket, prefix))
+
+    async def _list_common_prefixes(self, bucket: str, prefix: str) -> List[str]:
+        paginator = (await self._client_for(bucket)).get_paginator('list_objects_v2')
+        return [sub['Prefix']
+                async for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/')
+                for sub in page.get('CommonPrefixes', [])]
+
+    def put_object(self, bucket: str, key: str, body: bytes):
+        """Writes a small object in a single request. Raises ClientError on failure."""
+        self._run(self._put_object(bucket, key, body))
+
+    async def _put_object(self, bucket: str, key: str, body: bytes):
+        await (await self._client_for(bucket)).put_object(Bucket=bucket, Key=key, Body=body)
+
+    def get_object(self, bucket: str, key: str) -> bytes:
+        """Reads a small object fully into memory. Raises ClientError on failure."""
+        return self._run(self._get_object(bucket, key))
+
+    async def _get_object(self, bucket: str, key: str) -> bytes:
+        response = await (await self._client_for(bucket)).get_object(Bucket=bucket, Key=key)
+        async with response['Body'] as body:
+            return await body.read()
+
+    def get_object_metadata(self, bucket: str, key: str) -> Dict[str, str]:
+        """Returns the object's user metadata (HeadObject). Raises ClientError on failure."""
+        return self._run(self._get_object_metadata(bucket, key))
+
+    async def _get_object_metadata(self, bucket: str, key: str) -> Dict[str, str]:
+        return (await (await self._client_for(bucket)).head_object(Bucket=bucket, Key=key)).get('Metadata', {})
+
+    async def _iter_pages(self, bucket: str, prefix: str, parallel: bool) -> AsyncIterator[Dict[str, Any]]:
+        if not parallel:
+            paginator = (await self._client_for(bucket)).get_paginator('list_objects_v2')
+            async for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+                yield page
+            return
+
+        # Same sharding as S3Client._iter_sharded_pages, with shards paginated as concurrent tasks.
+        client = await self._client_for(bucket)
+        first_page = await client.list_objects_v2(Bucket=bucket, Prefix=prefix, Delimiter='/')
+        shards = S3Client._prefix_shards(first_page)
+        if shards is None:
+            first_page = await client.list_objects_v2(Bucket=bucket, Prefix=prefix)
+            shards = S3Client._key_range_shards(prefix, first_page)
+        yield first_page
+        if not shards:
+            return
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=LISTING_SHARD_WORKERS)
+        limit = asyncio.Semaphore(LISTING_SHARD_WORKERS)
+        tasks = [asyncio.ensure_future(self._list_shard(queue, limit, bucket, *shard)) for shard in shards]
+        running = len(tasks)
+        try:
+            while running:
+                item = await queue.get()
+                if item is _LISTING_DONE:
+                    running -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                elif isinstance(item, list):
+                    # Sub-shards of a shard that was still heavy; queued before that shard's _LISTING_DONE.
+                    tasks += [asyncio.ensure_future(self._list_shard(queue, limit, bucket, *shard)) for shard in item]
+                    running += len(item)
+                else:
+                    yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _list_shard(self, queue: asyncio.Queue, limit: asyncio.Semaphore, bucket: str, prefix: str,
+                          start_after: Optional[str], end_at: Optional[str]):
+        """
+        Paginates one listing shard into the page queue, stopping at the first key beyond end_at. Like
+        S3Client._list_shard, a shard whose first page shows it goes on queues the rest as a list of sub-shards.
+        """
+        paginate_args = {'Bucket': bucket, 'Prefix': prefix}
+        if start_after:
+            paginate_args['StartAfter'] = start_after
+        try:
+            paginator = (await self._client_for(bucket)).get_paginator('list_objects_v2')
+            async with limit:
+                first_page = True
+                async for page in paginator.paginate(**paginate_args):
+                    sub_shards = S3Client._key_range_shards(prefix, page, end_at) if first_page else []
+                    first_page = False
+                    page, done = S3Client._clip_shard_page(page, end_at)
+                    await queue.put(page)
+                    if done:
+                        break
+                    if len(sub_shards) > 1:
+                        await queue.put(sub_shards)
+                        break
+        except Exception as e:
+            await queue.put(e)
+        await queue.put(_LISTING_DONE)
+
+    def copy_single_file(self, source_bucket: str, source_key: str, dest_bucket: str, dest_key: str,
+                         size: Optional[int] = None, etag: Optional[str] = None) -> bool:
+        """Copy a single file; blocks the calling thread only, the request itself runs on the event loop."""
+        ok, throttled = self._run(self._copy_tracked(source_bucket, source_key, dest_bucket, dest_key, size, etag))
+        self._throttle_stats.count = getattr(self._throttle_stats, 'count', 0) + throttled
+        return ok
+
+    def copy_files(self, tasks: Iterable[Dict[str, Any]], concurrency: int = ASYNC_COPY_CONCURRENCY,
+                   limiter: Optional[AimdConcurrencyLimiter] = None) -> Dict[str, Any]:
+        """
+        Copies copy tasks (copy_single_file keyword arguments) on the event loop with `concurrency` worker
+        coroutines. Tasks are pulled from the iterable as workers free up, so it may be a lazy generator;
+        callers pass tasks interleaved across payers for fairness. With a limiter, a worker waits while its
+        task's source bucket is at the limiter's in-flight limit, and feeds each copy's outcome back to it.
+
+        Returns:
+            A summary with 'success', 'failed', 'total' and 'throttled' counts, plus the
+            'failed_tasks' themselves so callers can retry them.
+        """
+        return self._run(self._copy_files(tasks, concurrency, limiter))
+
+    async def _copy_files(self, tasks: Iterable[Dict[str, Any]], concurrency: int,
+                          limiter: Optional[AimdConcurrencyLimiter]) -> Dict[str, Any]:
+        summary = {"success": 0, "failed": 0, "total": 0, "throttled": 0, "failed_tasks": []}
+        pending = iter(tasks)
+        bucket_in_flight: Dict[str, int] = {}
+        bucket_freed = asyncio.Condition()
+
+        async def worker():
+            # The event loop runs one coroutine at a time, so workers can share the plain iterator.
+            for task in pending:
+                summary["total"] += 1
+                bucket = task["source_bucket"]
+                if limiter:
+                    async with bucket_freed:
+                        await bucket_freed.wait_for(lambda: bucket_in_flight.get(bucket, 0) < limiter.limit(bucket))
+                        bucket_in_flight[bucket] = bucket_in_flight.get(bucket, 0) + 1
+                started = self._loop.time()
+                ok, throttled = await self._copy_tracked(**task)
+                if limiter:
+                    limiter.record(bucket, self._loop.time() - started, throttled > 0, size=task.get('size'), ok=ok)
+                    async with bucket_freed:
+                        bucket_in_flight[bucket] -= 1
+                        bucket_freed.notify_all()
+                summary["success" if ok else "failed"] += 1
+                if not ok:
+                    summary["failed_tasks"].append(task)
+                summary["throttled"] += throttled
+                finished = summary["success"] + summary["failed"]
+                if finished % 250 == 0:
+                    logger.info(f"Copy progress: {finished} copies finished | Success: {summary['success']}, Failed: {summary['failed']}")
+
+        await asyncio.gather(*(worker() for _ in range(max(concurrency, 1))))
+        if limiter:
+            logger.info(f"Adaptive copy concurrency limits: {limiter.snapshot()}")
+        return summary
+
+    async def _copy_tracked(self, source_bucket: str, source_key: str, dest_bucket: str, dest_key: str,
+                            size: Optional[int] = None, etag: Optional[str] = None):
+        """
+        Runs one copy in its own context so throttled retries are attributed to it. Returns (ok, throttled).
+        Like S3Client.copy_single_file, a given source etag must still match.
+        """
+        counter = [0]
+        _throttle_counter.set(counter)
+        try:
+            if size is not None and size > min(MULTIPART_COPY_THRESHOLD, MAX_SINGLE_COPY_SIZE):
+                await self._multipart_copy(source_bucket, source_key, dest_bucket, dest_key, size, etag)
+            else:
+                copy_args = {'CopySource': {'Bucket': source_bucket, 'Key': source_key},
+                             'Bucket': dest_bucket, 'Key': dest_key}
+                if etag:
+                    copy_args.update(CopySourceIfMatch=f'"{etag}"', MetadataDirective='REPLACE',
+                                     Metadata={SOURCE_ETAG_METADATA_KEY: etag})
+                dest_client = await self._client_for(dest_bucket)
+                await dest_client.copy_object(**copy_args)
+            logger.debug(f"Successfully copied: {os.path.basename(source_key)}")
+            return True, counter[0]
+        except ClientError as e:
+            logger.error(f"Failed to copy s3://{source_bucket}/{source_key} to s3://{dest_bucket}/{dest_key}: {e}")
+            return False, counter[0]
+        except Exception as e:
+            logger.error(f"An unexpected error occurred during copy of {source_key}: {e}")
+            return False, counter[0]
+
+    async def _multipart_copy(self, source_bucket: str, source_key: str, dest_bucket: str, dest_key: str, size: int,
+                              etag: Optional[str] = None):
+        """Async counterpart of S3Client._multipart_copy; aborts the upload on any failure, then re-raises."""
+        head = await (await self._client_for(source_bucket)).head_object(Bucket=source_bucket, Key=source_key)
+        source_etag = f'"{etag}"' if etag else head['ETag']
+        dest_client = await self._client_for(dest_bucket)
+        create_args = {'Bucket': dest_bucket, 'Key': dest_key,
+                       'Metadata': dict(head.get('Metadata', {}), **{SOURCE_ETAG_METADATA_KEY: source_etag.strip('"')})}
+        if head.get('ContentType'):
+            create_args['ContentType'] = head['ContentType']
+        upload_id = (await dest_client.create_multipart_upload(**create_args))['UploadId']
+
+        part_size = S3Client._multipart_part_size(size)
+        ranges = [(part_number, start, min(start + part_size, size) - 1)
+                  for part_number, start in enumerate(range(0, size, part_size), 1)]
+        copy_source = {'Bucket': source_bucket, 'Key': source_key}
+        limit = asyncio.Semaphore(MULTIPART_COPY_PART_WORKERS)
+
+        async def copy_part(part_number: int, first_byte: int, last_byte: int) -> Dict[str, Any]:
+            async with limit:
+                response = await dest_client.upload_part_copy(
+                    CopySource=copy_source, CopySourceIfMatch=source_etag,
+                    CopySourceRange=f"bytes={first_byte}-{last_byte}",
+                    Bucket=dest_bucket, Key=dest_key, UploadId=upload_id, PartNumber=part_number
+                )
+            return {'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']}
+
+        part_tasks = [asyncio.ensure_future(copy_part(*part_range)) for part_range in ranges]
+        try:
+            parts = await asyncio.gather(*part_tasks)
+            await dest_client.complete_multipart_upload(
+                Bucket=dest_bucket, Key=dest_key, UploadId=upload_id,
+                MultipartUpload={'Parts': list(parts)}
+            )
+        except Exception:
+            for task in part_tasks:
+                task.cancel()
+            logger.warning(f"Aborting multipart copy to s3://{dest_bucket}/{dest_key} (upload id: {upload_id})")
+            try:
+                await dest_client.abort_multipart_upload(Bucket=dest_bucket, Key=dest_key, UploadId=upload_id)
+            except ClientError as abort_error:
+                logger.error(f"Failed to abort multipart upload {upload_id} for s3://{dest_bucket}/{dest_key}: {abort_error}")
+            raise
+
+    def delete_objects(self, bucket: str, keys: List[str]) -> bool:
+        """
+        Deletes a list of keys, sending up to DELETE_BATCH_WORKERS 1000-key batches concurrently.
+        True if every key was deleted.
+        """
+        return self._run(self._delete_objects(bucket, keys))
+
+    async def _delete_objects(self, bucket: str, keys: List[str]) -> bool:
+        if not keys:
+            return True
+
+        client = await self._client_for(bucket)
+        limit = asyncio.Semaphore(DELETE_BATCH_WORKERS)
+
+        async def delete_batch(batch: List[str]) -> bool:
+            try:
+                async with limit:
+                    response = await client.delete_objects(
+                        Bucket=bucket, Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+                    )
+            except ClientError as e:
+                logger.error(f"Failed to delete {len(batch)} objects from s3://{bucket}: {e}", exc_info=True)
+                return False
+            errors = response.get('Errors', [])
+            S3Client.log_delete_errors(bucket, errors)
+            return not errors
+
+        batches = [keys[i:i + MAX_DELETE_BATCH_SIZE] for i in range(0, len(keys), MAX_DELETE_BATCH_SIZE)]
+        return all(await asyncio.gather(*(delete_batch(batch) for batch in batches)))
+
+    def delete_objects_by_prefix(self, bucket: str, prefix: str) -> bool:
+        """Deletes all objects under a prefix, issuing each page's delete as soon as it is listed."""
+        logger.warning(f"Preparing to delete all objects under prefix: s3://{bucket}/{prefix}")
+        return self._run(self._delete_objects_by_prefix(bucket, prefix))
+
+    async def _delete_objects_by_prefix(self, bucket: str, prefix: str) -> bool:
+        limit = asyncio.Semaphore(DELETE_BATCH_WORKERS)
+
+        async def delete_page(keys: List[str]) -> bool:
+            try:
+                return await self._delete_objects(bucket, keys)
+            finally:
+                limit.release()
+
+        try:
+            deletes = []
+            deleted = 0
+            paginator = (await self._client_for(bucket)).get_paginator('list_objects_v2')
+            async for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+                keys = [obj['Key'] for obj in page.get('Contents', [])]
+                if keys:
+                    deleted += len(keys)
+                    # Like S3Client's, listing waits while DELETE_BATCH_WORKERS page deletes are in flight.
+                    await limit.acquire()
+                    deletes.append(asyncio.ensure_future(delete_page(keys)))
+            if not deletes:
+                logger.info(f"No objects found to delete under prefix: s3://{bucket}/{prefix}")
+                return True
+            if not all(await asyncio.gather(*deletes)):
+                return False
+            logger.info(f"Successfully deleted {deleted} objects under prefix: s3://{bucket}/{prefix}")
+            return True
+        except ClientError as e:
+            logger.error(f"Failed to delete objects from s3://{bucket}/{prefix}: {e}", exc_info=True)
+            return False
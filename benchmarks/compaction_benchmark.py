@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Small-file compaction benchmark: ParquetCompactor against a local S3 stand-in.
+
+Seeds each synthetic payer's staging prefix with many small CUR-like Snappy Parquet parts
+(one per hour by default) on a moto server. It then compacts the prefixes and reports:
+  - file count and bytes before and after compaction
+  - compaction time and peak RSS
+  - scan time over the stage, before and after compaction, for a full scan and for a
+    filtered aggregate. Both are read with pyarrow.dataset, standing in for the per-file
+    overhead an external table scan pays.
+Results are written as JSON next to the copy-throughput results.
+
+Requires moto[server] and pyarrow (and psutil for RSS).
+
+Example:
+    python benchmarks/compaction_benchmark.py --payers 8 --hours 720 --rows-per-file 2000
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import boto3
+from botocore.config import Config
+
+import config
+from s3_client import S3Client
+from parquet_compactor import ParquetCompactor, PYARROW_AVAILABLE
+from s3_stand_in import start_moto_server, create_bucket
+from copy_throughput_benchmark import PeakRssSampler, RESULTS_DIR, SEED_WORKERS
+
+if PYARROW_AVAILABLE:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+STAGING_BUCKET = 'bench-compaction'
+STAGE_ROOT = 'benchmark_app/analytics/uat/'
+PRODUCT_CODES = ['AmazonEC2', 'AmazonRDS', 'AmazonS3', 'AWSLambda', 'AmazonElastiCache']
+
+
+def cur_part(payer_id: str, hour: datetime, rows: int, seed: int):
+    """A CUR-shaped table for one hourly export part."""
+    start = pa.array([hour] * rows, type=pa.timestamp('us'))
+    return pa.table({
+        'bill_payer_account_id': pa.array([payer_id] * rows),
+        'line_item_usage_account_id': pa.array([f"{(seed + i) % 40:012}" for i in range(rows)]),
+        'line_item_usage_start_date': start,
+        'line_item_usage_end_date': pa.array([hour + timedelta(hours=1)] * rows, type=pa.timestamp('us')),
+        'line_item_product_code': pa.array([PRODUCT_CODES[(seed + i) % len(PRODUCT_CODES)] for i in range(rows)]),
+        'line_item_line_item_type': pa.array(['Usage' if (seed + i) % 7 else 'DiscountedUsage' for i in range(rows)]),
+        'line_item_usage_amount': pa.array([((seed * 31 + i) % 997) / 10.0 for i in range(rows)]),
+        'line_item_unblended_cost': pa.array([((seed * 17 + i) % 1009) / 100.0 for i in range(rows)]),
+        'reservation_reservation_a_r_n': pa.array([f"arn:aws:ec2:us-east-1:1:reserved-instances/{(seed + i) % 9}"
+                                                   for i in range(rows)]),
+    })
+
+
+def seed_stage(client, payers: int, hours: int, rows_per_file: int, year: int, month: int) -> List[str]:
+    """Writes one small Parquet part per payer-hour, like the copied CUR exports. Returns the payer prefixes."""
+    create_bucket(client, STAGING_BUCKET)
+    month_prefix = f"{STAGE_ROOT}year={year}/month={month}/"
+    period_start = datetime(year, month, 1)
+    prefixes = [f"{month_prefix}payer-{100000000000 + index}/" for index in range(payers)]
+
+    def put(item):
+        prefix, hour = item
+        payer_id = prefix.rstrip('/').rsplit('payer-', 1)[1]
+        stamp = period_start + timedelta(hours=hour)
+        sink = pa.BufferOutputStream()
+        pq.write_table(cur_part(payer_id, stamp, rows_per_file, hour), sink, compression='snappy')
+        key = f"{prefix}cur-{stamp.strftime('%Y%m%d%H')}-00001.snappy.parquet"
+        client.put_object(Bucket=STAGING_BUCKET, Key=key, Body=sink.getvalue().to_pybytes())
+
+    with ThreadPoolExecutor(max_workers=SEED_WORKERS) as executor:
+        list(executor.map(put, [(prefix, hour) for prefix in prefixes for hour in range(hours)]))
+    return prefixes
+
+
+def stage_stats(s3_client: S3Client, prefix: str) -> Dict[str, Any]:
+    objects = s3_client.list_objects_with_metadata(STAGING_BUCKET, prefix)
+    sizes = [meta['Size'] for key, meta in objects.items() if key.endswith('.parquet')]
+    return {"files": len(sizes), "bytes": sum(sizes),
+            "avg_file_kb": round(sum(sizes) / len(sizes) / 1024, 1) if sizes else None}
+
+
+def time_queries(filesystem, prefix: str, repeats: int) -> Dict[str, float]:
+    """Best-of-N seconds for a full scan and a filtered aggregate over every Parquet file under prefix."""
+    def full_scan():
+        return ds.dataset(f"{STAGING_BUCKET}/{prefix}", filesystem=filesystem, format='parquet').to_table().num_rows
+
+    def filtered_aggregate():
+        table = ds.dataset(f"{STAGING_BUCKET}/{prefix}", filesystem=filesystem, format='parquet').to_table(
+            columns=['line_item_usage_account_id', 'line_item_unblended_cost'],
+            filter=(ds.field('line_item_product_code') == 'AmazonEC2')
+                   & (ds.field('line_item_line_item_type') == 'DiscountedUsage')
+        )
+        return pc.sum(table['line_item_unblended_cost']).as_py()
+
+    timings = {}
+    for name, query in (("full_scan", full_scan), ("filtered_aggregate", filtered_aggregate)):
+        best = None
+        for _ in range(repeats):
+            started = time.perf_counter()
+            query()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        timings[f"{name}_seconds"] = round(best, 3)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoint-url', help="Use an already running S3 stand-in instead of starting moto.")
+    parser.add_argument('--region', default='us-east-2')
+    parser.add_argument('--payers', type=int, default=4)
+    parser.add_argument('--hours', type=int, default=168, help="Hourly parts per payer.")
+    parser.add_argument('--rows-per-file', type=int, default=2000)
+    parser.add_argument('--year', type=int, default=2024)
+    parser.add_argument('--month', type=int, default=7)
+    parser.add_argument('--repeats', type=int, default=3, help="Runs per query; the best time is reported.")
+    parser.add_argument('--label', default='')
+    parser.add_argument('--output', help="Result file (default: benchmarks/results/compaction-<timestamp>.json).")
+    args = parser.parse_args()
+
+    if not PYARROW_AVAILABLE:
+        parser.error("pyarrow is not installed; compaction cannot be benchmarked.")
+    logging.getLogger().setLevel(logging.WARNING)
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+    moto_process = None
+    endpoint_url = args.endpoint_url
+    if not endpoint_url:
+        moto_process, endpoint_url = start_moto_server()
+    try:
+        seed_client = boto3.client('s3', region_name=args.region, endpoint_url=endpoint_url,
+                                   config=Config(max_pool_connections=SEED_WORKERS))
+        prefixes = seed_stage(seed_client, args.payers, args.hours, args.rows_per_file, args.year, args.month)
+        month_prefix = f"{STAGE_ROOT}year={args.year}/month={args.month}/"
+        compacted_month_prefix = f"{STAGE_ROOT}{config.COMPACTION_OUTPUT_DIR}/year={args.year}/month={args.month}/"
+
+        s3_client = S3Client(region_name=args.region, endpoint_url=endpoint_url)
+        compactor = ParquetCompactor(s3_client, STAGING_BUCKET)
+        before = stage_stats(s3_client, month_prefix)
+        before.update(time_queries(compactor.filesystem, month_prefix, args.repeats))
+
+        with PeakRssSampler() as rss:
+            started = time.perf_counter()
+            ok = compactor.compact_prefixes([
+                (prefix, f"{STAGE_ROOT}{config.COMPACTION_OUTPUT_DIR}/{prefix[len(STAGE_ROOT):]}") for prefix in prefixes
+            ])
+            compaction_seconds = time.perf_counter() - started
+
+        after = stage_stats(s3_client, compacted_month_prefix)
+        after.update(time_queries(compactor.filesystem, compacted_month_prefix, args.repeats))
+        row_groups = [pq.ParquetFile(compactor.filesystem.open_input_file(f"{STAGING_BUCKET}/{key}")).num_row_groups
+                      for key in s3_client.list_objects_with_metadata(STAGING_BUCKET, compacted_month_prefix)]
+        after["row_groups"] = sum(row_groups)
+    finally:
+        if moto_process:
+            moto_process.terminate()
+            moto_process.wait()
+
+    result = {
+        "benchmark": "compaction",
+        "label": args.label,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "pyarrow": pa.__version__,
+        "parameters": {key: value for key, value in vars(args).items() if key not in ('output', 'endpoint_url')},
+        "config": {
+            name: getattr(config, name) for name in (
+                'COMPACTION_TARGET_FILE_BYTES', 'COMPACTION_ROW_GROUP_ROWS', 'COMPACTION_READ_BATCH_ROWS',
+                'COMPACTION_WORKERS'
+            )
+        },
+        "compaction": {"ok": ok, "seconds": round(compaction_seconds, 3), "peak_rss_mb": rss.peak_mb},
+        "before": before,
+        "after": after
+    }
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"compaction-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(json.dumps({key: result[key] for key in ("compaction", "before", "after")}, indent=2))
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Copy-throughput benchmark for S3Client and FargateDataCopyService against a local S3 stand-in.
+
+Seeds synthetic CUR-shaped prefixes (hourly Parquet keys across many payers) into a moto server,
+then measures three phases with optional injected per-request latency and SlowDown throttling:
+  listing - S3Client.list_objects_with_metadata over every payer's billing-period prefix
+  copy    - FargateDataCopyService.process_multiple_payers (Snowflake disabled)
+  delete  - S3Client.delete_objects_by_prefix over the staged data
+Each phase reports files/s and peak RSS; the copy phase also reports p50/p99 copy latency.
+Results are written as JSON; pass --baseline to compare against an earlier result file.
+
+Requires moto[server] (and psutil for RSS). Tuning knobs from config.py, such as
+ADAPTIVE_CONCURRENCY_ENABLED or STAGING_WRITE_MODE, are read from the environment as usual
+and recorded in the result file.
+
+Example:
+    AWS_ACCESS_KEY_ID=test AWS_SECRET_ACCESS_KEY=test \\
+        python benchmarks/copy_throughput_benchmark.py --payers 20 --hours 168 --latency-ms 20 --throttle-rate 0.01
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import boto3
+from botocore.config import Config
+
+import config
+from s3_client import S3Client
+from data_copy_service import FargateDataCopyService
+from s3_stand_in import start_moto_server, FaultInjector, seed_cur_prefixes, create_bucket, StaticPayerConfigs
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+STAGING_BUCKET = 'bench-staging'
+APP = 'benchmark_app'
+MODULE = 'analytics'
+SEED_WORKERS = 32
+
+
+class InstrumentedS3Client(S3Client):
+    """S3Client whose regional clients go through the fault injector and whose copies are timed."""
+
+    def __init__(self, injector: FaultInjector, **kwargs):
+        self.injector = injector
+        self.copy_latencies: List[float] = []
+        self._latency_lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def _create_client(self, region: str):
+        client = super()._create_client(region)
+        self.injector.attach(client)
+        return client
+
+    def copy_single_file(self, *args, **kwargs) -> bool:
+        started = time.perf_counter()
+        try:
+            return super().copy_single_file(*args, **kwargs)
+        finally:
+            with self._latency_lock:
+                self.copy_latencies.append(time.perf_counter() - started)
+
+
+class PeakRssSampler:
+    """Samples this process's RSS in the background and keeps the peak seen while active."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self):
+        if PSUTIL_AVAILABLE:
+            process = psutil.Process()
+            self.peak = process.memory_info().rss
+            self._thread = threading.Thread(target=self._sample, args=(process,), daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _sample(self, process):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, process.memory_info().rss)
+
+    @property
+    def peak_mb(self) -> Optional[float]:
+        return round(self.peak / (1024 * 1024), 1) if PSUTIL_AVAILABLE else None
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))]
+
+
+def phase_result(files: int, seconds: float, rss: PeakRssSampler, **extra) -> Dict[str, Any]:
+    result = {
+        "files": files, "seconds": round(seconds, 3),
+        "files_per_second": round(files / seconds, 1) if seconds else None,
+        "peak_rss_mb": rss.peak_mb
+    }
+    result.update(extra)
+    return result
+
+
+def run_listing(s3_client: S3Client, payer_configs: Dict[str, Dict[str, Any]], year: int, month: int) -> Dict[str, Any]:
+    files = 0
+    with PeakRssSampler() as rss:
+        started = time.perf_counter()
+        for payer_config in payer_configs.values():
+            prefix = f"{payer_config['path']}/data/BILLING_PERIOD={year}-{month:02}/"
+            files += len(s3_client.list_objects_with_metadata(
+                payer_config['bucket'], prefix, parallel=config.PARALLEL_LISTING_ENABLED
+            ))
+        elapsed = time.perf_counter() - started
+    return phase_result(files, elapsed, rss)
+
+
+def run_copy(service: FargateDataCopyService, s3_client: InstrumentedS3Client, payer_ids: List[str],
+             year: int, month: int, injector: FaultInjector) -> Dict[str, Any]:
+    s3_client.copy_latencies.clear()
+    requests_before, throttled_before = injector.requests, injector.throttled
+    with PeakRssSampler() as rss:
+        started = time.perf_counter()
+        result = service.process_multiple_payers(payer_ids, year, month, STAGING_BUCKET, APP, MODULE)
+        elapsed = time.perf_counter() - started
+    summary = result.get("copy_summary", {})
+    latencies_ms = [latency * 1000 for latency in s3_client.copy_latencies]
+    return phase_result(
+        summary.get("success", 0), elapsed, rss,
+        status=result["status"], failed=summary.get("failed", 0),
+        latency_ms={"p50": _round(percentile(latencies_ms, 50)), "p99": _round(percentile(latencies_ms, 99))},
+        requests=injector.requests - requests_before, throttled_requests=injector.throttled - throttled_before
+    )
+
+
+def run_delete(s3_client: S3Client) -> Dict[str, Any]:
+    files = len(s3_client.list_objects_with_metadata(STAGING_BUCKET, f"{APP}/"))
+    with PeakRssSampler() as rss:
+        started = time.perf_counter()
+        ok = s3_client.delete_objects_by_prefix(STAGING_BUCKET, f"{APP}/")
+        elapsed = time.perf_counter() - started
+    return phase_result(files, elapsed, rss, ok=ok)
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> bool:
+    """Prints files/s per phase against a baseline. Returns False if any phase regressed beyond tolerance."""
+    ok = True
+    for phase, current in result["phases"].items():
+        previous = baseline.get("phases", {}).get(phase)
+        if not previous or not previous.get("files_per_second") or not current.get("files_per_second"):
+            continue
+        ratio = current["files_per_second"] / previous["files_per_second"]
+        regressed = ratio < 1 - tolerance
+        ok = ok and not regressed
+        print(f"{phase:>8}: {previous['files_per_second']:>10} -> {current['files_per_second']:>10} files/s "
+              f"({(ratio - 1) * 100:+.1f}%){'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 2) if value is not None else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoint-url', help="Use an already running S3 stand-in instead of starting moto.")
+    parser.add_argument('--region', default='us-east-2')
+    parser.add_argument('--payers', type=int, default=10)
+    parser.add_argument('--payers-per-bucket', type=int, default=2)
+    parser.add_argument('--hours', type=int, default=72, help="Hourly partitions per payer.")
+    parser.add_argument('--parts-per-hour', type=int, default=1)
+    parser.add_argument('--object-size', type=int, default=1024, help="Bytes per synthetic Parquet object.")
+    parser.add_argument('--year', type=int, default=2024)
+    parser.add_argument('--month', type=int, default=7)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Latency added to every S3 request.")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Fraction of requests answered with 503 SlowDown.")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--label', default='', help="Free-form label stored with the result.")
+    parser.add_argument('--output', help="Result file (default: benchmarks/results/copy-throughput-<timestamp>.json).")
+    parser.add_argument('--baseline', help="Earlier result file to compare against.")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="Allowed files/s drop before flagging a regression.")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+    moto_process = None
+    endpoint_url = args.endpoint_url
+    if not endpoint_url:
+        moto_process, endpoint_url = start_moto_server()
+    try:
+        seed_client = boto3.client('s3', region_name=args.region, endpoint_url=endpoint_url,
+                                   config=Config(max_pool_connections=SEED_WORKERS))
+        payer_configs = seed_cur_prefixes(
+            seed_client, args.payers, args.payers_per_bucket, args.hours, args.parts_per_hour,
+            args.object_size, args.year, args.month, workers=SEED_WORKERS
+        )
+        create_bucket(seed_client, STAGING_BUCKET)
+
+        injector = FaultInjector(args.latency_ms, args.throttle_rate, seed=args.seed)
+        s3_client = InstrumentedS3Client(injector, region_name=args.region, endpoint_url=endpoint_url)
+        service = FargateDataCopyService(
+            'uat', s3_client=s3_client, payer_config_manager=StaticPayerConfigs(payer_configs), snowflake_enabled=False
+        )
+
+        phases = {"listing": run_listing(s3_client, payer_configs, args.year, args.month)}
+        phases["copy"] = run_copy(service, s3_client, sorted(payer_configs), args.year, args.month, injector)
+        phases["delete"] = run_delete(s3_client)
+    finally:
+        if moto_process:
+            moto_process.terminate()
+            moto_process.wait()
+
+    result = {
+        "benchmark": "copy_throughput",
+        "label": args.label,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "parameters": {key: value for key, value in vars(args).items()
+                       if key not in ('output', 'baseline', 'tolerance', 'endpoint_url')},
+        "config": {
+            name: getattr(config, name) for name in (
+                'MAX_COPY_WORKERS', 'COPY_CONCURRENCY_CEILING', 'ADAPTIVE_CONCURRENCY_ENABLED',
+                'COPY_SCHEDULER_WINDOW', 'STREAMING_PIPELINE_ENABLED', 'PARALLEL_LISTING_ENABLED',
+                'LISTING_SHARD_WORKERS', 'DELETE_BATCH_WORKERS', 'STAGING_WRITE_MODE'
+            )
+        },
+        "phases": phases
+    }
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"copy-throughput-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(json.dumps(phases, indent=2))
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            if not compare(result, json.load(f), args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
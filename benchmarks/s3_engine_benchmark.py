@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Side-by-side copy benchmark: the threaded engine (StreamingCopyPipeline over S3Client)
+against the asyncio engine (AsyncS3Client.copy_files) on the same set of source objects.
+
+Example, against a local moto server:
+    moto_server -p 5000 &
+    AWS_ACCESS_KEY_ID=test AWS_SECRET_ACCESS_KEY=test \\
+        python benchmarks/s3_engine_benchmark.py --endpoint-url http://127.0.0.1:5000 --files 5000 --seed
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from s3_client import S3Client
+from copy_pipeline import StreamingCopyPipeline
+from async_s3_client import AsyncS3Client, AIOBOTOCORE_AVAILABLE
+from s3_stand_in import seed_cur_prefixes
+
+logger = logging.getLogger(__name__)
+
+# --seed writes one synthetic payer's billing period: SEED_HOURS hours of small Parquet parts.
+SEED_YEAR = 2024
+SEED_MONTH = 7
+SEED_HOURS = 24
+SEED_OBJECT_SIZE = 256
+
+
+def build_tasks(s3_client: S3Client, source_bucket: str, prefix: str, dest_bucket: str, dest_prefix: str):
+    objects = s3_client.list_objects_with_metadata(source_bucket, prefix)
+    return [
+        {"source_bucket": source_bucket, "source_key": key, "dest_bucket": dest_bucket,
+         "dest_key": f"{dest_prefix}{os.path.basename(key)}", "size": meta['Size']}
+        for key, meta in objects.items()
+    ]
+
+
+def run_threaded(s3_client: S3Client, tasks) -> dict:
+    pipeline = StreamingCopyPipeline(s3_client)
+    pipeline.start()
+    started = time.perf_counter()
+    try:
+        pipeline.register_payer('benchmark')
+        for task in tasks:
+            pipeline.submit('benchmark', task, block=False)
+        pipeline.finish_listing('benchmark')
+    finally:
+        summary = pipeline.close()
+    return _result('threads', summary, time.perf_counter() - started)
+
+
+def run_asyncio(async_client: AsyncS3Client, tasks) -> dict:
+    started = time.perf_counter()
+    summary = async_client.copy_files(tasks)
+    return _result('asyncio', summary, time.perf_counter() - started)
+
+
+def _result(engine: str, summary: dict, elapsed: float) -> dict:
+    return {
+        "engine": engine, "files": summary["total"], "success": summary["success"], "failed": summary["failed"],
+        "seconds": round(elapsed, 3), "files_per_second": round(summary["total"] / elapsed, 1) if elapsed else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoint-url', help="S3 endpoint, e.g. a local moto server. Defaults to AWS.")
+    parser.add_argument('--region', default='us-east-2')
+    parser.add_argument('--source-bucket', default='benchmark-source', help="Ignored with --seed.")
+    parser.add_argument('--dest-bucket', help="Defaults to the source bucket.")
+    parser.add_argument('--prefix', default='payer-bench/data/BILLING_PERIOD=2024-07/', help="Ignored with --seed.")
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--seed', action='store_true',
+                        help="Seed about --files objects for one synthetic payer and copy its billing period.")
+    args = parser.parse_args()
+
+    if not AIOBOTOCORE_AVAILABLE:
+        parser.error("aiobotocore is not installed; the asyncio engine cannot be benchmarked.")
+    logging.getLogger().setLevel(logging.WARNING)
+
+    s3_client = S3Client(region_name=args.region, endpoint_url=args.endpoint_url)
+    source_bucket, prefix = args.source_bucket, args.prefix
+    if args.seed:
+        payer_configs = seed_cur_prefixes(s3_client.s3_client, 1, 1, SEED_HOURS, -(-args.files // SEED_HOURS),
+                                          SEED_OBJECT_SIZE, SEED_YEAR, SEED_MONTH)
+        payer_config = next(iter(payer_configs.values()))
+        source_bucket = payer_config['bucket']
+        prefix = f"{payer_config['path']}/data/BILLING_PERIOD={SEED_YEAR}-{SEED_MONTH:02}/"
+    dest_bucket = args.dest_bucket or source_bucket
+
+    results = []
+    run_id = int(time.time())
+    threaded_tasks = build_tasks(s3_client, source_bucket, prefix, dest_bucket, f"bench-{run_id}/threads/")
+    results.append(run_threaded(s3_client, threaded_tasks))
+
+    async_client = AsyncS3Client(region_name=args.region, endpoint_url=args.endpoint_url)
+    try:
+        async_tasks = build_tasks(s3_client, source_bucket, prefix, dest_bucket, f"bench-{run_id}/asyncio/")
+        results.append(run_asyncio(async_client, async_tasks))
+    finally:
+        async_client.close()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Local S3 stand-in for benchmarks: a moto server subprocess, client-side fault injection
+(per-request latency and SlowDown throttling) and synthetic CUR-shaped source data.
+"""
+import os
+import sys
+import time
+import random
+import socket
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+
+from botocore.awsrequest import AWSResponse
+
+logger = logging.getLogger(__name__)
+
+_SLOWDOWN_BODY = (b'<?xml version="1.0" encoding="UTF-8"?>'
+                  b'<Error><Code>SlowDown</Code><Message>Please reduce your request rate.</Message></Error>')
+
+
+def start_moto_server(port: Optional[int] = None, timeout: float = 30.0):
+    """Starts `python -m moto.server` on a free local port. Returns (process, endpoint_url)."""
+    if port is None:
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'moto.server', '-H', '127.0.0.1', '-p', str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("moto server exited during startup; is moto[server] installed?")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"moto server did not start on port {port} within {timeout}s")
+
+
+class _StaticBody:
+    def __init__(self, body: bytes):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+class FaultInjector:
+    """
+    Adds latency to every S3 request and answers a fraction of them with 503 SlowDown
+    before they reach the server, so botocore retries and throttle detection are exercised.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, throttle_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency_ms / 1000.0
+        self.throttle_rate = throttle_rate
+        self.requests = 0
+        self.throttled = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def attach(self, client):
+        client.meta.events.register('before-send.s3', self._before_send)
+
+    def _before_send(self, request, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            throttle = self.throttle_rate and self._random.random() < self.throttle_rate
+            if throttle:
+                self.throttled += 1
+        if throttle:
+            return AWSResponse(request.url, 503, {'Content-Type': 'application/xml'}, _StaticBody(_SLOWDOWN_BODY))
+        return None
+
+
+def seed_cur_prefixes(client, payers: int, payers_per_bucket: int, hours: int, parts_per_hour: int,
+                      object_size: int, year: int, month: int, workers: int = 32) -> Dict[str, Dict[str, Any]]:
+    """
+    Writes hourly CUR-style Parquet keys for `payers` synthetic payers, several payers sharing a bucket,
+    laid out like the real exports. Returns payer_id -> payer config as used by PayerConfigManager.
+    """
+    configs = {}
+    keys = []
+    period_start = datetime(year, month, 1)
+    for index in range(payers):
+        payer_id = f"{100000000000 + index}"
+        name = f"bench-{index:03}"
+        bucket = f"bench-cur-{index // payers_per_bucket:03}"
+        path = f"{name}/cur-hourly-athena-data-export-{name}/data"
+        configs[payer_id] = {"name": name, "bucket": bucket, "path": path, "access_type": "SAME_ACCOUNT"}
+        prefix = f"{path}/data/BILLING_PERIOD={year}-{month:02}/"
+        for hour in range(hours):
+            stamp = (period_start + timedelta(hours=hour)).strftime('%Y%m%d%H')
+            for part in range(1, parts_per_hour + 1):
+                keys.append((bucket, f"{prefix}{name}-{stamp}-{part:05}.snappy.parquet"))
+
+    for bucket in sorted({config['bucket'] for config in configs.values()}):
+        create_bucket(client, bucket)
+    body = os.urandom(object_size)
+    logger.info(f"Seeding {len(keys)} objects across {payers} payers...")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda item: client.put_object(Bucket=item[0], Key=item[1], Body=body), keys))
+    return configs
+
+
+def create_bucket(client, bucket: str):
+    region = client.meta.region_name
+    create_args = {'Bucket': bucket}
+    if region != 'us-east-1':
+        create_args['CreateBucketConfiguration'] = {'LocationConstraint': region}
+    try:
+        client.create_bucket(**create_args)
+    except client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+
+
+class StaticPayerConfigs:
+    """PayerConfigManager stand-in serving the seeded payer configurations."""
+
+    def __init__(self, configs: Dict[str, Dict[str, Any]]):
+        self.configs = configs
+
+    def get_payer_config(self, payer_id: str) -> Optional[Dict[str, Any]]:
+        config = self.configs.get(payer_id)
+        return dict(config) if config else None
+
+    def get_fallback_config(self, payer_id: str) -> Optional[Dict[str, Any]]:
+        return None
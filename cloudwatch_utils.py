@@ -87,6 +87,26 @@ class CloudWatchMetrics:
         
         return success
     
+    def send_copy_concurrency_metrics(self, limits: Dict[str, int]):
+        """Send the current adaptive copy concurrency limit for each source bucket"""
+        success = True
+        for bucket, limit in limits.items():
+            success &= self.send_metric('CopyConcurrencyLimit', limit, {'SourceBucket': bucket})
+        return success
+    
+    def send_query_profile_metrics(self, sections: Dict[str, Dict[str, Any]]):
+        """Send per-section Snowflake cost metrics from a run's query profile"""
+        success = True
+        for section, totals in sections.items():
+            dimensions = {'Section': section[:255]}
+            success &= self.send_metric('SqlElapsedTime', totals['total_elapsed_time'], dimensions, 'Milliseconds')
+            success &= self.send_metric('SqlBytesScanned', totals['bytes_scanned'], dimensions, 'Bytes')
+            success &= self.send_metric('SqlPartitionsScanned', totals['partitions_scanned'], dimensions)
+            success &= self.send_metric('SqlPartitionsTotal', totals['partitions_total'], dimensions)
+            success &= self.send_metric('SqlBytesSpilled', totals['bytes_spilled_to_local_storage']
+                                        + totals['bytes_spilled_to_remote_storage'], dimensions, 'Bytes')
+        return success
+    
     def send_error_metric(self, error_type: str, error_message: str = None):
         """Send error metric"""
         dimensions = {'ErrorType': error_type}
@@ -113,6 +133,14 @@ def send_processing_metrics(files_copied: int, files_failed: int, payer_count: i
     """Send file processing metrics"""
     return cloudwatch_metrics.send_file_processing_metrics(files_copied, files_failed, payer_count)
 
+def send_copy_concurrency_metrics(limits: Dict[str, int]):
+    """Send adaptive copy concurrency limits per source bucket"""
+    return cloudwatch_metrics.send_copy_concurrency_metrics(limits)
+
+def send_query_profile_metrics(sections: Dict[str, Dict[str, Any]]):
+    """Send per-section Snowflake query profile metrics"""
+    return cloudwatch_metrics.send_query_profile_metrics(sections)
+
 def send_error_metric(error_type: str, error_message: str = None):
     """Send error metric"""
     return cloudwatch_metrics.send_error_metric(error_type, error_message)
\ No newline at end of file
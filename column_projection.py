@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Which CUR columns the analytics script reads, so that the external table and the internal load only
+carry those columns instead of every column INFER_SCHEMA finds.
+
+The script is tokenized with comments and string literals removed. Identifiers in the CUR column
+families (line_item_*, bill_*, pricing_*, product*, reservation_*, ...) are the candidates. Names the
+script defines itself are dropped: aliases (`... AS name`), INSERT column lists and UPDATE SET
+targets. The rest are the CUR columns it reads.
+
+The analysis is cached per script hash. project_columns raises if the script reads a column that is
+neither in the staged schema nor derived by the refresh, so a new reference fails the refresh loudly
+instead of failing (or silently reading NULLs) halfway through the script.
+"""
+import re
+import hashlib
+import logging
+import threading
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CUR_COLUMN_PREFIXES = ('bill_', 'line_item_', 'pricing_', 'product', 'reservation_', 'savings_plan_', 'identity_',
+                       'discount_', 'split_line_item_', 'cost_category', 'resource_tags')
+
+_COMMENT_OR_LITERAL_RE = re.compile(r"--[^\n]*|/\*.*?\*/|'(?:[^']|'')*'", re.DOTALL)
+_IDENTIFIER_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_$]*')
+_ALIAS_RE = re.compile(r'\bas\s+([A-Za-z_][A-Za-z0-9_$]*)', re.IGNORECASE)
+_INSERT_COLUMNS_RE = re.compile(r'\binsert\s+into\s+[\w$.]+\s*\(([^)]*)\)', re.IGNORECASE)
+_UPDATE_SET_RE = re.compile(r'\bupdate\s+[\w$.]+\s+set\b(.*?)(?:\bfrom\b|\bwhere\b|;|$)', re.IGNORECASE | re.DOTALL)
+_SET_TARGET_RE = re.compile(r'^\s*([A-Za-z_][A-Za-z0-9_$]*)\s*=')
+
+_cache: Dict[str, FrozenSet[str]] = {}
+_cache_lock = threading.Lock()
+
+
+def script_hash(script: str) -> str:
+    return hashlib.sha256(script.encode('utf-8')).hexdigest()
+
+
+def script_columns(script: str, cache_key: Optional[str] = None) -> FrozenSet[str]:
+    """
+    CUR columns a script reads, lowercased. cache_key defaults to the script's hash; pass the hash of
+    the unrendered script to share one analysis between renderings that only differ in placeholder values.
+    """
+    cache_key = cache_key or script_hash(script)
+    with _cache_lock:
+        cached = _cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    code = _COMMENT_OR_LITERAL_RE.sub(' ', script)
+    identifiers = {identifier.lower() for identifier in _IDENTIFIER_RE.findall(code)}
+    defined = {alias.lower() for alias in _ALIAS_RE.findall(code)}
+    for column_list in _INSERT_COLUMNS_RE.findall(code):
+        defined.update(column.strip().lower() for column in column_list.split(','))
+    for assignments in _UPDATE_SET_RE.findall(code):
+        for assignment in _split_top_level(assignments):
+            target = _SET_TARGET_RE.match(assignment)
+            if target:
+                defined.add(target.group(1).lower())
+
+    columns = frozenset(identifier for identifier in identifiers
+                        if identifier.startswith(CUR_COLUMN_PREFIXES) and identifier not in defined)
+    with _cache_lock:
+        _cache[cache_key] = columns
+    logger.info(f"Analytics script {cache_key[:12]} reads {len(columns)} CUR columns.")
+    return columns
+
+
+def _split_top_level(text: str) -> List[str]:
+    """Splits on commas outside parentheses."""
+    parts, depth, start = [], 0, 0
+    for i, char in enumerate(text):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+def project_columns(script: str, available: Iterable[str], derived: Iterable[str] = (),
+                    cache_key: Optional[str] = None) -> List[str]:
+    """
+    The available (staged) columns the script reads, sorted. Raises ValueError if the script reads columns
+    that are neither available nor derived.
+    """
+    available = {column.lower() for column in available}
+    referenced = script_columns(script, cache_key)
+    uncovered = sorted(referenced - available - {column.lower() for column in derived})
+    if uncovered:
+        raise ValueError(f"The analytics script reads columns missing from the staged schema: {uncovered}")
+    return sorted(referenced & available)
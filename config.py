@@ -18,6 +18,164 @@ DEFAULT_APP = "aws_az_analytics_application_refresh"
 DEFAULT_MODULE = "analytics"
 DEFAULT_PROCESSING_MODE = "production"
 MAX_COPY_WORKERS = 100
+MAX_ANALYSIS_WORKERS = 16
+
+# --- Parallel Listing Configuration ---
+# Large BILLING_PERIOD prefixes are listed as independent shards (sub-prefixes or
+# StartAfter key ranges cut at the digit positions of the sampled keys) paginated concurrently,
+# then merged into one key map. A range that still spans several pages is split again.
+PARALLEL_LISTING_ENABLED = os.environ.get('PARALLEL_LISTING_ENABLED', 'true').lower() == 'true'
+LISTING_SHARD_WORKERS = 16
+
+# --- Prefix Deletion ---
+# Concurrent DeleteObjects requests (1000 keys each) when clearing a destination prefix.
+DELETE_BATCH_WORKERS = 8
+
+# --- Streaming Copy Pipeline ---
+# When enabled, copies start as soon as listing pages arrive instead of after every payer
+# has been analyzed.
+STREAMING_PIPELINE_ENABLED = os.environ.get('STREAMING_PIPELINE_ENABLED', 'true').lower() == 'true'
+
+# --- S3 Engine ---
+# 'threads': boto3 client, one copy worker thread per in-flight copy (default).
+# 'asyncio': aiobotocore client on a single event loop (optional dependency); a run's copies
+#            run on ASYNC_COPY_CONCURRENCY worker coroutines that take tasks round-robin across
+#            payers, within the adaptive per-bucket limits when ADAPTIVE_CONCURRENCY_ENABLED is set.
+S3_ENGINE = os.environ.get('S3_ENGINE', 'threads').lower()
+ASYNC_COPY_CONCURRENCY = 2000
+
+# --- Adaptive Copy Concurrency ---
+# Each source bucket gets an AIMD-controlled in-flight limit: it grows while copies complete
+# cleanly and is cut by ADAPTIVE_CONCURRENCY_BACKOFF on SlowDown/503 or degraded latency.
+ADAPTIVE_CONCURRENCY_ENABLED = os.environ.get('ADAPTIVE_CONCURRENCY_ENABLED', 'true').lower() == 'true'
+ADAPTIVE_CONCURRENCY_INITIAL = MAX_COPY_WORKERS
+ADAPTIVE_CONCURRENCY_MIN = 4
+ADAPTIVE_CONCURRENCY_MAX = 400
+ADAPTIVE_CONCURRENCY_BACKOFF = 0.7
+ADAPTIVE_LATENCY_TOLERANCE = 3.0
+ADAPTIVE_METRIC_INTERVAL_SECONDS = 60
+
+# Upper bound on concurrent copies across all buckets. Sizes the copy worker pool
+# and the botocore connection pool.
+COPY_CONCURRENCY_CEILING = ADAPTIVE_CONCURRENCY_MAX if ADAPTIVE_CONCURRENCY_ENABLED else MAX_COPY_WORKERS
+
+# --- Copy Scheduler ---
+# Copies are dispatched round-robin across source buckets and payers, with at most
+# COPY_SCHEDULER_WINDOW in flight. Streaming producers block once their payer has
+# COPY_LANE_CAPACITY tasks waiting, which keeps memory flat regardless of file count.
+COPY_SCHEDULER_WINDOW = COPY_CONCURRENCY_CEILING
+COPY_LANE_CAPACITY = 500
+
+# --- Multipart Copy Configuration ---
+# Objects larger than MULTIPART_COPY_THRESHOLD are copied server-side as parallel
+# ranged UploadPartCopy requests instead of a single copy_object call.
+# copy_object is capped at 5 GB by S3, so anything above that is always multipart.
+MULTIPART_COPY_THRESHOLD = 256 * 1024 * 1024
+MULTIPART_COPY_PART_SIZE = 64 * 1024 * 1024
+MULTIPART_COPY_PART_WORKERS = 8
+
+# --- Copy Retries ---
+# Copies that still fail after botocore's own retries get a second chance once the main pass
+# drains: up to COPY_RETRY_MAX_ATTEMPTS more tries each with full-jitter exponential backoff,
+# capped at COPY_RETRY_BUDGET extra attempts per run. Only files failing after that fail their payer.
+COPY_RETRY_MAX_ATTEMPTS = 3
+COPY_RETRY_BASE_DELAY_SECONDS = 1.0
+COPY_RETRY_MAX_DELAY_SECONDS = 30.0
+COPY_RETRY_BUDGET = 500
+COPY_RETRY_WORKERS = 16
+
+# --- Copy Journal ---
+# Progress of each month's run is journaled per payer set under {app}/{module}/{env}/_journal/ in the
+# staging bucket, so a run that is stopped mid-copy resumes where it left off instead of starting over.
+# A journaled copy is only reused while its source keeps the size and ETag it was copied with.
+# Records are written in batches of JOURNAL_BATCH_SIZE, or every JOURNAL_FLUSH_INTERVAL_SECONDS.
+JOURNAL_ENABLED = os.environ.get('JOURNAL_ENABLED', 'true').lower() == 'true'
+JOURNAL_BATCH_SIZE = 1000
+JOURNAL_FLUSH_INTERVAL_SECONDS = 10
+
+# --- Parquet Compaction ---
+# Optional (needs pyarrow): after copying, the staged Parquet parts of each processed payer (and of
+# any staged payer without compacted output yet) are rewritten into files of about
+# COMPACTION_TARGET_FILE_BYTES with row groups of COMPACTION_ROW_GROUP_ROWS rows, under
+# {app}/{module}/{env}/compacted/. Each compaction writes a new gen=<id>/ prefix there (payers already
+# compacted are copied in server-side), the Snowflake stage is pointed at it once it is complete, and
+# older generations are deleted after the run succeeds; the current one is recorded under
+# {app}/{module}/{env}/_compaction/. Payers are compacted COMPACTION_WORKERS at a time.
+COMPACTION_ENABLED = os.environ.get('COMPACTION_ENABLED', 'false').lower() == 'true'
+COMPACTION_TARGET_FILE_BYTES = 256 * 1024 * 1024
+COMPACTION_ROW_GROUP_ROWS = 128 * 1024
+COMPACTION_READ_BATCH_ROWS = 16 * 1024
+COMPACTION_WORKERS = 4
+COMPACTION_OUTPUT_DIR = 'compacted'
+
+# --- Schema Inference Cache ---
+# Inferred external table columns are cached under {app}/{module}/{env}/_schema_cache/ in the
+# staging bucket, keyed on a fingerprint of the Parquet footers of up to SCHEMA_FINGERPRINT_FILES_PER_PAYER
+# files per payer: the oldest, the newest and evenly spaced ones between (needs pyarrow). A schema change
+# confined to files that are not sampled is not detected.
+SCHEMA_CACHE_ENABLED = os.environ.get('SCHEMA_CACHE_ENABLED', 'true').lower() == 'true'
+SCHEMA_CACHE_DIR = '_schema_cache'
+SCHEMA_FINGERPRINT_FILES_PER_PAYER = 4
+
+# --- Analytics SQL Execution ---
+# The analytics script is split into statements and its independent per-product chains (linked
+# by the temp tables they create and read) run concurrently, each on its own Snowflake session,
+# with at most SQL_SCRIPT_MAX_SESSIONS sessions open. Each DELETE/INSERT pair runs in one transaction.
+SQL_PARALLEL_ENABLED = os.environ.get('SQL_PARALLEL_ENABLED', 'true').lower() == 'true'
+SQL_SCRIPT_MAX_SESSIONS = 5
+
+# --- Analytics SQL Mode ---
+# 'full': every run rebuilds the whole month of ck_analytics_application_ri_wastage_hourly for its payers.
+# 'incremental': each payer's rows are rebuilt only from its watermark onward. The watermark is the
+#     payer's latest LINEITEM_USAGESTARTDATE already in the month (the earliest across its products),
+#     minus ANALYTICS_INCREMENTAL_LOOKBACK_HOURS for late CUR adjustments, clamped to the month.
+#     Payers with no rows in the month are rebuilt in full.
+ANALYTICS_SQL_MODE = os.environ.get('ANALYTICS_SQL_MODE', 'full').lower()
+ANALYTICS_INCREMENTAL_LOOKBACK_HOURS = 24
+
+# --- Analytics Load Mode ---
+# 'external': the analytics script reads the external table over the staged Parquet files.
+# 'internal': the run's payers are first loaded with one INSERT ... SELECT from the stage, sorted by
+#     payer and usage hour, into a transient internal table (only the CUR columns the script reads),
+#     and the script reads that table instead. The table is dropped after the script. If the load
+#     fails, the script falls back to the external table. Load tables older than
+#     ANALYTICS_LOAD_TABLE_STALE_HOURS, left behind by crashed runs, are dropped at the start of a run.
+ANALYTICS_LOAD_MODE = os.environ.get('ANALYTICS_LOAD_MODE', 'external').lower()
+ANALYTICS_LOAD_TABLE_STALE_HOURS = 12
+
+# --- Pipelined Snowflake Processing ---
+# Off: the table refresh and analytics run once, after every payer's copies have finished.
+# On: as soon as SNOWFLAKE_PIPELINE_GROUP_SIZE payers are fully staged, the external table is refreshed
+# for their payer-{id}/ subpaths and their analytics script is submitted with execute_async, while other
+# payers are still copying. At most SNOWFLAKE_PIPELINE_MAX_GROUPS groups run at once, each on its own
+# session, polling its query ID every SNOWFLAKE_ASYNC_POLL_SECONDS and cancelling it after
+# SNOWFLAKE_ASYNC_TIMEOUT_SECONDS. Payers with failed copies are not processed. Not used with
+# compaction, 'versioned' staging or the asyncio S3 engine, which need every copy to finish first.
+SNOWFLAKE_PIPELINE_ENABLED = os.environ.get('SNOWFLAKE_PIPELINE_ENABLED', 'false').lower() == 'true'
+SNOWFLAKE_PIPELINE_GROUP_SIZE = 10
+SNOWFLAKE_PIPELINE_MAX_GROUPS = 3
+SNOWFLAKE_ASYNC_POLL_SECONDS = 10
+SNOWFLAKE_ASYNC_TIMEOUT_SECONDS = 4 * 60 * 60
+
+# --- SQL Profiling ---
+# Every Snowflake statement of the table refresh carries a JSON QUERY_TAG (run id, payer set,
+# section, statement index). After the run, their QUERY_HISTORY statistics are written as a
+# profile report under {app}/{module}/{env}/_profiles/ in the staging bucket and sent to CloudWatch.
+SQL_PROFILE_ENABLED = os.environ.get('SQL_PROFILE_ENABLED', 'true').lower() == 'true'
+SQL_PROFILE_DIR = '_profiles'
+
+# --- Staging Write Mode ---
+# 'replace' (default): wipe each payer's destination prefix, then copy every selected file.
+# 'sync': list the destination prefix, copy only new or changed objects and delete orphans.
+#         An object is unchanged if its size matches and its ETag, or the source ETag its copy
+#         recorded in the object's metadata, matches the source's. Staging ends up identical to
+#         'replace' with far fewer requests.
+# 'versioned': copy into a fresh run={run_id}/ prefix under the month, carry every payer the run
+#         did not stage over from the run the stage points at (recorded under _runs/), point the
+#         Snowflake stage at the new prefix once copies succeed, and delete superseded run prefixes
+#         in the background, keeping the newest STAGING_RUN_RETENTION (including the current one).
+STAGING_WRITE_MODE = os.environ.get('STAGING_WRITE_MODE', 'replace').lower()
+STAGING_RUN_RETENTION = 2
 
 # --- Environment-Specific Base Configurations ---
 NON_PROD_STAGING_BUCKET = "ck-data-pipeline-stage-bucket-airflow"
@@ -64,6 +222,17 @@ SNOWFLAKE_CONFIG = {
     'config_table': 'payers_buckets_path'
 }
 
+# --- Snowflake Session Pool ---
+# Snowflake sessions are pooled per credential profile for the whole process (snowflake_session.py):
+# up to SNOWFLAKE_POOL_SIZE idle sessions per profile stay open between the config fetch, the
+# timestamp lookups and the table refresh. Sessions idle longer than
+# SNOWFLAKE_POOL_VALIDATE_AFTER_SECONDS are checked before reuse, and Secrets Manager lookups are
+# cached for SNOWFLAKE_SECRET_TTL_SECONDS.
+SNOWFLAKE_POOL_SIZE = 6
+SNOWFLAKE_POOL_VALIDATE_AFTER_SECONDS = 300
+SNOWFLAKE_KEEPALIVE_HEARTBEAT_SECONDS = 900
+SNOWFLAKE_SECRET_TTL_SECONDS = 900
+
 # --- FALLBACK Payer Configurations ---
 PAYER_CONFIGS = {
     "671238551718": {
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Durable progress journal for a month's staging run, so an interrupted run can be resumed.
+
+The journal lives in the staging bucket beside the month prefixes, outside the Snowflake stage,
+one per payer set, so runs over different payers of the same month don't resume each other:
+    {app}/{module}/{env}/_journal/year=YYYY/month=M/payers=<hash>/
+It is a set of immutable JSON-lines segments. Each segment starts with a header naming the run
+and staging mode, followed by records of completed copy tasks (destination key, source size and
+ETag) and of destinations prepared per payer. Records are buffered and written JOURNAL_BATCH_SIZE
+at a time, with a background flush every JOURNAL_FLUSH_INTERVAL_SECONDS, so journaling costs one
+PUT per batch rather than one per copy. The journal is deleted once the copy phase of a run has
+succeeded; it is not needed to redo the Snowflake processing.
+"""
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from botocore.exceptions import ClientError
+
+from config import JOURNAL_BATCH_SIZE, JOURNAL_FLUSH_INTERVAL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Payer phases recorded in the journal.
+PHASE_PREPARED = 'prepared'    # destination cleaned; on resume its journaled copies are kept and only orphans removed
+
+
+class CopyJournal:
+    """Buffered, append-only record of copy progress under s3://{bucket}/{prefix}."""
+
+    def __init__(self, s3_client, bucket: str, prefix: str, batch_size: int = JOURNAL_BATCH_SIZE,
+                 flush_interval: float = JOURNAL_FLUSH_INTERVAL_SECONDS):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.run_id: Optional[str] = None
+        self.mode: Optional[str] = None
+        self._copied: Dict[str, Dict[str, Tuple[Optional[int], Optional[str]]]] = {}
+        self._phases: Dict[str, Set[str]] = {}
+        self._buffer: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._segment_lock = threading.Lock()
+        self._session = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+        self._segment = 0
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+
+    def load(self, mode: str) -> bool:
+        """
+        Reads the segments left by an earlier, unfinished run of the month.
+        A journal written under a different staging mode cannot be resumed and is discarded.
+
+        Returns:
+            True if there is progress to resume from.
+        """
+        try:
+            segment_keys = sorted(self.s3_client.list_objects_with_metadata(self.bucket, self.prefix))
+            segments = [self.s3_client.get_object(self.bucket, key) for key in segment_keys]
+        except ClientError as e:
+            logger.warning(f"Could not read copy journal s3://{self.bucket}/{self.prefix}; starting from scratch: {e}")
+            return False
+        if not segments:
+            return False
+
+        for body in segments:
+            lines = body.decode('utf-8').splitlines()
+            if not lines:
+                continue
+            header = json.loads(lines[0])
+            if header.get('mode') != mode:
+                logger.warning(f"Copy journal s3://{self.bucket}/{self.prefix} was written in '{header.get('mode')}' "
+                               f"mode, not '{mode}'; discarding it.")
+                self._reset()
+                self.s3_client.delete_objects_by_prefix(self.bucket, self.prefix)
+                return False
+            self.run_id = header.get('run_id')
+            for line in lines[1:]:
+                self._apply(json.loads(line))
+
+        copied = sum(len(keys) for keys in self._copied.values())
+        logger.info(f"Resuming from copy journal s3://{self.bucket}/{self.prefix}: {len(segments)} segments, "
+                    f"{copied} completed copies across {len(set(self._copied) | set(self._phases))} payers.")
+        return True
+
+    def start(self, run_id: Optional[str], mode: str):
+        """Sets the header for new segments and starts the background flusher."""
+        self.run_id = run_id
+        self.mode = mode
+        self._flusher = threading.Thread(target=self._flush_periodically, name="copy-journal-flush", daemon=True)
+        self._flusher.start()
+
+    def is_copied(self, payer_id: str, task: Dict[str, Any]) -> bool:
+        """True if the task's destination was copied by the journaled run from a source of the same size and ETag."""
+        sources = self._copied.get(payer_id)
+        return (sources is not None and task.get("etag") is not None
+                and sources.get(task["dest_key"]) == (task.get("size"), task["etag"]))
+
+    def has_phase(self, payer_id: str, phase: str) -> bool:
+        return phase in self._phases.get(payer_id, ())
+
+    def record_copy(self, payer_id: str, task: Dict[str, Any]):
+        self._append({"p": payer_id, "k": task["dest_key"], "s": task.get("size"), "e": task.get("etag")})
+
+    def record_phase(self, payer_id: str, phase: str):
+        self._append({"p": payer_id, "phase": phase})
+
+    def flush(self):
+        """Writes buffered records as a new segment. On failure they stay buffered for the next flush."""
+        with self._lock:
+            records, self._buffer = self._buffer, []
+        if not records:
+            return
+        with self._segment_lock:
+            self._segment += 1
+            key = f"{self.prefix}{self._session}-{self._segment:06}.jsonl"
+        lines = [json.dumps({"run_id": self.run_id, "mode": self.mode})] + [json.dumps(record) for record in records]
+        try:
+            self.s3_client.put_object(self.bucket, key, ('\n'.join(lines) + '\n').encode('utf-8'))
+        except ClientError as e:
+            logger.warning(f"Could not write copy journal segment s3://{self.bucket}/{key}: {e}")
+            with self._lock:
+                self._buffer[:0] = records
+
+    def close(self):
+        """Stops the background flusher and writes any remaining records."""
+        self._stop.set()
+        if self._flusher:
+            self._flusher.join()
+        self.flush()
+
+    def clear(self):
+        """Deletes the journal once the run it tracks has completed."""
+        self._stop.set()
+        if self._flusher:
+            self._flusher.join()
+        with self._lock:
+            self._buffer = []
+        self._reset()
+        if not self.s3_client.delete_objects_by_prefix(self.bucket, self.prefix):
+            logger.warning(f"Could not delete copy journal s3://{self.bucket}/{self.prefix}; the next run will resume from it.")
+
+    def _append(self, record: Dict[str, Any]):
+        with self._lock:
+            self._apply(record)
+            self._buffer.append(record)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self.flush()
+
+    def _apply(self, record: Dict[str, Any]):
+        if "phase" in record:
+            self._phases.setdefault(record["p"], set()).add(record["phase"])
+        else:
+            self._copied.setdefault(record["p"], {})[record["k"]] = (record.get("s"), record.get("e"))
+
+    def _reset(self):
+        self.run_id = None
+        self._copied = {}
+        self._phases = {}
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
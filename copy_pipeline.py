@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Streaming copy pipeline: listing threads hand copy work to the fair copy scheduler as
+listing pages arrive, while per-payer progress tracks when each payer is fully staged.
+"""
+import logging
+import threading
+from collections import Counter
+from typing import Callable, Dict, Any, List, Set, Optional
+
+from config import COPY_CONCURRENCY_CEILING, ADAPTIVE_CONCURRENCY_ENABLED
+from copy_scheduler import CopyScheduler, CopyOutcome, LaneKey
+from adaptive_concurrency import AimdConcurrencyLimiter
+from copy_retry import CopyRetryQueue, FailedCopy
+
+logger = logging.getLogger(__name__)
+
+
+class PayerCopyProgress:
+    """Copy bookkeeping for one payer, used to detect completion while other payers are still listing."""
+
+    def __init__(self, payer_id: str):
+        self.payer_id = payer_id
+        self.queued = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.listing_complete = False
+        # Listing or destination cleanup failed; whatever was staged for the payer must not be processed.
+        self.analysis_failed = False
+
+    @property
+    def is_complete(self) -> bool:
+        return self.listing_complete and self.succeeded + self.failed == self.queued
+
+
+class StreamingCopyPipeline:
+    """
+    Producer/consumer copy engine.
+    Producers call submit() for each copy task and finish_listing() once a payer is fully listed;
+    the scheduler runs S3Client.copy_single_file on queued tasks and results update per-payer progress.
+    Copies that fail in the main pass are retried by a CopyRetryQueue when the pipeline closes.
+    """
+
+    def __init__(self, s3_client, copy_workers: int = COPY_CONCURRENCY_CEILING,
+                 on_copied: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                 on_payer_complete: Optional[Callable[[PayerCopyProgress], None]] = None):
+        """
+        on_copied(payer_id, task), if given, is called for every copy that succeeds, including on retry.
+        on_payer_complete(progress), if given, is called once per payer when its listing and main-pass copies are done.
+        """
+        self.s3_client = s3_client
+        self.copy_workers = copy_workers
+        self.on_copied = on_copied
+        self.on_payer_complete = on_payer_complete
+        self.progress: Dict[str, PayerCopyProgress] = {}
+        self._lanes: Dict[str, Set[LaneKey]] = {}
+        self._lock = threading.Lock()
+        self._scheduler: Optional[CopyScheduler] = None
+        self._finished_copies = 0
+        self._failed_copies: List[FailedCopy] = []
+
+    def start(self):
+        """Starts the copy scheduler and its worker pool."""
+        self._scheduler = CopyScheduler(
+            run_task=self._run_copy,
+            on_result=self._record_result,
+            workers=self.copy_workers,
+            limiter=AimdConcurrencyLimiter() if ADAPTIVE_CONCURRENCY_ENABLED else None
+        )
+
+    def register_payer(self, payer_id: str) -> PayerCopyProgress:
+        with self._lock:
+            self._lanes.setdefault(payer_id, set())
+            return self.progress.setdefault(payer_id, PayerCopyProgress(payer_id))
+
+    def submit(self, payer_id: str, task: Dict[str, Any], block: bool = True):
+        """
+        Queues one copy task on the payer's lane. With block=True, waits while the lane is full,
+        which throttles listing to copy speed.
+        """
+        lane_key = (task["source_bucket"], payer_id)
+        with self._lock:
+            self.progress[payer_id].queued += 1
+            self._lanes[payer_id].add(lane_key)
+        self._scheduler.put(lane_key, task, block=block)
+
+    def record_skipped(self, payer_id: str, count: int = 1):
+        with self._lock:
+            self.progress[payer_id].skipped += count
+
+    def mark_failed(self, payer_id: str):
+        """Records that the payer's listing failed; call before finish_listing()."""
+        with self._lock:
+            self.progress[payer_id].analysis_failed = True
+
+    def finish_listing(self, payer_id: str):
+        """Marks a payer as fully listed; it is complete once its queued copies have finished."""
+        with self._lock:
+            progress = self.progress[payer_id]
+            progress.listing_complete = True
+            completed = progress.is_complete
+            lane_keys = list(self._lanes[payer_id])
+        for lane_key in lane_keys:
+            self._scheduler.close_lane(lane_key)
+        if completed:
+            self._on_payer_complete(progress)
+
+    def close(self) -> Dict[str, int]:
+        """
+        Waits for every queued copy to finish, stops the scheduler, retries failed copies
+        and returns the aggregated copy summary.
+        """
+        self._scheduler.close()
+        self._retry_failed_copies()
+        return self.summary()
+
+    def failed_payers(self) -> List[str]:
+        """Payers with copies that are still failing."""
+        with self._lock:
+            return sorted(payer_id for payer_id, progress in self.progress.items() if progress.failed)
+
+    def summary(self) -> Dict[str, int]:
+        with self._lock:
+            summary = {"success": 0, "failed": 0, "total": 0, "skipped": 0}
+            for progress in self.progress.values():
+                summary["success"] += progress.succeeded
+                summary["failed"] += progress.failed
+                summary["total"] += progress.queued
+                summary["skipped"] += progress.skipped
+        return summary
+
+    def _run_copy(self, task: Dict[str, Any]) -> CopyOutcome:
+        self.s3_client.pop_throttle_count()
+        ok = self.s3_client.copy_single_file(**task)
+        return CopyOutcome(ok=ok, throttled=self.s3_client.pop_throttle_count() > 0)
+
+    def _record_result(self, lane_key: LaneKey, task: Dict[str, Any], outcome: CopyOutcome):
+        payer_id = lane_key[1]
+        with self._lock:
+            progress = self.progress[payer_id]
+            if outcome.ok:
+                progress.succeeded += 1
+            else:
+                progress.failed += 1
+                self._failed_copies.append((payer_id, task))
+            self._finished_copies += 1
+            finished = self._finished_copies
+            completed = progress.is_complete
+        if outcome.ok and self.on_copied:
+            self.on_copied(payer_id, task)
+        if finished % 250 == 0:
+            summary = self.summary()
+            logger.info(f"Copy progress: {finished}/{summary['total']} | Success: {summary['success']}, Failed: {summary['failed']}")
+        if completed:
+            self._on_payer_complete(progress)
+
+    def _retry_failed_copies(self):
+        if not self._failed_copies:
+            return
+        failed = self._failed_copies
+        still_failing = CopyRetryQueue(lambda task: self.s3_client.copy_single_file(**task)).run(failed)
+        remaining = Counter(payer_id for payer_id, _ in still_failing)
+        with self._lock:
+            for payer_id, failed_count in Counter(payer_id for payer_id, _ in failed).items():
+                recovered = failed_count - remaining[payer_id]
+                self.progress[payer_id].failed -= recovered
+                self.progress[payer_id].succeeded += recovered
+            self._failed_copies = still_failing
+        if self.on_copied:
+            still_failing_ids = {id(task) for _, task in still_failing}
+            for payer_id, task in failed:
+                if id(task) not in still_failing_ids:
+                    self.on_copied(payer_id, task)
+
+    def _on_payer_complete(self, progress: PayerCopyProgress):
+        logger.info(f"Payer {progress.payer_id} copy complete: {progress.succeeded} copied, "
+                    f"{progress.failed} failed, {progress.skipped} already staged.")
+        if self.on_payer_complete:
+            self.on_payer_complete(progress)
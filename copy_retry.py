@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Second-chance retries for copies that failed in the main pass.
+Once the main pass has drained, failed copies are re-attempted with full-jitter exponential
+backoff, within a per-run budget of extra attempts, so a transient blip does not fail the run.
+"""
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+from config import (COPY_RETRY_MAX_ATTEMPTS, COPY_RETRY_BASE_DELAY_SECONDS, COPY_RETRY_MAX_DELAY_SECONDS,
+                    COPY_RETRY_BUDGET, COPY_RETRY_WORKERS)
+
+logger = logging.getLogger(__name__)
+
+FailedCopy = Tuple[str, Dict[str, Any]]
+
+
+class CopyRetryQueue:
+    """Retries failed (payer_id, task) copies; copy_fn(task) returns True on success."""
+
+    def __init__(self, copy_fn: Callable[[Dict[str, Any]], bool], max_attempts: int = COPY_RETRY_MAX_ATTEMPTS,
+                 base_delay: float = COPY_RETRY_BASE_DELAY_SECONDS, max_delay: float = COPY_RETRY_MAX_DELAY_SECONDS,
+                 budget: int = COPY_RETRY_BUDGET, workers: int = COPY_RETRY_WORKERS):
+        self._copy_fn = copy_fn
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.workers = workers
+        self.attempts_used = 0
+        self._lock = threading.Lock()
+
+    def run(self, failed: List[FailedCopy]) -> List[FailedCopy]:
+        """Retries every failed copy and returns the ones that are still failing."""
+        if not failed or self.max_attempts <= 0:
+            return list(failed)
+        logger.info(f"Retrying {len(failed)} failed copies (up to {self.max_attempts} attempts each, "
+                    f"budget {self.budget - self.attempts_used} attempts)...")
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(failed)), thread_name_prefix="copy-retry") as executor:
+            results = list(executor.map(lambda item: self._retry(item[1]), failed))
+        still_failing = [item for item, ok in zip(failed, results) if not ok]
+        logger.info(f"Copy retries recovered {len(failed) - len(still_failing)} of {len(failed)} files "
+                    f"using {self.attempts_used} retry attempts.")
+        for payer_id, task in still_failing:
+            logger.error(f"Copy still failing after retries for payer {payer_id}: s3://{task['source_bucket']}/{task['source_key']}")
+        return still_failing
+
+    def _retry(self, task: Dict[str, Any]) -> bool:
+        for attempt in range(self.max_attempts):
+            if not self._take_attempt():
+                logger.warning(f"Copy retry budget exhausted; not retrying {task['source_key']}")
+                return False
+            # Full jitter: spreads retries out so they do not hit a recovering bucket in lockstep.
+            time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+            if self._copy_fn(task):
+                return True
+        return False
+
+    def _take_attempt(self) -> bool:
+        with self._lock:
+            if self.attempts_used >= self.budget:
+                return False
+            self.attempts_used += 1
+            return True
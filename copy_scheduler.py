@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Bounded, fair copy scheduler.
+Copy tasks are queued in lanes (one per source bucket and payer) and dispatched to a
+thread pool round-robin, first across source buckets and then across the payers of a
+bucket, while never keeping more than a fixed window of copies in flight. With an
+adaptive limiter, each source bucket is additionally held to its own in-flight limit.
+"""
+import time
+import logging
+import threading
+from collections import deque, OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Hashable, Optional, Tuple
+
+from config import (COPY_CONCURRENCY_CEILING, COPY_SCHEDULER_WINDOW, COPY_LANE_CAPACITY,
+                    ADAPTIVE_METRIC_INTERVAL_SECONDS)
+from adaptive_concurrency import AimdConcurrencyLimiter
+from cloudwatch_utils import send_copy_concurrency_metrics
+
+logger = logging.getLogger(__name__)
+
+LaneKey = Tuple[str, Hashable]
+
+# What a copy task reports back: whether it succeeded and whether S3 throttled it along the way.
+CopyOutcome = namedtuple('CopyOutcome', ['ok', 'throttled'])
+
+
+class _Lane:
+    """Pending tasks for one (source_bucket, payer) pair."""
+
+    def __init__(self):
+        self.tasks: Deque[Dict[str, Any]] = deque()
+        self.closed = False
+
+
+class CopyScheduler:
+    """
+    Dispatches copy tasks with a bounded in-flight window and round-robin lane fairness.
+
+    Producers call put() (blocking while their lane is at capacity) and close_lane() once a
+    lane will receive no more tasks. run_task is called on a worker thread for each task and
+    returns a CopyOutcome; on_result receives (lane_key, task, outcome) when it finishes.
+    When a limiter is given, its latency/throttle feedback sets each source bucket's in-flight limit.
+    """
+
+    def __init__(self, run_task: Callable[[Dict[str, Any]], CopyOutcome],
+                 on_result: Callable[[LaneKey, Dict[str, Any], CopyOutcome], None],
+                 workers: int = COPY_CONCURRENCY_CEILING, window: int = COPY_SCHEDULER_WINDOW,
+                 lane_capacity: int = COPY_LANE_CAPACITY, limiter: Optional[AimdConcurrencyLimiter] = None):
+        self._run_task = run_task
+        self._on_result = on_result
+        self._window = max(window, 1)
+        self._lane_capacity = lane_capacity
+        self._limiter = limiter
+        self._bucket_in_flight: Dict[str, int] = {}
+        self._last_metric_publish = time.monotonic()
+        # bucket -> OrderedDict(lane_key -> _Lane); both levels rotate to give round-robin order.
+        self._buckets: "OrderedDict[str, OrderedDict[LaneKey, _Lane]]" = OrderedDict()
+        self._in_flight = 0
+        self._closing = False
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="copy-worker")
+        # CloudWatch calls run here, off the dispatcher thread.
+        self._metrics_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="copy-metrics")
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="copy-dispatcher", daemon=True)
+        self._dispatcher.start()
+        logger.info(f"Copy scheduler started with {workers} workers and an in-flight window of {self._window}.")
+
+    def put(self, lane_key: LaneKey, task: Dict[str, Any], block: bool = True):
+        """Queues a task on a lane. With block=True, waits while the lane is at capacity."""
+        with self._cond:
+            lane = self._lane(lane_key)
+            while block and len(lane.tasks) >= self._lane_capacity:
+                self._cond.wait()
+            lane.tasks.append(task)
+            self._cond.notify_all()
+
+    def close_lane(self, lane_key: LaneKey):
+        """Marks a lane as complete; it is dropped once its queued tasks have been dispatched."""
+        with self._cond:
+            self._lane(lane_key).closed = True
+            self._cond.notify_all()
+
+    def close(self):
+        """Waits until every lane is closed and drained and all copies have finished, then stops the pool."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._dispatcher.join()
+        self._executor.shutdown(wait=True)
+        self._publish_limits()
+        self._metrics_executor.shutdown(wait=True)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _lane(self, lane_key: LaneKey) -> _Lane:
+        bucket = lane_key[0]
+        lanes = self._buckets.setdefault(bucket, OrderedDict())
+        if lane_key not in lanes:
+            lanes[lane_key] = _Lane()
+        return lanes[lane_key]
+
+    def _next_task(self) -> Optional[Tuple[LaneKey, Dict[str, Any]]]:
+        """Pops the next task in round-robin order, pruning lanes that are closed and empty."""
+        for bucket in list(self._buckets):
+            lanes = self._buckets[bucket]
+            if self._limiter and self._bucket_in_flight.get(bucket, 0) >= self._limiter.limit(bucket):
+                continue
+            for lane_key in list(lanes):
+                lane = lanes[lane_key]
+                if not lane.tasks:
+                    if lane.closed:
+                        del lanes[lane_key]
+                    continue
+                task = lane.tasks.popleft()
+                lanes.move_to_end(lane_key)
+                self._buckets.move_to_end(bucket)
+                return lane_key, task
+            if not lanes:
+                del self._buckets[bucket]
+        return None
+
+    def _is_finished(self) -> bool:
+        return self._closing and self._in_flight == 0 and all(
+            lane.closed and not lane.tasks for lanes in self._buckets.values() for lane in lanes.values()
+        )
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._is_finished():
+                        return
+                    next_item = self._next_task() if self._in_flight < self._window else None
+                    if next_item:
+                        break
+                    self._cond.wait()
+                self._in_flight += 1
+                bucket = next_item[0][0]
+                self._bucket_in_flight[bucket] = self._bucket_in_flight.get(bucket, 0) + 1
+                # A lane just shrank, so a producer blocked on capacity may continue.
+                self._cond.notify_all()
+            lane_key, task = next_item
+            self._executor.submit(self._execute, lane_key, task)
+            if time.monotonic() - self._last_metric_publish >= ADAPTIVE_METRIC_INTERVAL_SECONDS:
+                self._publish_limits()
+
+    def _execute(self, lane_key: LaneKey, task: Dict[str, Any]):
+        bucket = lane_key[0]
+        started = time.monotonic()
+        try:
+            outcome = self._run_task(task)
+        except Exception as e:
+            logger.error(f"Copy task failed unexpectedly for {task.get('source_key')}: {e}", exc_info=True)
+            outcome = CopyOutcome(ok=False, throttled=False)
+        if self._limiter:
+            self._limiter.record(bucket, time.monotonic() - started, outcome.throttled, size=task.get('size'),
+                                 ok=outcome.ok)
+        try:
+            self._on_result(lane_key, task, outcome)
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._bucket_in_flight[bucket] -= 1
+                self._cond.notify_all()
+
+    def _publish_limits(self):
+        """Logs each source bucket's current adaptive concurrency limit and publishes it in the background."""
+        self._last_metric_publish = time.monotonic()
+        if not self._limiter:
+            return
+        limits = self._limiter.snapshot()
+        if limits:
+            logger.info(f"Adaptive copy concurrency limits: {limits}")
+            self._metrics_executor.submit(send_copy_concurrency_metrics, limits)
@@ -1,16 +1,31 @@
 
 import os
+import hashlib
 import logging
-from typing import List, Dict, Any, Tuple, Optional
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+from typing import List, Dict, Any, Tuple, Optional, Iterator, Set
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
 from datetime import datetime, timezone
 
-from s3_client import S3Client, PayerConfigManager
-from config import get_environment_config, MAX_COPY_WORKERS
+from s3_client import S3Client, PayerConfigManager, SOURCE_ETAG_METADATA_KEY
+from copy_pipeline import StreamingCopyPipeline
+from adaptive_concurrency import AimdConcurrencyLimiter
+from copy_retry import CopyRetryQueue
+from copy_journal import CopyJournal, PHASE_PREPARED
+from parquet_compactor import ParquetCompactor, PYARROW_AVAILABLE
+from schema_cache import SchemaCache
+from query_profiler import QueryProfiler
+from async_s3_client import AsyncS3Client, AIOBOTOCORE_AVAILABLE
+from config import (get_environment_config, COPY_CONCURRENCY_CEILING, MAX_ANALYSIS_WORKERS, STAGING_WRITE_MODE,
+                    PARALLEL_LISTING_ENABLED, STREAMING_PIPELINE_ENABLED, S3_ENGINE, ASYNC_COPY_CONCURRENCY,
+                    STAGING_RUN_RETENTION, JOURNAL_ENABLED, COMPACTION_ENABLED, COMPACTION_OUTPUT_DIR,
+                    SCHEMA_CACHE_ENABLED, SCHEMA_CACHE_DIR, SQL_PROFILE_ENABLED, SQL_PROFILE_DIR,
+                    SNOWFLAKE_PIPELINE_ENABLED, ADAPTIVE_CONCURRENCY_ENABLED)
 
 try:
     from snowflake_external_table import create_external_table_and_process, SnowflakeExternalTableManager
+    from snowflake_pipeline import PipelinedSnowflakeProcessor
     SNOWFLAKE_AVAILABLE = True
 except ImportError:
     SNOWFLAKE_AVAILABLE = False
@@ -25,20 +40,50 @@ class FargateDataCopyService:
     downstream processing in Snowflake.
     """
 
-    def __init__(self, environment: str = 'uat'):
+    def __init__(self, environment: str = 'uat', s3_client=None, payer_config_manager=None,
+                 snowflake_enabled: bool = True):
+        """
+        s3_client and payer_config_manager default to ones built for the environment; passing them in
+        (and snowflake_enabled=False) lets the service run against other S3 endpoints, e.g. in benchmarks.
+        """
         self.environment = environment
         self.env_config = get_environment_config(environment)
         s3_region = self.env_config.get('s3_region')
         
-        self.s3_client = S3Client(region_name=s3_region)
-        self.payer_config_manager = PayerConfigManager(self.environment)
+        if s3_client is None:
+            if S3_ENGINE == 'asyncio' and not AIOBOTOCORE_AVAILABLE:
+                logger.warning("S3_ENGINE is 'asyncio' but aiobotocore is not installed; using the threaded S3 engine.")
+            use_async = S3_ENGINE == 'asyncio' and AIOBOTOCORE_AVAILABLE
+            s3_client = AsyncS3Client(region_name=s3_region) if use_async else S3Client(region_name=s3_region)
+            # The service built the client, so it closes it when the run ends (the asyncio engine holds an event loop).
+            self._owns_s3_client = True
+        else:
+            self._owns_s3_client = False
+        self.s3_client = s3_client
+        self.async_engine = isinstance(s3_client, AsyncS3Client)
+        self.payer_config_manager = payer_config_manager or PayerConfigManager(self.environment)
+        self.run_id = None
+        # Payers whose copies were still failing after the retry pass in the current run.
+        self.copy_failed_payers: List[str] = []
+        # Payers that failed before their copies were queued (source resolution, listing, cleanup).
+        self.analysis_failed_payers: List[str] = []
+        self.journal: Optional[CopyJournal] = None
         
-        if SNOWFLAKE_AVAILABLE:
+        self.snowflake_enabled = snowflake_enabled and SNOWFLAKE_AVAILABLE
+        if self.snowflake_enabled:
             self.snowflake_manager = SnowflakeExternalTableManager(self.environment, 'analytics')
         else:
             self.snowflake_manager = None
             
-        logger.info(f"FargateDataCopyService initialized for env: '{environment}' with {MAX_COPY_WORKERS} workers.")
+        if self.snowflake_enabled and SCHEMA_CACHE_ENABLED and not PYARROW_AVAILABLE:
+            logger.warning("SCHEMA_CACHE_ENABLED is set but pyarrow is not installed; staged schemas cannot be "
+                           "fingerprinted, so INFER_SCHEMA will run on every run.")
+
+        if self.async_engine:
+            logger.info(f"FargateDataCopyService initialized for env: '{environment}' with the asyncio S3 engine "
+                        f"(up to {ASYNC_COPY_CONCURRENCY} concurrent copies).")
+        else:
+            logger.info(f"FargateDataCopyService initialized for env: '{environment}' with up to {COPY_CONCURRENCY_CEILING} copy workers.")
 
     def process_multiple_payers(self, payer_ids: List[str], year: int, month: int,
                                staging_bucket: str, app: str, module: str) -> Dict[str, Any]:
@@ -50,7 +95,44 @@ class FargateDataCopyService:
             A dictionary summarizing the final status of the operation.
         """
         logger.info(f"Starting analysis for {len(payer_ids)} payers for {year}-{month:02}.")
-        
+        self.run_id = None
+        self.copy_failed_payers = []
+        self.analysis_failed_payers = []
+        self.journal = None
+        self.snowflake_processor = None
+        if JOURNAL_ENABLED:
+            self.journal = CopyJournal(self.s3_client, staging_bucket,
+                                       self._journal_prefix(app, module, year, month, payer_ids))
+            self.journal.load(STAGING_WRITE_MODE)
+        if STAGING_WRITE_MODE == 'versioned':
+            # A resumed run keeps writing to the interrupted run's prefix. New run ids are
+            # sortable, so the newest run prefixes are the last ones in listing order.
+            self.run_id = (self.journal and self.journal.run_id) or datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+            logger.info(f"Staging into run prefix: {self._run_prefix(app, module, year, month)}")
+        if self.journal:
+            self.journal.start(self.run_id, STAGING_WRITE_MODE)
+
+        result = None
+        try:
+            result = self._process_payers(payer_ids, year, month, staging_bucket, app, module)
+            return result
+        finally:
+            if self.journal:
+                # A run that needed no copies leaves nothing to resume; anything else keeps its journal for the
+                # next run unless _copy_phase_finished already removed it.
+                if result and result["status"] in ("SUCCESS", "UP_TO_DATE"):
+                    self.journal.clear()
+                else:
+                    self.journal.close()
+            if self.snowflake_processor:
+                # Listing, analysis or copying raised before the pipelined groups were finished.
+                self.snowflake_processor.cancel()
+            if self.async_engine and self._owns_s3_client:
+                self.s3_client.close()
+
+    def _process_payers(self, payer_ids: List[str], year: int, month: int,
+                        staging_bucket: str, app: str, module: str) -> Dict[str, Any]:
+        """Analyzes, copies and processes the payers of one run; see process_multiple_payers."""
         all_payer_metadata = []
         failed_payers = []
 
@@ -61,12 +143,35 @@ class FargateDataCopyService:
                 logger.error(f"Cannot connect to Snowflake for timestamps; will process all files. Error: {e}")
                 self.snowflake_manager = None
         
-        for payer_id in payer_ids:
-            status, result = self._analyze_single_payer(payer_id, year, month)
+        # Analysis is I/O bound (head_bucket, Snowflake timestamp lookup, S3 listing), so payers are
+        # analyzed concurrently. executor.map keeps results in input order.
+        analysis_workers = max(1, min(MAX_ANALYSIS_WORKERS, len(payer_ids)))
+        streamed_summary = snowflake_pipeline = None
+        with ThreadPoolExecutor(max_workers=analysis_workers) as executor:
+            # The asyncio engine copies each run as one batch of coroutines, so it always takes the phased path.
+            if STREAMING_PIPELINE_ENABLED and not self.async_engine:
+                # Listing feeds the copy workers directly, so copies start while other payers are still listed.
+                snowflake_pipeline = self._snowflake_pipeline(payer_ids, staging_bucket, app, module, year, month)
+                pipeline = StreamingCopyPipeline(self.s3_client, on_copied=self.journal.record_copy if self.journal else None,
+                                                 on_payer_complete=snowflake_pipeline.payer_staged if snowflake_pipeline else None)
+                pipeline.start()
+                try:
+                    analysis_results = list(executor.map(
+                        lambda p: self._stream_single_payer(pipeline, p, year, month, staging_bucket, app, module),
+                        payer_ids
+                    ))
+                finally:
+                    streamed_summary = pipeline.close()
+                    self.copy_failed_payers = pipeline.failed_payers()
+            else:
+                analysis_results = list(executor.map(lambda p: self._analyze_single_payer(p, year, month), payer_ids))
+
+        for payer_id, (status, result) in zip(payer_ids, analysis_results):
             if status == 'HAS_NEW_FILES':
                 all_payer_metadata.append(result)
             elif status == 'FAILED':
                 failed_payers.append(payer_id)
+        self.analysis_failed_payers = list(failed_payers)
         
         if self.snowflake_manager:
             self.snowflake_manager.close_connection()
@@ -79,10 +184,24 @@ class FargateDataCopyService:
             logger.error("\nFAILURE: All payers failed during analysis phase.")
             return {"status": "FAILED", "copy_summary": {"success": 0, "failed": 0, "total": 0}, "failed_payers": failed_payers}
 
-        copy_summary = self._execute_copy_and_snowflake_process(
-            all_payer_metadata, staging_bucket, app, module, year, month
-        )
+        if streamed_summary is not None:
+            self._log_copy_summary(streamed_summary)
+            self._copy_phase_finished(streamed_summary)
+            if snowflake_pipeline:
+                copy_summary = self._finish_snowflake_pipeline(
+                    snowflake_pipeline, streamed_summary, [p['payer_id'] for p in all_payer_metadata],
+                    staging_bucket, app, module, year, month
+                )
+            else:
+                copy_summary = self._run_snowflake_process(
+                    streamed_summary, [p['payer_id'] for p in all_payer_metadata], staging_bucket, app, module, year, month
+                )
+        else:
+            copy_summary = self._execute_copy_and_snowflake_process(
+                all_payer_metadata, staging_bucket, app, module, year, month
+            )
 
+        failed_payers += [p for p in self.copy_failed_payers + self.analysis_failed_payers if p not in failed_payers]
         overall_success = (copy_summary["failed"] == 0 and not failed_payers)
         return {
             "status": "SUCCESS" if overall_success else "FAILED",
@@ -100,54 +219,26 @@ class FargateDataCopyService:
         """
         logger.info(f"\n--- Analyzing Payer: {payer_id} ---")
         try:
-            config = self.payer_config_manager.get_payer_config(payer_id)
-            if not config:
-                logger.error(f"Skipping payer {payer_id}: no configuration found.")
+            source = self._resolve_payer_source(payer_id, year, month)
+            if not source:
                 return 'FAILED', None
-
-            source_bucket = config.get('bucket')
-            if not self.s3_client.can_access_bucket(source_bucket):
-                logger.warning(f"Access denied for bucket '{source_bucket}' from primary config for payer {payer_id}.")
-                config = self.payer_config_manager.get_fallback_config(payer_id)
-                if not config:
-                    logger.error(f"Skipping payer {payer_id}: access denied and no fallback available.")
-                    return 'FAILED', None
-                source_bucket = config.get('bucket')
-
-            source_path_base = config.get('path')
-            
-            last_processed_ts = None
-            if self.snowflake_manager:
-                last_processed_ts = self.snowflake_manager.get_last_processed_timestamp(payer_id)
-                if last_processed_ts:
-                    last_processed_ts = last_processed_ts.replace(tzinfo=timezone.utc)
-
-            # --- START OF MODIFICATION ---
-            # This logic now ONLY scans the specified month. The previous month's
-            # logic has been removed to prevent picking up late-arriving data.
-            prefixes_to_scan = []
-            current_month_prefix = f"{source_path_base.rstrip('/')}/data/BILLING_PERIOD={year}-{month:02}/"
-            prefixes_to_scan.append(current_month_prefix)
-
-            # The following lines have been removed:
-            # prev_month = month - 1 if month > 1 else 12
-            # prev_year = year if month > 1 else year - 1
-            # prev_month_prefix = f"{source_path_base.rstrip('/')}/data/BILLING_PERIOD={prev_year}-{prev_month:02}/"
-            # prefixes_to_scan.append(prev_month_prefix)
-            # --- END OF MODIFICATION ---
-            
-            logger.info(f"Scanning S3 prefixes: {prefixes_to_scan}")
+            source_bucket, prefixes_to_scan, last_processed_ts = source
 
             files_to_copy_list = []
+            file_metadata = {}
             for prefix in prefixes_to_scan:
-                found_files = self.s3_client.list_objects_with_metadata(source_bucket, prefix, since=last_processed_ts)
+                found_files = self.s3_client.list_objects_with_metadata(
+                    source_bucket, prefix, since=last_processed_ts, parallel=PARALLEL_LISTING_ENABLED
+                )
                 files_to_copy_list.extend(found_files.keys())
+                file_metadata.update(found_files)
             
             if files_to_copy_list:
                 logger.info(f"   Found {len(files_to_copy_list)} new files to process.")
                 metadata = {
                     "payer_id": payer_id,
                     "files_to_copy": files_to_copy_list,
+                    "file_metadata": file_metadata,
                     "source_bucket": source_bucket
                 }
                 return 'HAS_NEW_FILES', metadata
@@ -159,78 +250,773 @@ class FargateDataCopyService:
             logger.error(f"An unexpected error occurred analyzing files for payer {payer_id}: {e}", exc_info=True)
             return 'FAILED', None
             
+    def _stream_single_payer(self, pipeline: StreamingCopyPipeline, payer_id: str, year: int, month: int,
+                             staging_bucket: str, app: str, module: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        Streaming counterpart of _analyze_single_payer: each listing page is turned into copy tasks
+        and handed to the pipeline straight away. The destination is only cleaned (or synced) once
+        the first new file is seen, so up-to-date payers are left untouched.
+
+        Returns:
+            The same (status, metadata) tuple as _analyze_single_payer, without the file lists.
+        """
+        logger.info(f"\n--- Analyzing Payer: {payer_id} ---")
+        pipeline.register_payer(payer_id)
+        listed = False
+        try:
+            source = self._resolve_payer_source(payer_id, year, month)
+            if not source:
+                return 'FAILED', None
+            source_bucket, prefixes_to_scan, last_processed_ts = source
+            dest_prefix = self._dest_prefix(app, module, year, month, payer_id)
+
+            existing = None
+            staged_keys = set()
+            files_found = 0
+            for prefix in prefixes_to_scan:
+                pages = self.s3_client.iter_objects_with_metadata(
+                    source_bucket, prefix, since=last_processed_ts, parallel=PARALLEL_LISTING_ENABLED
+                )
+                for page_objects in pages:
+                    if existing is None:
+                        existing = self._prepare_destination(payer_id, staging_bucket, dest_prefix)
+                        if existing is None:
+                            return 'FAILED', None
+                    page_tasks = [self._build_copy_task(source_bucket, source_key, source_meta, staging_bucket, dest_prefix)
+                                  for source_key, source_meta in page_objects.items()]
+                    unchanged = self._unchanged_dest_keys(staging_bucket, page_tasks, page_objects, existing)
+                    for task in page_tasks:
+                        files_found += 1
+                        staged_keys.add(task["dest_key"])
+                        if (task["dest_key"] in unchanged
+                                or (self.journal and self.journal.is_copied(payer_id, task))):
+                            pipeline.record_skipped(payer_id)
+                        else:
+                            pipeline.submit(payer_id, task)
+
+            if not files_found:
+                logger.info(f"   All files for payer {payer_id} are already up-to-date.")
+                listed = True
+                return 'UP_TO_DATE', None
+
+            orphans = [key for key in existing if key not in staged_keys]
+            if orphans:
+                logger.info(f"Deleting {len(orphans)} orphaned objects under s3://{staging_bucket}/{dest_prefix}")
+                if not self.s3_client.delete_objects(staging_bucket, orphans):
+                    return 'FAILED', None
+
+            logger.info(f"   Found {files_found} new files to process for payer {payer_id}.")
+            listed = True
+            return 'HAS_NEW_FILES', {"payer_id": payer_id, "source_bucket": source_bucket}
+
+        except Exception as e:
+            logger.error(f"An unexpected error occurred analyzing files for payer {payer_id}: {e}", exc_info=True)
+            return 'FAILED', None
+        finally:
+            if not listed:
+                # Its staging prefix may be partial or stale, so it must not reach Snowflake processing.
+                pipeline.mark_failed(payer_id)
+            pipeline.finish_listing(payer_id)
+
+    def _prepare_destination(self, payer_id: str, staging_bucket: str, dest_prefix: str) -> Optional[Dict[str, Dict[str, Any]]]:
+        """
+        Readies a payer's destination prefix for streaming copies according to STAGING_WRITE_MODE.
+
+        Returns:
+            The objects already staged that may be kept (in 'replace' mode, only on resume), or None on failure.
+        """
+        if STAGING_WRITE_MODE == 'sync':
+            try:
+                return self.s3_client.list_objects_with_metadata(staging_bucket, dest_prefix)
+            except ClientError as e:
+                logger.error(f"Could not list destination s3://{staging_bucket}/{dest_prefix} for sync: {e}")
+                return None
+        if STAGING_WRITE_MODE == 'versioned':
+            # The run prefix is new, so there is nothing to clean or keep.
+            return {}
+
+        existing = self._clean_destination(payer_id, staging_bucket, dest_prefix)
+        if existing is None:
+            logger.error(f"Halting process for payer {payer_id} due to failure in cleaning destination.")
+        return existing
+
+    def _clean_destination(self, payer_id: str, staging_bucket: str,
+                           dest_prefix: str) -> Optional[Dict[str, Dict[str, Any]]]:
+        """
+        Wipes a payer's destination prefix for 'replace' mode. A destination already cleaned by an
+        interrupted run is not wiped again, since it now holds that run's journaled copies; it is
+        listed instead, so that the caller can delete the objects the new listing no longer has.
+
+        Returns:
+            The objects kept (empty after a wipe), or None on failure.
+        """
+        if self.journal and self.journal.has_phase(payer_id, PHASE_PREPARED):
+            logger.info(f"Destination for payer {payer_id} was cleaned by the interrupted run; keeping its copies.")
+            try:
+                return self.s3_client.list_objects_with_metadata(staging_bucket, dest_prefix)
+            except ClientError as e:
+                logger.error(f"Could not list destination s3://{staging_bucket}/{dest_prefix}: {e}")
+                return None
+        logger.info(f"Cleaning destination for payer {payer_id} before copy...")
+        if not self.s3_client.delete_objects_by_prefix(staging_bucket, dest_prefix):
+            return None
+        if self.journal:
+            self.journal.record_phase(payer_id, PHASE_PREPARED)
+        return {}
+
+    def _resolve_payer_source(self, payer_id: str, year: int,
+                              month: int) -> Optional[Tuple[str, List[str], Optional[datetime]]]:
+        """
+        Resolves where a payer's data lives and what counts as new.
+
+        Returns:
+            A tuple of (source_bucket, prefixes_to_scan, last_processed_ts),
+            or None if the payer has no usable configuration.
+        """
+        config = self.payer_config_manager.get_payer_config(payer_id)
+        if not config:
+            logger.error(f"Skipping payer {payer_id}: no configuration found.")
+            return None
+
+        source_bucket = config.get('bucket')
+        if not self.s3_client.can_access_bucket(source_bucket):
+            logger.warning(f"Access denied for bucket '{source_bucket}' from primary config for payer {payer_id}.")
+            config = self.payer_config_manager.get_fallback_config(payer_id)
+            if not config:
+                logger.error(f"Skipping payer {payer_id}: access denied and no fallback available.")
+                return None
+            source_bucket = config.get('bucket')
+
+        source_path_base = config.get('path')
+
+        last_processed_ts = None
+        if self.snowflake_manager:
+            last_processed_ts = self.snowflake_manager.get_last_processed_timestamp(payer_id)
+            if last_processed_ts:
+                last_processed_ts = last_processed_ts.replace(tzinfo=timezone.utc)
+
+        # --- START OF MODIFICATION ---
+        # This logic now ONLY scans the specified month. The previous month's
+        # logic has been removed to prevent picking up late-arriving data.
+        prefixes_to_scan = []
+        current_month_prefix = f"{source_path_base.rstrip('/')}/data/BILLING_PERIOD={year}-{month:02}/"
+        prefixes_to_scan.append(current_month_prefix)
+
+        # The following lines have been removed:
+        # prev_month = month - 1 if month > 1 else 12
+        # prev_year = year if month > 1 else year - 1
+        # prev_month_prefix = f"{source_path_base.rstrip('/')}/data/BILLING_PERIOD={prev_year}-{prev_month:02}/"
+        # prefixes_to_scan.append(prev_month_prefix)
+        # --- END OF MODIFICATION ---
+
+        logger.info(f"Scanning S3 prefixes: {prefixes_to_scan}")
+        return source_bucket, prefixes_to_scan, last_processed_ts
+
     def _execute_copy_and_snowflake_process(self, all_payer_metadata: List[Dict], staging_bucket: str,
                                             app: str, module: str, year: int, month: int) -> Dict[str, int]:
         """
         Manages the cleanup, parallel file copy, and subsequent Snowflake processing.
         """
-        summary = {"success": 0, "failed": 0, "total": 0}
-        all_copy_tasks = []
+        summary = {"success": 0, "failed": 0, "total": 0, "skipped": 0}
+        copy_plan = []
         processed_payer_ids = [p['payer_id'] for p in all_payer_metadata]
 
-        logger.info(f"Preparing to copy files for {len(processed_payer_ids)} payers.")
+        logger.info(f"Preparing to copy files for {len(processed_payer_ids)} payers (staging mode: '{STAGING_WRITE_MODE}').")
 
         for payer_data in all_payer_metadata:
             payer_id = payer_data['payer_id']
             source_bucket = payer_data['source_bucket']
-            dest_prefix = f"{app}/{module}/{self.environment}/year={year}/month={month}/payer-{payer_id}/"
-
-            # --- START OF NEW LOGIC ---
-            # Clean the destination directory for this specific payer before copying new files.
-            # This makes the process idempotent.
-            logger.info(f"Cleaning destination for payer {payer_id} before copy...")
-            if not self.s3_client.delete_objects_by_prefix(staging_bucket, dest_prefix):
-                logger.error(f"Halting process for payer {payer_id} due to failure in cleaning destination.")
-                # We can decide to either fail the whole payer or just log and continue.
-                # For safety, let's skip adding copy tasks for this failed payer.
-                continue 
-            # --- END OF NEW LOGIC ---
-
-            for source_key in payer_data['files_to_copy']:
-                filename = os.path.basename(source_key)
-                dest_key = f"{dest_prefix}{filename}"
-                all_copy_tasks.append({
-                    "source_bucket": source_bucket, "source_key": source_key,
-                    "dest_bucket": staging_bucket, "dest_key": dest_key
-                })
-
-        total_tasks = len(all_copy_tasks)
+            dest_prefix = self._dest_prefix(app, module, year, month, payer_id)
+
+            payer_tasks = [
+                self._build_copy_task(source_bucket, source_key, payer_data['file_metadata'].get(source_key, {}),
+                                      staging_bucket, dest_prefix)
+                for source_key in payer_data['files_to_copy']
+            ]
+
+            if STAGING_WRITE_MODE == 'sync':
+                # Bring the destination in line with the source listing: unchanged objects stay,
+                # orphans are removed, and only new or modified files are queued for copy.
+                pending_tasks = self._sync_destination(staging_bucket, dest_prefix, payer_tasks, payer_data['file_metadata'])
+                if pending_tasks is None:
+                    logger.error(f"Halting process for payer {payer_id} due to failure in syncing destination.")
+                    self.analysis_failed_payers.append(payer_id)
+                    continue
+                summary["skipped"] += len(payer_tasks) - len(pending_tasks)
+                payer_tasks = pending_tasks
+            elif STAGING_WRITE_MODE == 'versioned':
+                # Each run writes to its own fresh prefix, so there is nothing to clean.
+                pass
+            else:
+                # --- START OF NEW LOGIC ---
+                # Clean the destination directory for this specific payer before copying new files.
+                # This makes the process idempotent.
+                existing = self._clean_destination(payer_id, staging_bucket, dest_prefix)
+                if existing is None:
+                    logger.error(f"Halting process for payer {payer_id} due to failure in cleaning destination.")
+                    # We can decide to either fail the whole payer or just log and continue.
+                    # For safety, let's skip adding copy tasks for this failed payer.
+                    self.analysis_failed_payers.append(payer_id)
+                    continue
+                if existing:
+                    # Resumed: the interrupted run's copies stay, but objects no longer in the source go.
+                    pending_tasks = self._sync_destination(staging_bucket, dest_prefix, payer_tasks,
+                                                           payer_data['file_metadata'], existing)
+                    if pending_tasks is None:
+                        logger.error(f"Halting process for payer {payer_id} due to failure in cleaning destination.")
+                        self.analysis_failed_payers.append(payer_id)
+                        continue
+                    summary["skipped"] += len(payer_tasks) - len(pending_tasks)
+                    payer_tasks = pending_tasks
+                # --- END OF NEW LOGIC ---
+
+            if self.journal:
+                # Files the interrupted run already copied are not copied again.
+                pending_tasks = [task for task in payer_tasks if not self.journal.is_copied(payer_id, task)]
+                summary["skipped"] += len(payer_tasks) - len(pending_tasks)
+                payer_tasks = pending_tasks
+
+            copy_plan.append((payer_id, payer_tasks))
+
+        total_tasks = sum(len(payer_tasks) for _, payer_tasks in copy_plan)
         summary["total"] = total_tasks
-        if total_tasks == 0:
+        if total_tasks == 0 and summary["skipped"] == 0:
             logger.warning("No new or modified files were queued for copying after cleanup phase.")
             return summary
+        if summary["skipped"]:
+            logger.info(f"{summary['skipped']} files already staged and unchanged; skipping their copy.")
+
+        if self.async_engine:
+            logger.info(f"Starting asyncio copy of {total_tasks} files...")
+            # Tasks are handed out lazily and alternate between payers, like the threaded scheduler's lanes.
+            copy_results = self.s3_client.copy_files(
+                self._interleave_payer_tasks(copy_plan),
+                limiter=AimdConcurrencyLimiter() if ADAPTIVE_CONCURRENCY_ENABLED else None
+            )
+            summary["success"] = copy_results["success"]
+            summary["failed"] = copy_results["failed"]
+            still_failing = []
+            if copy_results["failed_tasks"]:
+                # Second chance for copies that failed in the main pass, with backoff and a per-run budget.
+                payer_by_dest_key = {task["dest_key"]: payer_id for payer_id, payer_tasks in copy_plan for task in payer_tasks}
+                still_failing = CopyRetryQueue(lambda task: self.s3_client.copy_single_file(**task)).run(
+                    [(payer_by_dest_key[task["dest_key"]], task) for task in copy_results["failed_tasks"]]
+                )
+                summary["success"] += summary["failed"] - len(still_failing)
+                summary["failed"] = len(still_failing)
+                self.copy_failed_payers = sorted({payer_id for payer_id, _ in still_failing})
+            if self.journal:
+                failed_dest_keys = {task["dest_key"] for _, task in still_failing}
+                for payer_id, payer_tasks in copy_plan:
+                    for task in payer_tasks:
+                        if task["dest_key"] not in failed_dest_keys:
+                            self.journal.record_copy(payer_id, task)
+            self._log_copy_summary(summary)
+            self._copy_phase_finished(summary)
+            return self._run_snowflake_process(summary, processed_payer_ids, staging_bucket, app, module, year, month)
 
         logger.info(f"Starting multithreaded copy of {total_tasks} files...")
-        with ThreadPoolExecutor(max_workers=MAX_COPY_WORKERS) as executor:
-            future_to_task = {executor.submit(self.s3_client.copy_single_file, **task): task for task in all_copy_tasks}
-            for i, future in enumerate(as_completed(future_to_task), 1):
-                if future.result():
-                    summary["success"] += 1
+        # The scheduler keeps a bounded window of copies in flight and takes turns across payers,
+        # so small payers are not stuck behind a large one.
+        snowflake_pipeline = self._snowflake_pipeline(processed_payer_ids, staging_bucket, app, module, year, month)
+        pipeline = StreamingCopyPipeline(self.s3_client, on_copied=self.journal.record_copy if self.journal else None,
+                                         on_payer_complete=snowflake_pipeline.payer_staged if snowflake_pipeline else None)
+        pipeline.start()
+        open_lanes = []
+        try:
+            for payer_id, payer_tasks in copy_plan:
+                pipeline.register_payer(payer_id)
+                open_lanes.append((payer_id, iter(payer_tasks)))
+            # Submits block while a lane is full, as in the streaming path; taking turns across payers keeps
+            # one payer's full lane from holding back the others.
+            while open_lanes:
+                for lane in list(open_lanes):
+                    payer_id, payer_tasks = lane
+                    task = next(payer_tasks, None)
+                    if task is None:
+                        open_lanes.remove(lane)
+                        pipeline.finish_listing(payer_id)
+                    else:
+                        pipeline.submit(payer_id, task)
+        finally:
+            # A lane left open after a failure would keep close() waiting for it forever.
+            for payer_id, _ in open_lanes:
+                pipeline.finish_listing(payer_id)
+            copy_results = pipeline.close()
+            self.copy_failed_payers = pipeline.failed_payers()
+        summary["success"] = copy_results["success"]
+        summary["failed"] = copy_results["failed"]
+
+        self._log_copy_summary(summary)
+        self._copy_phase_finished(summary)
+        if snowflake_pipeline:
+            return self._finish_snowflake_pipeline(snowflake_pipeline, summary, processed_payer_ids, staging_bucket,
+                                                   app, module, year, month)
+        return self._run_snowflake_process(summary, processed_payer_ids, staging_bucket, app, module, year, month)
+
+    @staticmethod
+    def _interleave_payer_tasks(copy_plan: List[Tuple[str, List[Dict[str, Any]]]]) -> Iterator[Dict[str, Any]]:
+        """Yields the copy tasks of every payer round-robin, one payer at a time."""
+        iterators = [iter(payer_tasks) for _, payer_tasks in copy_plan]
+        while iterators:
+            for iterator in list(iterators):
+                task = next(iterator, None)
+                if task is None:
+                    iterators.remove(iterator)
                 else:
-                    summary["failed"] += 1
-                if i % 250 == 0 or i == total_tasks:
-                    logger.info(f"Copy progress: {i}/{total_tasks} | Success: {summary['success']}, Failed: {summary['failed']}")
+                    yield task
 
+    @staticmethod
+    def _log_copy_summary(summary: Dict[str, int]):
         logger.info(f"--- S3 Copy Summary ---")
         logger.info(f"  Total files copied successfully: {summary['success']}")
         logger.info(f"  Total files failed to copy: {summary['failed']}")
+        logger.info(f"  Total files already staged (skipped): {summary['skipped']}")
+
+    def _copy_phase_finished(self, summary: Dict[str, int]):
+        """
+        Removes the copy journal once every payer's copies have succeeded: only the copy phase is resumed, so
+        a failure in Snowflake processing after this point doesn't need it.
+        """
+        if not self.journal or summary["failed"] or self.copy_failed_payers or self.analysis_failed_payers:
+            return
+        self.journal.clear()
+        self.journal = None
+        logger.info("Copy phase complete; copy journal removed.")
 
+    def _run_snowflake_process(self, summary: Dict[str, int], processed_payer_ids: List[str], staging_bucket: str,
+                               app: str, module: str, year: int, month: int) -> Dict[str, int]:
+        """Runs the Snowflake external table and analytics step, unless any copy failed."""
         if summary["failed"] > 0:
             logger.warning("Skipping Snowflake processing due to data copy failures.")
             return summary
+        if STAGING_WRITE_MODE == 'versioned' and not self._carry_over_payers(processed_payer_ids, staging_bucket,
+                                                                              app, module, year, month):
+            logger.error("Could not carry the other staged payers over into this run's prefix; "
+                         "leaving the stage on the previous run.")
+            summary["failed"] = summary["total"]
+            return summary
 
-        if SNOWFLAKE_AVAILABLE:
+        compaction_id = None
+        if self.snowflake_enabled:
             try:
+                if COMPACTION_ENABLED:
+                    compaction_id = self._compact_staged_payers(staging_bucket, app, module, year, month)
+                stage_prefix = self._run_prefix(app, module, year, month)
+                if compaction_id:
+                    stage_prefix = self._compaction_generation_prefix(app, module, year, month, compaction_id)
+                schema_cache = schema_fingerprint = None
+                if SCHEMA_CACHE_ENABLED:
+                    schema_cache = SchemaCache(self.s3_client, staging_bucket,
+                                               f"{app}/{module}/{self.environment}/{SCHEMA_CACHE_DIR}/")
+                    schema_fingerprint = schema_cache.fingerprint(stage_prefix)
+                profiler = self._new_profiler(processed_payer_ids, module)
                 logger.info("Starting Snowflake external table creation...")
-                create_external_table_and_process(
-                    env=self.environment, module=module, year=year, month=month,
-                    staging_bucket=staging_bucket, payer_ids=processed_payer_ids, app=app
-                )
+                try:
+                    create_external_table_and_process(
+                        env=self.environment, module=module, year=year, month=month,
+                        staging_bucket=staging_bucket, payer_ids=processed_payer_ids, app=app, run_id=self.run_id,
+                        compaction_id=compaction_id, schema_cache=schema_cache, schema_fingerprint=schema_fingerprint,
+                        profiler=profiler
+                    )
+                finally:
+                    self._publish_profile(profiler, staging_bucket, app, module, year, month)
                 logger.info("Snowflake external table process completed successfully!")
             except Exception as snowflake_error:
                 logger.error(f"Snowflake external table creation failed: {snowflake_error}", exc_info=True)
                 summary["failed"] = summary["total"]
         else:
-            logger.warning("Snowflake module not available, skipping external table creation.")
+            logger.warning("Snowflake processing disabled or module not available, skipping external table creation.")
+
+        if compaction_id and summary["failed"] == 0:
+            self._record_compaction(staging_bucket, app, module, year, month, compaction_id)
+        if STAGING_WRITE_MODE == 'versioned' and summary["failed"] == 0:
+            self._record_stage_run(staging_bucket, app, module, year, month)
+            self._start_run_prefix_gc(staging_bucket, app, module, year, month)
+        return summary
+
+    def _snowflake_pipeline(self, payer_ids: List[str], staging_bucket: str, app: str, module: str,
+                            year: int, month: int) -> Optional['PipelinedSnowflakeProcessor']:
+        """
+        A processor that refreshes and analyses payer groups while others are still copying, or None when
+        SNOWFLAKE_PIPELINE_ENABLED is off or the run's staging needs every copy to finish first.
+        """
+        if not (SNOWFLAKE_PIPELINE_ENABLED and self.snowflake_enabled):
+            return None
+        if COMPACTION_ENABLED or STAGING_WRITE_MODE == 'versioned':
+            logger.info("Pipelined Snowflake processing is not used with compaction or 'versioned' staging; "
+                        "Snowflake processing starts after all copies.")
+            return None
+        schema_cache = None
+        if SCHEMA_CACHE_ENABLED:
+            schema_cache = SchemaCache(self.s3_client, staging_bucket, f"{app}/{module}/{self.environment}/{SCHEMA_CACHE_DIR}/")
+        logger.info("Pipelined Snowflake processing enabled: payer groups are processed as soon as they are staged.")
+        self.snowflake_processor = PipelinedSnowflakeProcessor(
+            self.environment, module, year, month, staging_bucket, app, schema_cache=schema_cache,
+            stage_prefix=self._run_prefix(app, module, year, month), profiler=self._new_profiler(payer_ids, module)
+        )
+        return self.snowflake_processor
+
+    def _finish_snowflake_pipeline(self, processor: 'PipelinedSnowflakeProcessor', summary: Dict[str, int],
+                                   processed_payer_ids: List[str], staging_bucket: str, app: str, module: str,
+                                   year: int, month: int) -> Dict[str, int]:
+        """Pipelined counterpart of _run_snowflake_process: processes the last staged payers and waits for every group."""
+        try:
+            failed = processor.finish(processed_payer_ids, self.copy_failed_payers + self.analysis_failed_payers)
+        finally:
+            processor.harvest()
+            self._publish_profile(processor.profiler, staging_bucket, app, module, year, month)
+        if failed:
+            logger.error(f"Snowflake processing failed for payers {failed}.")
+            summary["failed"] = summary["total"]
+        elif summary["failed"] == 0:
+            logger.info("Snowflake external table process completed successfully!")
+        return summary
+
+    def _new_profiler(self, payer_ids: List[str], module: str) -> Optional[QueryProfiler]:
+        if not SQL_PROFILE_ENABLED:
+            return None
+        profile_id = self.run_id or datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+        return QueryProfiler(profile_id, payer_ids, module)
+
+    def _publish_profile(self, profiler: Optional[QueryProfiler], staging_bucket: str, app: str, module: str,
+                         year: int, month: int):
+        if profiler:
+            profiler.publish(self.s3_client, staging_bucket,
+                             f"{app}/{module}/{self.environment}/{SQL_PROFILE_DIR}/"
+                             f"year={year}/month={month}/{profiler.run_id}.json")
+
+    def _compact_staged_payers(self, staging_bucket: str, app: str, module: str, year: int, month: int) -> Optional[str]:
+        """
+        Brings the compacted output in line with every payer staged under the run prefix. The output of each
+        compaction is a new generation, a gen=<id>/ prefix under the compacted run prefix that no reader uses yet:
+        staged payers whose output in the current generation is missing or older than their staged files are
+        compacted into it, the output of the others is copied over server-side, and payers no longer staged are
+        left out. The stage is only pointed at a generation once it is complete, and the generations it
+        supersedes are removed once the run has succeeded (see _record_compaction).
+
+        Returns:
+            The id of the generation the Snowflake stage should point at (the current one when it is already
+            up to date), or None if the stage should read the staged files directly.
+        """
+        if not PYARROW_AVAILABLE:
+            logger.warning("COMPACTION_ENABLED is set but pyarrow is not installed; the stage will read the staged files directly.")
+            return None
+        run_prefix = self._run_prefix(app, module, year, month)
+        try:
+            current_id = self._current_compaction_id(staging_bucket, app, module, year, month)
+            current_prefix = (self._compaction_generation_prefix(app, module, year, month, current_id)
+                              if current_id else None)
+            staged = sorted(self._payer_dirs(staging_bucket, run_prefix))
+            compacted = self._payer_dirs(staging_bucket, current_prefix) if current_prefix else set()
+            with ThreadPoolExecutor(max_workers=max(1, min(MAX_ANALYSIS_WORKERS, len(staged)))) as executor:
+                current = list(executor.map(
+                    lambda payer_dir: payer_dir in compacted and self._compaction_is_current(
+                        staging_bucket, f"{run_prefix}{payer_dir}", f"{current_prefix}{payer_dir}"),
+                    staged
+                ))
+        except ClientError as e:
+            logger.error(f"Could not list the staged payers to compact: {e}")
+            return None
+        if current_id and all(current) and compacted == set(staged):
+            logger.info(f"Compacted generation {current_id} is up to date for all {len(staged)} staged payers; keeping it.")
+            return current_id
+
+        compaction_id = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+        generation_prefix = self._compaction_generation_prefix(app, module, year, month, compaction_id)
+        carried = [payer_dir for payer_dir, is_current in zip(staged, current) if is_current]
+        prefixes = [(f"{run_prefix}{payer_dir}", f"{generation_prefix}{payer_dir}")
+                    for payer_dir, is_current in zip(staged, current) if not is_current]
+        logger.info(f"Compacting staged Parquet files for {len(prefixes)} payers into s3://{staging_bucket}/{generation_prefix} "
+                    f"({len(carried)} staged payers already compacted are copied over)...")
+        if carried and not self._copy_compacted_payers(staging_bucket, current_prefix, generation_prefix, carried):
+            logger.error("Could not copy the current compacted output; the stage will read the staged files directly.")
+            return None
+        if ParquetCompactor(self.s3_client, staging_bucket).compact_prefixes(prefixes):
+            return compaction_id
+        logger.error("Compaction failed; the stage will read the staged files directly.")
+        return None
+
+    def _copy_compacted_payers(self, bucket: str, source_prefix: str, dest_prefix: str, payer_dirs: List[str]) -> bool:
+        """Copies the compacted output of payer_dirs from one generation prefix into another, server-side."""
+        pipeline = StreamingCopyPipeline(self.s3_client)
+        pipeline.start()
+        try:
+            for payer_dir in payer_dirs:
+                payer_id = payer_dir[len('payer-'):].rstrip('/')
+                pipeline.register_payer(payer_id)
+                try:
+                    for key, meta in self.s3_client.list_objects_with_metadata(bucket, f"{source_prefix}{payer_dir}").items():
+                        pipeline.submit(payer_id, self._build_copy_task(bucket, key, meta, bucket,
+                                                                        f"{dest_prefix}{payer_dir}"))
+                finally:
+                    pipeline.finish_listing(payer_id)
+        except ClientError as e:
+            logger.error(f"Could not list the compacted output under {source_prefix}: {e}")
+            return False
+        finally:
+            copy_results = pipeline.close()
+        return copy_results["failed"] == 0
+
+    def _compaction_is_current(self, bucket: str, staged_prefix: str, compacted_prefix: str) -> bool:
+        """True if the payer's compacted output exists and was written after every one of its staged files."""
+        compacted = self.s3_client.list_objects_with_metadata(bucket, compacted_prefix)
+        staged = self.s3_client.list_objects_with_metadata(bucket, staged_prefix) if compacted else {}
+        if not staged:
+            return False
+        newest_staged = max(meta['LastModified'] for meta in staged.values())
+        return newest_staged <= min(meta['LastModified'] for meta in compacted.values())
+
+    def _payer_dirs(self, bucket: str, prefix: str) -> Set[str]:
+        """The payer-{id}/ sub-prefixes directly under prefix, relative to it."""
+        return {sub_prefix[len(prefix):] for sub_prefix in self.s3_client.list_common_prefixes(bucket, prefix)
+                if sub_prefix[len(prefix):].startswith('payer-')}
+
+    def _compacted_prefix(self, app: str, module: str, prefix: str) -> str:
+        """Maps a staging prefix to its counterpart under the compacted output root."""
+        env_root = f"{app}/{module}/{self.environment}/"
+        return f"{env_root}{COMPACTION_OUTPUT_DIR}/{prefix[len(env_root):]}"
+
+    def _compaction_generation_prefix(self, app: str, module: str, year: int, month: int, compaction_id: str) -> str:
+        """Root of one generation of the run's compacted output."""
+        return f"{self._compacted_prefix(app, module, self._run_prefix(app, module, year, month))}gen={compaction_id}/"
+
+    def _compaction_pointer_key(self, app: str, module: str, year: int, month: int) -> str:
+        """Records which compacted generation of the month the stage points at; kept outside the stage."""
+        return f"{app}/{module}/{self.environment}/_compaction/year={year}/month={month}/current"
+
+    def _current_compaction_id(self, staging_bucket: str, app: str, module: str, year: int, month: int) -> Optional[str]:
+        """The compacted generation recorded by the last successful run, or None before any run recorded one."""
+        try:
+            return self.s3_client.get_object(staging_bucket, self._compaction_pointer_key(app, module, year, month)
+                                             ).decode('utf-8').strip()
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise
+
+    def _record_compaction(self, staging_bucket: str, app: str, module: str, year: int, month: int, compaction_id: str):
+        """
+        Records compaction_id as the month's current compacted generation, then deletes the generations it
+        superseded (and output of the layout before generations) under the run's compacted prefix.
+        """
+        try:
+            self.s3_client.put_object(staging_bucket, self._compaction_pointer_key(app, module, year, month),
+                                      compaction_id.encode('utf-8'))
+        except ClientError as e:
+            logger.warning(f"Could not record compacted generation {compaction_id} of {year}-{month:02}: {e}")
+            return
+        compacted_run_prefix = self._compacted_prefix(app, module, self._run_prefix(app, module, year, month))
+        current_prefix = f"{compacted_run_prefix}gen={compaction_id}/"
+        try:
+            superseded = [
+                prefix for prefix in self.s3_client.list_common_prefixes(staging_bucket, compacted_run_prefix)
+                if (prefix.startswith(f"{compacted_run_prefix}gen=") and prefix < current_prefix)
+                or prefix.startswith(f"{compacted_run_prefix}payer-")
+            ]
+            for prefix in superseded:
+                logger.info(f"Deleting superseded compacted output: s3://{staging_bucket}/{prefix}")
+                if not self.s3_client.delete_objects_by_prefix(staging_bucket, prefix):
+                    logger.warning(f"Could not fully delete s3://{staging_bucket}/{prefix}; it will be retried on the next run.")
+        except ClientError as e:
+            logger.warning(f"Could not list the compacted generations under s3://{staging_bucket}/{compacted_run_prefix}: {e}")
+
+    def _month_prefix(self, app: str, module: str, year: int, month: int) -> str:
+        return f"{app}/{module}/{self.environment}/year={year}/month={month}/"
+
+    def _run_prefix(self, app: str, module: str, year: int, month: int) -> str:
+        """Root of this run's staged data: the month prefix, or its run={run_id}/ child in 'versioned' mode."""
+        month_prefix = self._month_prefix(app, module, year, month)
+        return f"{month_prefix}run={self.run_id}/" if self.run_id else month_prefix
+
+    def _dest_prefix(self, app: str, module: str, year: int, month: int, payer_id: str) -> str:
+        return f"{self._run_prefix(app, module, year, month)}payer-{payer_id}/"
 
-        return summary
\ No newline at end of file
+    def _journal_prefix(self, app: str, module: str, year: int, month: int, payer_ids: List[str]) -> str:
+        """
+        Where the copy journal of the month and payer set lives: beside the year= prefixes, outside the
+        Snowflake stage.
+        """
+        payer_set = hashlib.sha256(",".join(sorted(payer_ids)).encode('utf-8')).hexdigest()[:12]
+        return f"{app}/{module}/{self.environment}/_journal/year={year}/month={month}/payers={payer_set}/"
+
+    def _run_pointer_key(self, app: str, module: str, year: int, month: int) -> str:
+        """Records which run prefix the month's stage points at; kept outside the stage, like the journal."""
+        return f"{app}/{module}/{self.environment}/_runs/year={year}/month={month}/current"
+
+    def _stage_run_prefix(self, staging_bucket: str, app: str, module: str, year: int, month: int) -> Optional[str]:
+        """
+        The run prefix the stage points at: the one recorded by the last successful run, or, before any run
+        recorded one, the newest run prefix older than this run's.
+        """
+        month_prefix = self._month_prefix(app, module, year, month)
+        try:
+            run_id = self.s3_client.get_object(staging_bucket, self._run_pointer_key(app, module, year, month))
+            return f"{month_prefix}run={run_id.decode('utf-8').strip()}/"
+        except ClientError:
+            older_runs = sorted(
+                prefix for prefix in self.s3_client.list_common_prefixes(staging_bucket, month_prefix)
+                if prefix.startswith(f"{month_prefix}run=") and prefix < self._run_prefix(app, module, year, month)
+            )
+            return older_runs[-1] if older_runs else None
+
+    def _record_stage_run(self, staging_bucket: str, app: str, module: str, year: int, month: int):
+        try:
+            self.s3_client.put_object(staging_bucket, self._run_pointer_key(app, module, year, month),
+                                      self.run_id.encode('utf-8'))
+        except ClientError as e:
+            logger.warning(f"Could not record run {self.run_id} as the staged run of {year}-{month:02}: {e}")
+
+    def _carry_over_payers(self, processed_payer_ids: List[str], staging_bucket: str, app: str, module: str,
+                           year: int, month: int) -> bool:
+        """
+        Copies the staged files of every payer this run did not stage itself (payers outside the run, and payers
+        with nothing new) from the run the stage points at into this run's prefix, so that switching the stage
+        to this run leaves no payer behind. The copies are server-side; a resumed run only copies what is missing.
+
+        Returns:
+            True if every payer was carried over.
+        """
+        run_prefix = self._run_prefix(app, module, year, month)
+        try:
+            previous_prefix = self._stage_run_prefix(staging_bucket, app, module, year, month)
+        except ClientError as e:
+            logger.error(f"Could not find the staged run to carry payers over from: {e}")
+            return False
+        if not previous_prefix or previous_prefix == run_prefix:
+            return True
+
+        staged = {f"payer-{payer_id}/" for payer_id in processed_payer_ids}
+        pipeline = StreamingCopyPipeline(self.s3_client)
+        pipeline.start()
+        carried = []
+        try:
+            for payer_prefix in self.s3_client.list_common_prefixes(staging_bucket, previous_prefix):
+                payer_dir = payer_prefix[len(previous_prefix):]
+                if not payer_dir.startswith('payer-') or payer_dir in staged:
+                    continue
+                payer_id = payer_dir[len('payer-'):].rstrip('/')
+                source_metadata = self.s3_client.list_objects_with_metadata(staging_bucket, payer_prefix)
+                dest_prefix = f"{run_prefix}{payer_dir}"
+                tasks = [self._build_copy_task(staging_bucket, key, meta, staging_bucket, dest_prefix)
+                         for key, meta in source_metadata.items()]
+                pending_tasks = self._sync_destination(staging_bucket, dest_prefix, tasks, source_metadata)
+                if pending_tasks is None:
+                    return False
+                pipeline.register_payer(payer_id)
+                for task in pending_tasks:
+                    pipeline.submit(payer_id, task)
+                pipeline.finish_listing(payer_id)
+                carried.append(payer_id)
+        except ClientError as e:
+            logger.error(f"Could not list the payers of {previous_prefix} to carry over: {e}")
+            return False
+        finally:
+            copy_results = pipeline.close()
+        if carried:
+            logger.info(f"Carried {len(carried)} payers over from {previous_prefix} into {run_prefix} "
+                        f"({copy_results['success']} files copied, {copy_results['failed']} failed).")
+        return copy_results["failed"] == 0
+
+    def _start_run_prefix_gc(self, staging_bucket: str, app: str, module: str, year: int, month: int) -> threading.Thread:
+        """
+        Deletes superseded run prefixes of the month on a background thread, off the critical path.
+        The thread is not a daemon, so the process still waits for it before exiting.
+        """
+        month_prefixes = [self._month_prefix(app, module, year, month)]
+        if COMPACTION_ENABLED:
+            month_prefixes.append(self._compacted_prefix(app, module, month_prefixes[0]))
+
+        def collect():
+            for month_prefix in month_prefixes:
+                self._collect_old_run_prefixes(staging_bucket, month_prefix, self.run_id)
+
+        thread = threading.Thread(target=collect, name="staging-run-gc")
+        thread.start()
+        return thread
+
+    def _collect_old_run_prefixes(self, staging_bucket: str, month_prefix: str, run_id: str):
+        current_prefix = f"{month_prefix}run={run_id}/"
+        try:
+            # Runs started after this one are left alone; of the older ones, the newest
+            # STAGING_RUN_RETENTION - 1 are kept for readers that may still be using them.
+            older_runs = sorted(
+                prefix for prefix in self.s3_client.list_common_prefixes(staging_bucket, month_prefix)
+                if prefix.startswith(f"{month_prefix}run=") and prefix < current_prefix
+            )
+            stale_runs = older_runs[:max(len(older_runs) - (STAGING_RUN_RETENTION - 1), 0)]
+            for prefix in stale_runs:
+                logger.info(f"Garbage-collecting superseded staging run prefix: s3://{staging_bucket}/{prefix}")
+                if not self.s3_client.delete_objects_by_prefix(staging_bucket, prefix):
+                    logger.warning(f"Could not fully delete s3://{staging_bucket}/{prefix}; it will be retried on the next run.")
+        except Exception as e:
+            logger.warning(f"Garbage collection of old staging runs under s3://{staging_bucket}/{month_prefix} failed: {e}")
+
+    @staticmethod
+    def _build_copy_task(source_bucket: str, source_key: str, source_meta: Dict[str, Any],
+                         staging_bucket: str, dest_prefix: str) -> Dict[str, Any]:
+        filename = os.path.basename(source_key)
+        return {
+            "source_bucket": source_bucket, "source_key": source_key,
+            "dest_bucket": staging_bucket, "dest_key": f"{dest_prefix}{filename}",
+            "size": source_meta.get('Size'), "etag": source_meta.get('ETag')
+        }
+
+    def _sync_destination(self, staging_bucket: str, dest_prefix: str, copy_tasks: List[Dict[str, Any]],
+                          source_metadata: Dict[str, Dict[str, Any]],
+                          existing: Optional[Dict[str, Dict[str, Any]]] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        Incrementally syncs a payer's destination prefix (listed here unless existing is given) with its copy tasks.
+        Deletes orphaned objects and returns only the tasks whose destination is missing or stale,
+        or None if the destination could not be listed or cleaned.
+        """
+        if existing is None:
+            try:
+                existing = self.s3_client.list_objects_with_metadata(staging_bucket, dest_prefix)
+            except ClientError as e:
+                logger.error(f"Could not list destination s3://{staging_bucket}/{dest_prefix} for sync: {e}")
+                return None
+
+        wanted_keys = {task["dest_key"] for task in copy_tasks}
+        orphans = [key for key in existing if key not in wanted_keys]
+        if orphans:
+            logger.info(f"Deleting {len(orphans)} orphaned objects under s3://{staging_bucket}/{dest_prefix}")
+            if not self.s3_client.delete_objects(staging_bucket, orphans):
+                return None
+
+        unchanged = self._unchanged_dest_keys(staging_bucket, copy_tasks, source_metadata, existing)
+        return [task for task in copy_tasks if task["dest_key"] not in unchanged]
+
+    def _unchanged_dest_keys(self, staging_bucket: str, copy_tasks: List[Dict[str, Any]],
+                             source_metadata: Dict[str, Dict[str, Any]],
+                             existing: Dict[str, Dict[str, Any]]) -> Set[str]:
+        """
+        The destination keys of copy_tasks whose staged object already matches its source object: same size and
+        either the same ETag or, where the ETags differ (multipart sources and multipart copies have composite
+        ETags), a source ETag recorded in the staged object's metadata by the copy that equals the current one.
+        That metadata is read with HeadObject, in parallel, only for the objects the listing cannot decide.
+        """
+        unchanged, recorded_etag_needed = set(), {}
+        for task in copy_tasks:
+            source_meta, dest_meta = source_metadata.get(task["source_key"]), existing.get(task["dest_key"])
+            if not source_meta or not dest_meta or source_meta['Size'] != dest_meta['Size']:
+                continue
+            if source_meta['ETag'] == dest_meta['ETag']:
+                unchanged.add(task["dest_key"])
+            else:
+                recorded_etag_needed[task["dest_key"]] = source_meta['ETag']
+        if recorded_etag_needed:
+            with ThreadPoolExecutor(max_workers=min(MAX_ANALYSIS_WORKERS, len(recorded_etag_needed))) as executor:
+                recorded = executor.map(lambda dest_key: self._recorded_source_etag(staging_bucket, dest_key),
+                                        recorded_etag_needed)
+                unchanged.update(dest_key for (dest_key, etag), recorded_etag
+                                 in zip(recorded_etag_needed.items(), recorded) if recorded_etag == etag)
+        return unchanged
+
+    def _recorded_source_etag(self, staging_bucket: str, dest_key: str) -> Optional[str]:
+        """The source ETag a copy recorded on the staged object, or None if it has none or cannot be read."""
+        try:
+            return self.s3_client.get_object_metadata(staging_bucket, dest_key).get(SOURCE_ETAG_METADATA_KEY)
+        except ClientError as e:
+            logger.warning(f"Could not read the metadata of s3://{staging_bucket}/{dest_key}; it will be copied again: {e}")
+            return None
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Small-file compaction for staged CUR data.
+
+CUR exports land as many small Snappy Parquet parts, and every file adds per-file overhead to
+Snowflake external table scans and INFER_SCHEMA. ParquetCompactor rewrites each payer's staged
+parts into a few large Snappy Parquet files with large row groups. Reads and writes stream
+through pyarrow's S3 filesystem. At most one row group per prefix is held in memory, and
+prefixes (one per payer) are compacted in parallel. Output prefixes are expected to be fresh:
+callers write each compaction to a new prefix that no reader uses yet (see DataCopyService).
+"""
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from config import (COMPACTION_TARGET_FILE_BYTES, COMPACTION_ROW_GROUP_ROWS, COMPACTION_READ_BATCH_ROWS,
+                    COMPACTION_WORKERS)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from pyarrow import fs as pafs
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+PARQUET_SUFFIX = '.parquet'
+
+
+def arrow_s3_filesystem(s3_client, bucket: str):
+    """A pyarrow S3 filesystem for the bucket's region, honouring the S3 client's endpoint override."""
+    region = s3_client.get_bucket_info(bucket)['region'] or s3_client.region
+    if not s3_client.endpoint_url:
+        return pafs.S3FileSystem(region=region)
+    endpoint = urlparse(s3_client.endpoint_url)
+    return pafs.S3FileSystem(region=region, endpoint_override=endpoint.netloc, scheme=endpoint.scheme)
+
+
+class ParquetCompactor:
+    """Compacts Parquet parts under staging prefixes into fewer, larger files."""
+
+    def __init__(self, s3_client, bucket: str, target_file_bytes: int = COMPACTION_TARGET_FILE_BYTES,
+                 row_group_rows: int = COMPACTION_ROW_GROUP_ROWS, read_batch_rows: int = COMPACTION_READ_BATCH_ROWS,
+                 workers: int = COMPACTION_WORKERS):
+        if not PYARROW_AVAILABLE:
+            raise ImportError("pyarrow is required for Parquet compaction (pip install pyarrow).")
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.target_file_bytes = target_file_bytes
+        self.row_group_rows = row_group_rows
+        self.read_batch_rows = read_batch_rows
+        self.workers = workers
+        self.filesystem = arrow_s3_filesystem(s3_client, bucket)
+
+    def compact_prefixes(self, prefixes: List[Tuple[str, str]]) -> bool:
+        """
+        Compacts each (source_prefix, output_prefix), in parallel across prefixes.
+        Returns True if every prefix was compacted.
+        """
+        if not prefixes:
+            return True
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(prefixes)), thread_name_prefix="compaction") as executor:
+            results = list(executor.map(lambda prefix: self._compact_safely(*prefix), prefixes))
+        totals = {"input_files": 0, "output_files": 0, "rows": 0}
+        for stats in results:
+            if stats:
+                for key in totals:
+                    totals[key] += stats[key]
+        logger.info(f"Compacted {totals['input_files']} staged files into {totals['output_files']} "
+                    f"({totals['rows']} rows) across {len(prefixes)} prefixes.")
+        return all(results)
+
+    def _compact_safely(self, source_prefix: str, output_prefix: str) -> Optional[Dict[str, Any]]:
+        try:
+            return self.compact_prefix(source_prefix, output_prefix)
+        except Exception as e:
+            logger.error(f"Compaction of s3://{self.bucket}/{source_prefix} failed: {e}", exc_info=True)
+            return None
+
+    def compact_prefix(self, source_prefix: str, output_prefix: str) -> Dict[str, Any]:
+        """
+        Streams every Parquet part under source_prefix into part-NNNNN files under output_prefix.
+
+        Returns:
+            Stats with 'input_files', 'output_files', 'rows', 'input_bytes' and 'output_bytes'.
+        """
+        sources = self.s3_client.list_objects_with_metadata(self.bucket, source_prefix)
+        source_keys = sorted(key for key in sources if key.endswith(PARQUET_SUFFIX))
+        writer = _RotatingParquetWriter(self.filesystem, f"{self.bucket}/{output_prefix}",
+                                        self.target_file_bytes, self.row_group_rows)
+        rows = 0
+        try:
+            for key in source_keys:
+                with self.filesystem.open_input_file(f"{self.bucket}/{key}") as source:
+                    parquet_file = pq.ParquetFile(source)
+                    for batch in parquet_file.iter_batches(batch_size=self.read_batch_rows):
+                        writer.write_batch(batch)
+                    rows += parquet_file.metadata.num_rows
+        finally:
+            writer.close()
+
+        stats = {
+            "input_files": len(source_keys), "output_files": len(writer.keys), "rows": rows,
+            "input_bytes": sum(sources[key]['Size'] for key in source_keys), "output_bytes": writer.bytes_written
+        }
+        logger.info(f"Compacted s3://{self.bucket}/{source_prefix}: {stats['input_files']} files -> "
+                    f"{stats['output_files']} files, {rows} rows.")
+        return stats
+
+
+class _RotatingParquetWriter:
+    """
+    Buffers record batches into row groups of row_group_rows and writes them to part-NNNNN Parquet files.
+    A new file starts once the current one reaches the target size, or when an input arrives with a
+    different schema (e.g. CUR columns added mid-month).
+    """
+
+    def __init__(self, filesystem, output_path: str, target_file_bytes: int, row_group_rows: int):
+        self.filesystem = filesystem
+        self.output_path = output_path
+        self.target_file_bytes = target_file_bytes
+        self.row_group_rows = row_group_rows
+        self.keys: List[str] = []
+        self.bytes_written = 0
+        self._pending = []
+        self._pending_rows = 0
+        self._sink = None
+        self._writer = None
+
+    def write_batch(self, batch):
+        if self._pending and not self._pending[0].schema.equals(batch.schema):
+            self._write_row_group()
+        self._pending.append(batch)
+        self._pending_rows += batch.num_rows
+        if self._pending_rows >= self.row_group_rows:
+            self._write_row_group()
+
+    def close(self):
+        self._write_row_group()
+        if self._writer:
+            self._finish_file()
+
+    def _write_row_group(self):
+        if not self._pending:
+            return
+        table = pa.Table.from_batches(self._pending)
+        self._pending, self._pending_rows = [], 0
+        if self._writer and (not self._writer.schema.equals(table.schema)
+                             or self._sink.tell() >= self.target_file_bytes):
+            self._finish_file()
+        if not self._writer:
+            path = posixpath.join(self.output_path, f"part-{len(self.keys):05}.snappy{PARQUET_SUFFIX}")
+            self._sink = self.filesystem.open_output_stream(path)
+            self._writer = pq.ParquetWriter(self._sink, table.schema, compression='snappy')
+            self.keys.append(path)
+        self._writer.write_table(table, row_group_size=len(table))
+
+    def _finish_file(self):
+        self._writer.close()
+        self.bytes_written += self._sink.tell()
+        self._sink.close()
+        self._writer = None
+        self._sink = None
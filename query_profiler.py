@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Per-statement profiling of the Snowflake work in a run.
+
+Before each statement, QueryProfiler sets a JSON QUERY_TAG on the session: the run id, a hash of
+the payer set, the product section and the statement index. It also records the statement's
+query ID. A script submitted as one async `begin ... end` block gets an ALTER SESSION SET
+QUERY_TAG before each of its statements instead (tag_script), and its child queries are found by
+their tag. After the run, it reads elapsed time, bytes scanned, partition pruning and spill for
+those queries from INFORMATION_SCHEMA.QUERY_HISTORY_BY_USER. The result is published as a JSON
+profile report in the staging bucket, plus per-section CloudWatch metrics.
+"""
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from cloudwatch_utils import send_query_profile_metrics
+from sql_script_runner import SqlStatement, split_statements, assign_sections
+
+logger = logging.getLogger(__name__)
+
+# QUERY_HISTORY_BY_USER returns at most this many queries per call; a run issues a few dozen.
+QUERY_HISTORY_RESULT_LIMIT = 10000
+QUERY_HISTORY_COLUMNS = ['total_elapsed_time', 'bytes_scanned', 'partitions_scanned', 'partitions_total',
+                         'bytes_spilled_to_local_storage', 'bytes_spilled_to_remote_storage']
+
+
+class QueryProfiler:
+    """Tags, records and profiles the statements of one run. Safe to share between sessions and threads."""
+
+    def __init__(self, run_id: str, payer_ids: List[str], module: str):
+        self.run_id = run_id
+        self.payer_ids = sorted(payer_ids)
+        self.payer_set = hashlib.sha256(",".join(self.payer_ids).encode('utf-8')).hexdigest()[:12]
+        self.module = module
+        self.started_at = time.time()
+        self.queries: List[Dict[str, Any]] = []
+        self.history: Dict[str, Dict[str, Any]] = {}
+        # Query IDs of async script blocks; their child queries are profiled instead.
+        self.script_blocks: List[str] = []
+        self._lock = threading.Lock()
+
+    def query_tag(self, section: str, statement: Optional[int] = None) -> str:
+        tag = {"run_id": self.run_id, "module": self.module, "payer_set": self.payer_set,
+               "payers": len(self.payer_ids), "section": section}
+        if statement is not None:
+            tag["statement"] = statement
+        return json.dumps(tag, separators=(',', ':'))
+
+    def execute(self, cursor, sql: str, section: str, statement: Optional[int] = None, params=None):
+        """Tags the cursor's session, executes sql and records its query ID."""
+        cursor.execute("ALTER SESSION SET QUERY_TAG = %s", (self.query_tag(section, statement),))
+        started = time.perf_counter()
+        try:
+            return cursor.execute(sql, params) if params is not None else cursor.execute(sql)
+        finally:
+            with self._lock:
+                self.queries.append({"query_id": getattr(cursor, 'sfqid', None), "section": section,
+                                     "statement": statement,
+                                     "client_seconds": round(time.perf_counter() - started, 3)})
+
+    def tag_script(self, script: str) -> str:
+        """
+        Rewrites a script as one `begin ... end` block that sets the QUERY_TAG of each statement's section
+        and index before running it, so the child queries of an async block can be attributed by harvest().
+        """
+        statements = [SqlStatement(index, sql) for index, sql in enumerate(split_statements(script))]
+        assign_sections(statements)
+        lines = ["begin"]
+        for statement in statements:
+            tag = self.query_tag(statement.section, statement.index).replace("'", "''")
+            lines.append(f"ALTER SESSION SET QUERY_TAG = '{tag}';")
+            lines.append(f"{statement.sql};")
+        lines.append("end;")
+        return "\n".join(lines)
+
+    def execute_async(self, cursor, sql: str, section: str) -> str:
+        """
+        Submits a script block (see tag_script) without waiting for it and returns its query ID. The block itself
+        is not profiled: its statements are found by their tags when the history is harvested.
+        """
+        cursor.execute("ALTER SESSION SET QUERY_TAG = %s", (self.query_tag(section),))
+        cursor.execute_async(sql)
+        with self._lock:
+            self.script_blocks.append(cursor.sfqid)
+        return cursor.sfqid
+
+    def harvest(self, cursor):
+        """
+        Reads the QUERY_HISTORY statistics of every recorded query, and of the statements of async script blocks,
+        which are recorded here from their tags. Failures only cost the report its detail.
+        """
+        query_ids = [query["query_id"] for query in self.queries if query["query_id"]]
+        if not query_ids and not self.script_blocks:
+            return
+        id_filter = f"query_id IN ({', '.join(['%s'] * len(query_ids))}) OR " if query_ids else ""
+        history_query = f"""
+        SELECT query_id, query_tag, {', '.join(QUERY_HISTORY_COLUMNS)}, execution_status
+        FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY_BY_USER(
+            END_TIME_RANGE_START => TO_TIMESTAMP_LTZ(%s), RESULT_LIMIT => {QUERY_HISTORY_RESULT_LIMIT}))
+        WHERE {id_filter}(query_tag LIKE %s AND query_type <> 'ALTER_SESSION')
+        """
+        run_tag = '%' + json.dumps({"run_id": self.run_id}, separators=(',', ':'))[1:-1] + '%'
+        try:
+            cursor.execute("ALTER SESSION UNSET QUERY_TAG")
+            cursor.execute(history_query, (int(self.started_at), *query_ids, run_tag))
+            names = [description[0].lower() for description in cursor.description]
+            recorded = set(query_ids)
+            with self._lock:
+                for row in cursor.fetchall():
+                    record = dict(zip(names, row))
+                    query_id, query_tag = record.pop('query_id'), record.pop('query_tag')
+                    if query_id in self.script_blocks:
+                        continue
+                    if query_id not in recorded:
+                        tag = json.loads(query_tag)
+                        self.queries.append({"query_id": query_id, "section": tag.get("section"),
+                                             "statement": tag.get("statement"), "client_seconds": None})
+                    self.history[query_id] = record
+            logger.info(f"Harvested query history for {len(self.history)} queries "
+                        f"({len(self.history) - len(recorded & set(self.history))} from async script blocks).")
+        except Exception as e:
+            logger.warning(f"Could not read query history for run {self.run_id}: {e}")
+
+    def report(self) -> Dict[str, Any]:
+        """Per-query statistics and per-section totals, sections ordered by elapsed time."""
+        queries, sections = [], {}
+        for query in self.queries:
+            stats = self.history.get(query["query_id"], {})
+            entry = dict(query, **{column: stats.get(column) for column in QUERY_HISTORY_COLUMNS},
+                         execution_status=stats.get('execution_status'))
+            queries.append(entry)
+            totals = sections.setdefault(query["section"], dict({column: 0 for column in QUERY_HISTORY_COLUMNS},
+                                                                 queries=0))
+            totals["queries"] += 1
+            for column in QUERY_HISTORY_COLUMNS:
+                totals[column] += entry[column] or 0
+        for totals in sections.values():
+            totals["pruned_fraction"] = (round(1 - totals['partitions_scanned'] / totals['partitions_total'], 4)
+                                         if totals['partitions_total'] else None)
+        return {
+            "run_id": self.run_id,
+            "module": self.module,
+            "payer_set": self.payer_set,
+            "payer_ids": self.payer_ids,
+            "sections": dict(sorted(sections.items(), key=lambda item: -item[1]['total_elapsed_time'])),
+            "queries": queries
+        }
+
+    def publish(self, s3_client=None, bucket: Optional[str] = None, key: Optional[str] = None) -> Dict[str, Any]:
+        """Logs the per-section summary, writes the report to s3://{bucket}/{key} and sends CloudWatch metrics."""
+        report = self.report()
+        for section, totals in report["sections"].items():
+            logger.info(f"SQL profile [{section}]: {totals['queries']} queries, "
+                        f"{totals['total_elapsed_time'] / 1000:.1f}s elapsed, "
+                        f"{totals['bytes_scanned'] / 1024 ** 3:.2f} GiB scanned, "
+                        f"{totals['partitions_scanned']}/{totals['partitions_total']} partitions, "
+                        f"{(totals['bytes_spilled_to_local_storage'] + totals['bytes_spilled_to_remote_storage']) / 1024 ** 2:.0f} MiB spilled")
+        if s3_client and bucket and key:
+            try:
+                s3_client.put_object(bucket, key, json.dumps(report, indent=2, default=str).encode('utf-8'))
+                logger.info(f"SQL profile report written to s3://{bucket}/{key}")
+            except Exception as e:
+                logger.warning(f"Could not write SQL profile report to s3://{bucket}/{key}: {e}")
+        send_query_profile_metrics(report["sections"])
+        return report
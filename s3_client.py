@@ -1,94 +1,349 @@
 
 import os
+import string
 import boto3
 import logging
-from typing import Dict, Any, Optional
+import threading
+from collections import deque
+from typing import Dict, Any, Optional, List, Iterator, Tuple
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import boto3.session
 from botocore.exceptions import ClientError
-from config import S3_CONFIG, PAYER_CONFIGS, MAX_COPY_WORKERS
+from config import (S3_CONFIG, PAYER_CONFIGS, COPY_CONCURRENCY_CEILING, MULTIPART_COPY_THRESHOLD,
+                    MULTIPART_COPY_PART_SIZE, MULTIPART_COPY_PART_WORKERS, LISTING_SHARD_WORKERS,
+                    DELETE_BATCH_WORKERS)
 from snowflake_external_table import SnowflakeConfigFetcher
 
 logger = logging.getLogger(__name__)
 
+# A listing shard: (prefix, start_after, end_at), end_at inclusive and None for the rest of the prefix.
+Shard = Tuple[str, Optional[str], Optional[str]]
+
+# Hard S3 limits for server-side copies.
+MAX_SINGLE_COPY_SIZE = 5 * 1024 ** 3
+MAX_MULTIPART_PARTS = 10000
+
+# Maximum number of keys accepted by a single DeleteObjects request.
+MAX_DELETE_BATCH_SIZE = 1000
+
+# Characters used to split a flat key space into StartAfter shards, in S3 (byte) sort order.
+LISTING_SHARD_ALPHABET = string.digits + string.ascii_uppercase + string.ascii_lowercase
+
+# User metadata key under which a staged copy records the ETag of the source object it was copied from.
+SOURCE_ETAG_METADATA_KEY = 'source-etag'
+
+# head_bucket outcomes that are definitive for the lifetime of a run, and so safe to cache.
+CACHEABLE_BUCKET_ERROR_CODES = ('403', 'AccessDenied', '404', 'NoSuchBucket')
+
+# Error codes S3 uses to ask clients to slow down.
+THROTTLE_ERROR_CODES = ('SlowDown', 'ServiceUnavailable', 'Throttling', 'ThrottlingException',
+                        'RequestLimitExceeded', '503')
+
 class S3Client:
     """Enhanced S3 client for cross-account and cross-region operations"""
-    def __init__(self, region_name=None):
+    def __init__(self, region_name=None, endpoint_url: Optional[str] = None):
         self.region = region_name or S3_CONFIG.get('region_name', 'us-east-2')
+        self.endpoint_url = endpoint_url
         self.s3_client = None
+        self._throttle_stats = threading.local()
+        # bucket -> {'accessible', 'region'}, and region -> client, shared by every thread.
+        self._bucket_info: Dict[str, Dict[str, Any]] = {}
+        self._bucket_locks: Dict[str, threading.Lock] = {}
+        self._regional_clients: Dict[str, Any] = {}
+        self._cache_lock = threading.Lock()
         self._init_s3_client()
 
     def _init_s3_client(self):
         """Initialize S3 client with VPC endpoint bypass and an appropriately sized connection pool."""
         try:
-            session = boto3.session.Session()
-            client_config = boto3.session.Config(
-                s3={
-                    'addressing_style': S3_CONFIG['addressing_style'],
-                    'use_accelerate_endpoint': S3_CONFIG['use_accelerate_endpoint'],
-                    'use_dualstack_endpoint': S3_CONFIG['use_dualstack_endpoint']
-                },
-                signature_version=S3_CONFIG['signature_version'],
-                retries={'max_attempts': S3_CONFIG['max_attempts']},
-                max_pool_connections=MAX_COPY_WORKERS
-            )
-            self.s3_client = session.client('s3', region_name=self.region, config=client_config)
-            logger.info(f"S3 client initialized for region '{self.region}' with connection pool size: {MAX_COPY_WORKERS}")
+            self.s3_client = self._create_client(self.region)
+            self._regional_clients[self.region] = self.s3_client
+            logger.info(f"S3 client initialized for region '{self.region}' with connection pool size: {COPY_CONCURRENCY_CEILING + MULTIPART_COPY_PART_WORKERS}")
         except Exception as e:
             logger.error(f"Failed to initialize S3 client: {str(e)}")
             raise
 
+    def _create_client(self, region: str):
+        session = boto3.session.Session()
+        client_config = boto3.session.Config(
+            s3={
+                'addressing_style': S3_CONFIG['addressing_style'],
+                'use_accelerate_endpoint': S3_CONFIG['use_accelerate_endpoint'],
+                'use_dualstack_endpoint': S3_CONFIG['use_dualstack_endpoint']
+            },
+            signature_version=S3_CONFIG['signature_version'],
+            retries={'max_attempts': S3_CONFIG['max_attempts']},
+            max_pool_connections=COPY_CONCURRENCY_CEILING + MULTIPART_COPY_PART_WORKERS
+        )
+        client = session.client('s3', region_name=region, endpoint_url=self.endpoint_url, config=client_config)
+        # Observe every attempt, including the ones botocore retries internally, so throttling is visible.
+        client.meta.events.register_first('needs-retry.s3', self._observe_attempt)
+        return client
+
+    def _client_for(self, bucket: str):
+        """Returns the client for the bucket's own region, so requests skip the cross-region redirect."""
+        region = self.get_bucket_info(bucket)['region'] or self.region
+        with self._cache_lock:
+            client = self._regional_clients.get(region)
+            if client is None:
+                logger.info(f"Creating S3 client for region '{region}' (bucket '{bucket}')")
+                client = self._regional_clients[region] = self._create_client(region)
+        return client
+
+    def _observe_attempt(self, response=None, **kwargs):
+        """botocore 'needs-retry' hook: counts throttled attempts made by the calling thread. Never decides on retries."""
+        if response is None:
+            return None
+        http_response, parsed = response
+        error_code = parsed.get('Error', {}).get('Code') if isinstance(parsed, dict) else None
+        if error_code in THROTTLE_ERROR_CODES or getattr(http_response, 'status_code', None) == 503:
+            self._throttle_stats.count = getattr(self._throttle_stats, 'count', 0) + 1
+        return None
+
+    def pop_throttle_count(self) -> int:
+        """Returns and resets the number of throttled S3 attempts seen on the calling thread."""
+        count = getattr(self._throttle_stats, 'count', 0)
+        self._throttle_stats.count = 0
+        return count
+
     def can_access_bucket(self, bucket_name: str) -> bool:
         """Checks if the role has s3:ListBucket permission on a bucket."""
+        return self.get_bucket_info(bucket_name)['accessible']
+
+    def get_bucket_info(self, bucket_name: str) -> Dict[str, Any]:
+        """
+        Returns {'accessible': bool, 'region': Optional[str]} for a bucket.
+        The bucket is probed with head_bucket once; payers sharing a bucket reuse the result.
+        """
+        info = self._bucket_info.get(bucket_name)
+        if info is not None:
+            return info
+        with self._cache_lock:
+            bucket_lock = self._bucket_locks.setdefault(bucket_name, threading.Lock())
+        with bucket_lock:
+            info = self._bucket_info.get(bucket_name)
+            if info is None:
+                info, cacheable = self._probe_bucket(bucket_name)
+                if cacheable:
+                    self._bucket_info[bucket_name] = info
+        return info
+
+    def _probe_bucket(self, bucket_name: str) -> Tuple[Dict[str, Any], bool]:
+        """Runs head_bucket and returns (bucket info, whether the outcome may be cached)."""
         try:
-            self.s3_client.head_bucket(Bucket=bucket_name)
+            response = self.s3_client.head_bucket(Bucket=bucket_name)
             logger.debug(f"Access to bucket '{bucket_name}' confirmed.")
-            return True
+            return {'accessible': True, 'region': self._bucket_region(response)}, True
         except ClientError as e:
-            if e.response['Error']['Code'] in ('403', 'AccessDenied'):
+            error_code = e.response['Error']['Code']
+            if error_code in ('403', 'AccessDenied'):
                 logger.warning(f"Access DENIED for bucket '{bucket_name}'.")
             else:
                 logger.error(f"Error checking access for bucket '{bucket_name}': {e}")
-            return False
+            return ({'accessible': False, 'region': self._bucket_region(e.response)},
+                    error_code in CACHEABLE_BUCKET_ERROR_CODES)
         except Exception as e:
             logger.error(f"Unexpected error checking bucket access for '{bucket_name}': {e}")
-            return False
+            return {'accessible': False, 'region': None}, False
 
-    def list_objects_with_metadata(self, bucket: str, prefix: str, since: Optional[datetime] = None) -> Dict[str, Dict[str, Any]]:
+    @staticmethod
+    def _bucket_region(response: Dict[str, Any]) -> Optional[str]:
+        # S3 reports the bucket's region in this header on success and on most errors.
+        return response.get('ResponseMetadata', {}).get('HTTPHeaders', {}).get('x-amz-bucket-region')
+
+    def list_objects_with_metadata(self, bucket: str, prefix: str, since: Optional[datetime] = None,
+                                   parallel: bool = False) -> Dict[str, Dict[str, Any]]:
         """
         Lists all objects under a prefix, returning a map of full_key -> {'ETag', 'Size'}.
         Optionally, only returns objects modified *since* a given datetime.
+        With parallel=True, large prefixes are split into shards that are paginated concurrently.
         """
         objects_map = {}
+        for page_objects in self.iter_objects_with_metadata(bucket, prefix, since=since, parallel=parallel):
+            objects_map.update(page_objects)
+        if since:
+            logger.debug(f"Found {len(objects_map)} objects modified since {since} in s3://{bucket}/{prefix}")
+        else:
+            logger.debug(f"Found {len(objects_map)} objects with metadata in s3://{bucket}/{prefix}")
+        return objects_map
+
+    def iter_objects_with_metadata(self, bucket: str, prefix: str, since: Optional[datetime] = None,
+                                   parallel: bool = False) -> Iterator[Dict[str, Dict[str, Any]]]:
+        """
+        Same as list_objects_with_metadata, but yields one full_key -> metadata map per listing page
+        as soon as it arrives, so callers can start working before the listing finishes.
+        """
         try:
-            paginator = self.s3_client.get_paginator('list_objects_v2')
-            pages = paginator.paginate(Bucket=bucket, Prefix=prefix)
+            if parallel:
+                pages = self._iter_sharded_pages(bucket, prefix)
+            else:
+                paginator = self._client_for(bucket).get_paginator('list_objects_v2')
+                pages = paginator.paginate(Bucket=bucket, Prefix=prefix)
             for page in pages:
+                page_objects = {}
                 for obj in page.get('Contents', []):
                     if since and obj['LastModified'] <= since:
                         continue 
                     
                     full_key = obj['Key']
                     if full_key and not full_key.endswith('/'): 
-                        objects_map[full_key] = {
+                        page_objects[full_key] = {
                             'ETag': obj['ETag'].strip('"'),
                             'Size': obj['Size'],
                             'LastModified': obj['LastModified']
                         }
-            if since:
-                logger.debug(f"Found {len(objects_map)} objects modified since {since} in s3://{bucket}/{prefix}")
-            else:
-                logger.debug(f"Found {len(objects_map)} objects with metadata in s3://{bucket}/{prefix}")
+                if page_objects:
+                    yield page_objects
         except ClientError as e:
             logger.error(f"Failed to list objects in s3://{bucket}/{prefix}: {e}")
             raise
-        return objects_map
 
-    def copy_single_file(self, source_bucket: str, source_key: str, dest_bucket: str, dest_key: str) -> bool:
-        """Copy a single file with enhanced error handling."""
+    def list_common_prefixes(self, bucket: str, prefix: str) -> List[str]:
+        """Lists the immediate sub-prefixes ('folders') under a prefix."""
+        paginator = self._client_for(bucket).get_paginator('list_objects_v2')
+        return [sub['Prefix']
+                for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/')
+                for sub in page.get('CommonPrefixes', [])]
+
+    def put_object(self, bucket: str, key: str, body: bytes):
+        """Writes a small object in a single request. Raises ClientError on failure."""
+        self._client_for(bucket).put_object(Bucket=bucket, Key=key, Body=body)
+
+    def get_object(self, bucket: str, key: str) -> bytes:
+        """Reads a small object fully into memory. Raises ClientError on failure."""
+        return self._client_for(bucket).get_object(Bucket=bucket, Key=key)['Body'].read()
+
+    def get_object_metadata(self, bucket: str, key: str) -> Dict[str, str]:
+        """Returns the object's user metadata (HeadObject). Raises ClientError on failure."""
+        return self._client_for(bucket).head_object(Bucket=bucket, Key=key).get('Metadata', {})
+
+    def _iter_sharded_pages(self, bucket: str, prefix: str) -> Iterator[Dict[str, Any]]:
+        """
+        Yields list_objects_v2 pages for a prefix, paginating independent shards concurrently.
+        Sub-prefixes discovered with a '/' delimiter become shards; a flat prefix that spans more
+        than one page is split into StartAfter key ranges derived from its first page, and a shard
+        that still spans more than one page is split again from its own first page.
+        """
+        client = self._client_for(bucket)
+        first_page = client.list_objects_v2(Bucket=bucket, Prefix=prefix, Delimiter='/')
+        shards = self._prefix_shards(first_page)
+        if shards is None:
+            first_page = client.list_objects_v2(Bucket=bucket, Prefix=prefix)
+            shards = self._key_range_shards(prefix, first_page)
+        yield first_page
+
+        if not shards:
+            return
+        logger.debug(f"Listing s3://{bucket}/{prefix} as {len(shards)} parallel shards")
+        with ThreadPoolExecutor(max_workers=LISTING_SHARD_WORKERS) as executor:
+            pending = {executor.submit(self._list_shard, bucket, *shard) for shard in shards}
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    pages, sub_shards = future.result()
+                    pending |= {executor.submit(self._list_shard, bucket, *shard) for shard in sub_shards}
+                    yield from pages
+
+    @staticmethod
+    def _prefix_shards(delimited_page: Dict[str, Any]) -> Optional[List[Shard]]:
+        """
+        Shards for a prefix from the first page of its '/'-delimited listing: one per common prefix when the
+        direct children fit in that page (anything deeper lives under them). None if the page is truncated,
+        in which case the prefix must be split with _key_range_shards instead.
+        """
+        if delimited_page.get('IsTruncated'):
+            return None
+        return [(sub['Prefix'], None, None) for sub in delimited_page.get('CommonPrefixes', [])]
+
+    @staticmethod
+    def _key_range_shards(prefix: str, flat_page: Dict[str, Any], end_at: Optional[str] = None) -> List[Shard]:
+        """
+        Shards for the rest of a flat prefix (or of the shard ending at end_at) after its first
+        (undelimited) listing page.
+        """
+        sample_keys = [obj['Key'] for obj in flat_page.get('Contents', [])]
+        if not flat_page.get('IsTruncated') or not sample_keys:
+            return []
+        return [(prefix, low, high) for low, high in S3Client._key_space_shards(prefix, sample_keys, end_at)]
+
+    @staticmethod
+    def _clip_shard_page(page: Dict[str, Any], end_at: Optional[str]) -> Tuple[Dict[str, Any], bool]:
+        """Cuts a shard's listing page at end_at (inclusive). Returns the page and whether the shard is done."""
+        if end_at is None:
+            return page, False
+        contents = page.get('Contents', [])
+        in_range = [obj for obj in contents if obj['Key'] <= end_at]
+        return {'Contents': in_range}, len(in_range) < len(contents)
+
+    @staticmethod
+    def _key_space_shards(prefix: str, sample_keys: List[str],
+                          end_at: Optional[str] = None) -> List[Tuple[str, Optional[str]]]:
+        """
+        Splits the key space between a sampled page and end_at into contiguous (start_after, end_at] ranges.
+        Where the sampled keys diverge inside a number (CUR part numbers grow), the ranges follow its digit
+        positions: each digit above the last sampled key's, from the diverging digit up to the most significant
+        one, starts a range, so the first ranges hold about as many keys as the sample and later ones grow
+        tenfold per position (heavy ones are split again when listed). Otherwise the character after the
+        sample's common stem is split over LISTING_SHARD_ALPHABET.
+        """
+        last_key = sample_keys[-1]
+        diverge_at = len(os.path.commonprefix(sample_keys))
+        boundaries = []
+        position = diverge_at
+        while len(prefix) <= position < len(last_key) and last_key[position] in string.digits:
+            boundaries += [last_key[:position] + digit for digit in string.digits if digit > last_key[position]]
+            position -= 1
+        if not boundaries:
+            stem = last_key[:max(diverge_at, len(prefix))]
+            boundaries = [stem + char for char in LISTING_SHARD_ALPHABET if stem + char > last_key]
+        if end_at is not None:
+            boundaries = [boundary for boundary in boundaries if boundary < end_at]
+        return list(zip([last_key] + boundaries, boundaries + [end_at]))
+
+    def _list_shard(self, bucket: str, prefix: str, start_after: Optional[str],
+                    end_at: Optional[str]) -> Tuple[List[Dict[str, Any]], List[Shard]]:
+        """
+        Paginates one listing shard, stopping at the first key beyond end_at (inclusive bound). If the shard's first
+        page shows it goes on, the rest of it is split with that page as a new sample and returned as sub-shards to
+        list in parallel. Returns the pages listed and the sub-shards.
+        """
+        paginator = self._client_for(bucket).get_paginator('list_objects_v2')
+        paginate_args = {'Bucket': bucket, 'Prefix': prefix}
+        if start_after:
+            paginate_args['StartAfter'] = start_after
+
+        pages = []
+        for page in paginator.paginate(**paginate_args):
+            sub_shards = [] if pages else self._key_range_shards(prefix, page, end_at)
+            page, done = self._clip_shard_page(page, end_at)
+            pages.append(page)
+            if done:
+                break
+            if len(sub_shards) > 1:
+                return pages, sub_shards
+        return pages, []
+
+    def copy_single_file(self, source_bucket: str, source_key: str, dest_bucket: str, dest_key: str,
+                         size: Optional[int] = None, etag: Optional[str] = None) -> bool:
+        """
+        Copy a single file with enhanced error handling.
+        When the object size is known and above the multipart threshold, the copy is
+        split into parallel ranged UploadPartCopy requests. With the source ETag the file
+        was listed with, the copy fails if the source has changed since, and the copy records
+        it under SOURCE_ETAG_METADATA_KEY so a later sync can tell the copy is current.
+        """
         try:
-            copy_source = {'Bucket': source_bucket, 'Key': source_key}
-            self.s3_client.copy_object(CopySource=copy_source, Bucket=dest_bucket, Key=dest_key)
+            if size is not None and size > min(MULTIPART_COPY_THRESHOLD, MAX_SINGLE_COPY_SIZE):
+                self._multipart_copy(source_bucket, source_key, dest_bucket, dest_key, size, etag)
+            else:
+                copy_args = {'CopySource': {'Bucket': source_bucket, 'Key': source_key},
+                             'Bucket': dest_bucket, 'Key': dest_key}
+                if etag:
+                    copy_args.update(CopySourceIfMatch=f'"{etag}"', MetadataDirective='REPLACE',
+                                     Metadata={SOURCE_ETAG_METADATA_KEY: etag})
+                # CopyObject is served by the destination bucket's region.
+                self._client_for(dest_bucket).copy_object(**copy_args)
             logger.debug(f"Successfully copied: {os.path.basename(source_key)}")
             return True
         except ClientError as e:
@@ -98,6 +353,118 @@ class S3Client:
             logger.error(f"An unexpected error occurred during copy of {source_key}: {e}")
             return False
 
+    @staticmethod
+    def _multipart_part_size(size: int) -> int:
+        """Returns the configured part size, grown if needed to stay within the S3 part count limit."""
+        part_size = MULTIPART_COPY_PART_SIZE
+        while -(-size // part_size) > MAX_MULTIPART_PARTS:
+            part_size *= 2
+        return part_size
+
+    def _multipart_copy(self, source_bucket: str, source_key: str, dest_bucket: str, dest_key: str, size: int,
+                        etag: Optional[str] = None):
+        """
+        Copies a large object with parallel ranged UploadPartCopy requests, every part conditioned on
+        etag (or, without it, on the ETag HeadObject returns). Any failure aborts the multipart upload so no incomplete parts are left behind, then re-raises.
+        """
+        head = self._client_for(source_bucket).head_object(Bucket=source_bucket, Key=source_key)
+        # Every part is conditioned on the same ETag, so a concurrent overwrite fails the copy instead of mixing versions.
+        source_etag = f'"{etag}"' if etag else head['ETag']
+        dest_client = self._client_for(dest_bucket)
+        create_args = {'Bucket': dest_bucket, 'Key': dest_key,
+                       'Metadata': dict(head.get('Metadata', {}), **{SOURCE_ETAG_METADATA_KEY: source_etag.strip('"')})}
+        if head.get('ContentType'):
+            create_args['ContentType'] = head['ContentType']
+        upload_id = dest_client.create_multipart_upload(**create_args)['UploadId']
+
+        part_size = self._multipart_part_size(size)
+        ranges = [(part_number, start, min(start + part_size, size) - 1)
+                  for part_number, start in enumerate(range(0, size, part_size), 1)]
+        copy_source = {'Bucket': source_bucket, 'Key': source_key}
+        # Part threads count their own throttled attempts; they are credited to this thread's copy when it ends.
+        part_throttles: List[int] = []
+        logger.debug(f"Multipart copy of s3://{source_bucket}/{source_key} ({size} bytes) in {len(ranges)} parts")
+
+        try:
+            with ThreadPoolExecutor(max_workers=min(MULTIPART_COPY_PART_WORKERS, len(ranges))) as executor:
+                futures = [
+                    executor.submit(self._upload_part_copy, copy_source, source_etag, dest_bucket, dest_key,
+                                    upload_id, part_number, first_byte, last_byte, part_throttles)
+                    for part_number, first_byte, last_byte in ranges
+                ]
+                try:
+                    parts = [future.result() for future in futures]
+                except Exception:
+                    for future in futures:
+                        future.cancel()
+                    raise
+            dest_client.complete_multipart_upload(
+                Bucket=dest_bucket, Key=dest_key, UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except Exception:
+            logger.warning(f"Aborting multipart copy to s3://{dest_bucket}/{dest_key} (upload id: {upload_id})")
+            try:
+                dest_client.abort_multipart_upload(Bucket=dest_bucket, Key=dest_key, UploadId=upload_id)
+            except ClientError as abort_error:
+                logger.error(f"Failed to abort multipart upload {upload_id} for s3://{dest_bucket}/{dest_key}: {abort_error}")
+            raise
+        finally:
+            self._throttle_stats.count = getattr(self._throttle_stats, 'count', 0) + sum(part_throttles)
+
+    def _upload_part_copy(self, copy_source: Dict[str, str], source_etag: str, dest_bucket: str, dest_key: str,
+                          upload_id: str, part_number: int, first_byte: int, last_byte: int,
+                          throttles: Optional[List[int]] = None) -> Dict[str, Any]:
+        """
+        Copies one byte range of the source object into a multipart upload part. The throttled attempts
+        it saw on this thread are appended to throttles.
+        """
+        try:
+            response = self._client_for(dest_bucket).upload_part_copy(
+                CopySource=copy_source, CopySourceIfMatch=source_etag,
+                CopySourceRange=f"bytes={first_byte}-{last_byte}",
+                Bucket=dest_bucket, Key=dest_key, UploadId=upload_id, PartNumber=part_number
+            )
+        finally:
+            if throttles is not None:
+                throttles.append(self.pop_throttle_count())
+        return {'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']}
+
+
+    def delete_objects(self, bucket: str, keys: List[str]) -> bool:
+        """
+        Deletes a list of keys from an S3 bucket in batches of 1000, sent concurrently.
+
+        Returns:
+            bool: True if every key was deleted (or the list was empty), False otherwise.
+        """
+        if not keys:
+            return True
+        # The delete_objects API can take up to 1000 keys at a time. We chunk it.
+        batches = [keys[i:i + MAX_DELETE_BATCH_SIZE] for i in range(0, len(keys), MAX_DELETE_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=min(DELETE_BATCH_WORKERS, len(batches))) as executor:
+            results = list(executor.map(lambda batch: self._delete_batch(bucket, batch), batches))
+        return all(results)
+
+    def _delete_batch(self, bucket: str, keys: List[str]) -> bool:
+        """Sends one DeleteObjects request, logging every key S3 failed to delete."""
+        try:
+            response = self._client_for(bucket).delete_objects(
+                Bucket=bucket,
+                Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+            )
+        except ClientError as e:
+            logger.error(f"Failed to delete {len(keys)} objects from s3://{bucket}: {e}", exc_info=True)
+            return False
+        errors = response.get('Errors', [])
+        self.log_delete_errors(bucket, errors)
+        return not errors
+
+    @staticmethod
+    def log_delete_errors(bucket: str, errors: List[Dict[str, Any]]):
+        """Logs each per-key error of a DeleteObjects response."""
+        for error in errors:
+            logger.error(f"Failed to delete s3://{bucket}/{error.get('Key')}: {error.get('Code')} - {error.get('Message')}")
 
     def delete_objects_by_prefix(self, bucket: str, prefix: str) -> bool:
         """
@@ -112,36 +479,35 @@ class S3Client:
         """
         logger.warning(f"Preparing to delete all objects under prefix: s3://{bucket}/{prefix}")
         try:
-            # First, list all objects under the prefix
-            paginator = self.s3_client.get_paginator('list_objects_v2')
+            # Each listed page is deleted while the next one is fetched. Continuation tokens are
+            # key positions, so deleting already-listed keys does not disturb the listing.
+            paginator = self._client_for(bucket).get_paginator('list_objects_v2')
             pages = paginator.paginate(Bucket=bucket, Prefix=prefix)
-            
-            objects_to_delete = []
-            for page in pages:
-                if 'Contents' in page:
-                    for obj in page['Contents']:
-                        objects_to_delete.append({'Key': obj['Key']})
 
-            if not objects_to_delete:
+            results = []
+            pending = deque()
+            deleted = 0
+            with ThreadPoolExecutor(max_workers=DELETE_BATCH_WORKERS) as executor:
+                for page in pages:
+                    keys = [obj['Key'] for obj in page.get('Contents', [])]
+                    if not keys:
+                        continue
+                    deleted += len(keys)
+                    pending.append(executor.submit(self._delete_batch, bucket, keys))
+                    # Keep listing at most one round of batches ahead of the deletes.
+                    if len(pending) > DELETE_BATCH_WORKERS:
+                        results.append(pending.popleft().result())
+                results.extend(future.result() for future in pending)
+
+            if not deleted:
                 logger.info(f"No objects found to delete under prefix: s3://{bucket}/{prefix}")
                 return True
+            if not all(results):
+                return False
 
-            logger.info(f"Found {len(objects_to_delete)} objects to delete.")
-            
-            # The delete_objects API can take up to 1000 keys at a time. We chunk it.
-            for i in range(0, len(objects_to_delete), 1000):
-                chunk = objects_to_delete[i:i + 1000]
-                response = self.s3_client.delete_objects(
-                    Bucket=bucket,
-                    Delete={'Objects': chunk, 'Quiet': True}
-                )
-                if 'Errors' in response:
-                    logger.error(f"Errors occurred during S3 object deletion: {response['Errors']}")
-                    return False
-
-            logger.info(f"Successfully deleted all objects under prefix: s3://{bucket}/{prefix}")
+            logger.info(f"Successfully deleted {deleted} objects under prefix: s3://{bucket}/{prefix}")
             return True
-            
+
         except ClientError as e:
             logger.error(f"Failed to delete objects from s3://{bucket}/{prefix}: {e}", exc_info=True)
             return False
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Cache of inferred external table columns, keyed on a fingerprint of the staged Parquet schemas.
+
+The fingerprint hashes the Arrow schemas read from up to SCHEMA_FINGERPRINT_FILES_PER_PAYER sampled
+Parquet footers per payer under the stage location: the oldest and the newest file (CUR columns are
+added going forward) and evenly spaced files between them. A schema change confined to files that are
+not sampled is missed; INFER_SCHEMA only runs when the fingerprint changes. While it is unchanged, the
+column list cached in the staging bucket is reused. Fingerprinting needs pyarrow (a requirement of the service);
+without it, every run infers, and the service warns about it once at startup.
+"""
+import json
+import hashlib
+import logging
+from typing import List, Optional
+
+from botocore.exceptions import ClientError
+
+from config import SCHEMA_FINGERPRINT_FILES_PER_PAYER
+from parquet_compactor import arrow_s3_filesystem, PYARROW_AVAILABLE, PARQUET_SUFFIX
+
+if PYARROW_AVAILABLE:
+    import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaCache:
+    """Inferred column lists stored as s3://{bucket}/{prefix}{fingerprint}.json."""
+
+    def __init__(self, s3_client, bucket: str, prefix: str):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def fingerprint(self, stage_prefix: str) -> Optional[str]:
+        """
+        Hashes the distinct schemas of the sampled Parquet files in each payer-{id}/ prefix under stage_prefix.
+        Returns None if the schemas cannot be sampled, in which case the schema must be inferred.
+        """
+        if not PYARROW_AVAILABLE:
+            return None
+        try:
+            filesystem = arrow_s3_filesystem(self.s3_client, self.bucket)
+            schemas = set()
+            for payer_prefix in self.s3_client.list_common_prefixes(self.bucket, stage_prefix):
+                if not payer_prefix[len(stage_prefix):].startswith('payer-'):
+                    continue
+                keys = sorted(key for key in self.s3_client.list_objects_with_metadata(self.bucket, payer_prefix)
+                              if key.endswith(PARQUET_SUFFIX))
+                for key in self._sample(keys):
+                    with filesystem.open_input_file(f"{self.bucket}/{key}") as footer_source:
+                        schemas.add(pq.read_schema(footer_source).remove_metadata().to_string())
+        except Exception as e:
+            logger.warning(f"Could not fingerprint staged schemas under s3://{self.bucket}/{stage_prefix}: {e}")
+            return None
+        if not schemas:
+            return None
+        return hashlib.sha256('\n\n'.join(sorted(schemas)).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _sample(keys: List[str], count: int = SCHEMA_FINGERPRINT_FILES_PER_PAYER) -> List[str]:
+        """Up to count keys spread evenly over the sorted keys, always including the first and the last."""
+        if len(keys) <= count:
+            return keys
+        if count <= 1:
+            return keys[-1:]
+        return sorted({keys[round(i * (len(keys) - 1) / (count - 1))] for i in range(count)})
+
+    def get(self, fingerprint: str) -> Optional[List[str]]:
+        """Returns the cached column definitions for a fingerprint, or None on a miss."""
+        try:
+            return json.loads(self.s3_client.get_object(self.bucket, self._key(fingerprint)))['columns']
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+                logger.warning(f"Could not read schema cache entry {self._key(fingerprint)}: {e}")
+            return None
+
+    def put(self, fingerprint: str, columns: List[str]):
+        try:
+            self.s3_client.put_object(self.bucket, self._key(fingerprint), json.dumps({"columns": columns}).encode('utf-8'))
+        except ClientError as e:
+            logger.warning(f"Could not write schema cache entry {self._key(fingerprint)}: {e}")
+
+    def _key(self, fingerprint: str) -> str:
+        return f"{self.prefix}{fingerprint}.json"
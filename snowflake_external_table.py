@@ -2,18 +2,48 @@
 # snowflake_external_table.py (Corrected with proper DDL construction)
 #
 import os
-import json
+import re
+import time
+import uuid
+import hashlib
 import logging
-import boto3
+import threading
 import snowflake.connector
 from typing import Dict, Any, List, Tuple, Optional
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from botocore.exceptions import ClientError
 
-from config import SNOWFLAKE_CONFIG
+from config import (SNOWFLAKE_CONFIG, COMPACTION_OUTPUT_DIR, SQL_PARALLEL_ENABLED, ANALYTICS_SQL_MODE,
+                    ANALYTICS_INCREMENTAL_LOOKBACK_HOURS, ANALYTICS_LOAD_MODE, ANALYTICS_LOAD_TABLE_STALE_HOURS,
+                    SNOWFLAKE_ASYNC_POLL_SECONDS, SNOWFLAKE_ASYNC_TIMEOUT_SECONDS)
+from sql_script_runner import SqlScriptRunner, SqlScriptError
+from column_projection import project_columns, script_hash
+from snowflake_session import snowflake_sessions
 
 logger = logging.getLogger(__name__)
 
+# Staged files live under payer-{id}/ below the stage URL, so the payer can be derived from
+# METADATA$FILENAME. Partitioning on it lets `payer_partition in (...)` filters prune whole payer prefixes.
+PAYER_PARTITION_COLUMN = 'payer_partition'
+PAYER_PARTITION_EXPRESSION = "split_part(split_part(metadata$filename, 'payer-', 2), '/', 1)"
+
+# The script reads the month's external table under this name. In 'internal' load mode, it is
+# pointed at the run's load table instead.
+ANALYTICS_SOURCE_TABLE_TEMPLATE = 'analytics_application_table_#startyear_#startmonth'
+# Keys of the CUR product map the script reads, projected once into typed columns so the script filters on
+# columns instead of LATERAL FLATTENing product:key_value (which multiplies every scanned row by the map size).
+PRODUCT_ATTRIBUTE_COLUMNS = {'product_product_name': 'product_name', 'product_region': 'region'}
+PRODUCT_SOURCE_COLUMN = 'product'
+ANALYTICS_SCRIPT_PATH = "analytics_wastage_queries.sql"
+ANALYTICS_STAGE_NAME = 'wastage_analytics_stage_application'
+ANALYTICS_LOAD_TABLE_PREFIX = 'analytics_application_load_'
+# Inferred column definitions look like `name type AS (expression)`.
+_COLUMN_DEFINITION_RE = re.compile(r'^(\S+)\s+(.+?)\s+as\s+\((.*)\)$', re.IGNORECASE | re.DOTALL)
+
+# Session pool profiles: SNOWFLAKE_CONFIG, and the prod analytics secret.
+SNOWFLAKE_CONFIG_PROFILE = 'snowflake_config'
+PROD_ANALYTICS_SECRET_ID = 'snowflake/jenkins/payer/cln_data_payer_summary_prod'
+
 def _split_s3_path(s3_path: str) -> Tuple[str, str]:
     """Splits an s3 path like 's3://bucket/path/to/folder' into bucket and path."""
     if s3_path.startswith("s3://"):
@@ -23,6 +53,21 @@ def _split_s3_path(s3_path: str) -> Tuple[str, str]:
     key = parts[1] if len(parts) > 1 else ''
     return bucket.strip(), key.strip()
 
+def product_attribute_expression(product: str, key: str) -> str:
+    """SQL for one key of a CUR product map column ({key_value: [{key, value}, ...]}) as varchar, without FLATTEN."""
+    return f"GET(GET(FILTER({product}:key_value::array, entry -> entry:key = '{key}'), 0), 'value')::varchar"
+
+def _like_literal(value: str) -> str:
+    """
+    Escapes the LIKE wildcards of a name for a SHOW ... LIKE '...' pattern. The backslash is doubled
+    because it is also the escape character of the string literal itself.
+    """
+    return value.replace('_', '\\\\_').replace('%', '\\\\%')
+
+def _column_name(definition: str) -> str:
+    """The column name of an inferred `name type AS (expression)` definition."""
+    return definition.strip().split(None, 1)[0].lower()
+
 class SnowflakeConfigFetcher:
     """Fetches and processes payer configuration from a dedicated Snowflake table."""
     def __init__(self, env: str):
@@ -36,7 +81,7 @@ class SnowflakeConfigFetcher:
     def _connect(self):
         try:
             logger.info(f"Connecting to Snowflake to fetch payer configurations for env: {self.env}")
-            self.connection = snowflake.connector.connect(**self.snowflake_params)
+            self.connection = snowflake_sessions.acquire(SNOWFLAKE_CONFIG_PROFILE, lambda: self.snowflake_params)
             self.cursor = self.connection.cursor()
             logger.info("Successfully connected to Snowflake for config fetching.")
         except Exception as e:
@@ -45,7 +90,8 @@ class SnowflakeConfigFetcher:
 
     def _close(self):
         if self.cursor: self.cursor.close()
-        if self.connection: self.connection.close()
+        if self.connection: snowflake_sessions.release(SNOWFLAKE_CONFIG_PROFILE, self.connection)
+        self.connection = self.cursor = None
 
     def get_payer_configs(self) -> Dict[str, Any]:
         """Fetches and maps payer configs from the Snowflake table."""
@@ -81,12 +127,19 @@ class SnowflakeExternalTableManager:
         self.module = module.lower()
         self.connection = None
         self.cursor = None
+        self._connection_lock = threading.Lock()
+        # Set for a table refresh run; tags and records every statement of the refresh.
+        self.profiler = None
         logger.info(f"Initializing SnowflakeExternalTableManager for {self.module} in {self.env}")
 
     def get_last_processed_timestamp(self, payer_id: str) -> Optional[datetime]:
-        """Queries the final table to get the latest timestamp for a specific payer."""
-        if not self.connection or not self.cursor or self.connection.is_closed():
-            self.connect()
+        """
+        Queries the final table to get the latest timestamp for a specific payer.
+        Safe to call from several threads: the connection is shared, but each call uses its own cursor.
+        """
+        with self._connection_lock:
+            if not self.connection or not self.cursor or self.connection.is_closed():
+                self.connect()
         
         query = """
         SELECT MAX(LINEITEM_USAGESTARTDATE) 
@@ -95,8 +148,9 @@ class SnowflakeExternalTableManager:
         """
         try:
             logger.info(f"Querying for last processed timestamp for payer {payer_id}")
-            self.cursor.execute(query, (payer_id,))
-            result = self.cursor.fetchone()
+            with self.connection.cursor() as cursor:
+                cursor.execute(query, (payer_id,))
+                result = cursor.fetchone()
             if result and result[0]:
                 last_timestamp = result[0]
                 logger.info(f"Last processed timestamp for payer {payer_id} is {last_timestamp}")
@@ -109,20 +163,35 @@ class SnowflakeExternalTableManager:
             return None
 
     def get_secret_value(self, secret_id: str) -> Dict[str, Any]:
-        """Get secret from AWS Secrets Manager."""
+        """Get secret from AWS Secrets Manager, through the session pool's TTL cache."""
         try:
-            client = boto3.client('secretsmanager', region_name='us-east-1')
-            response = client.get_secret_value(SecretId=secret_id)
-            return json.loads(response['SecretString'])
+            return snowflake_sessions.get_secret(secret_id)
         except ClientError as e:
             logger.error(f"Could not retrieve secret {secret_id}: {e}")
             raise
 
+    def _analytics_profile(self) -> str:
+        return f"secret:{PROD_ANALYTICS_SECRET_ID}" if self.env == 'prod' else SNOWFLAKE_CONFIG_PROFILE
+
     def create_db_connection_analytics(self) -> snowflake.connector.SnowflakeConnection:
-        """Create Snowflake connection for analytics module, aware of environment."""
+        """
+        Borrow a Snowflake session for analytics module, aware of environment.
+        Hand it back with release_db_connection_analytics.
+        """
+        return snowflake_sessions.acquire(self._analytics_profile(), self._analytics_connect_params)
+
+    def release_db_connection_analytics(self, connection):
+        snowflake_sessions.release(self._analytics_profile(), connection)
+
+    def analytics_session(self):
+        """Context manager borrowing an analytics session from the pool."""
+        return snowflake_sessions.session(self._analytics_profile(), self._analytics_connect_params)
+
+    def _analytics_connect_params(self) -> Dict[str, Any]:
+        """Connection parameters for a new analytics session."""
         if self.env == 'prod':
             logger.info("Connecting to Snowflake PROD environment for analytics")
-            secret_id = 'snowflake/jenkins/payer/cln_data_payer_summary_prod'
+            secret_id = PROD_ANALYTICS_SECRET_ID
             secret = self.get_secret_value(secret_id)
 
             if not secret:
@@ -135,10 +204,10 @@ class SnowflakeExternalTableManager:
             secret['warehouse'] = override_warehouse
             
             logger.info(f"Connecting with user '{secret.get('user')}' and overridden warehouse '{secret.get('warehouse')}'")
-            return snowflake.connector.connect(**secret)
+            return secret
         else:
             logger.info(f"Connecting to Snowflake UAT/Non-Prod for analytics (env: {self.env})")
-            return snowflake.connector.connect(**SNOWFLAKE_CONFIG)
+            return SNOWFLAKE_CONFIG
 
     def connect(self):
         """Establish Snowflake connection based on module and environment."""
@@ -154,25 +223,56 @@ class SnowflakeExternalTableManager:
             raise
 
     def close_connection(self):
+        """Closes the cursor and returns the session to the pool."""
         if self.cursor: self.cursor.close()
-        if self.connection and not self.connection.is_closed(): self.connection.close()
-        logger.info("Snowflake connection closed")
+        if self.connection: self.release_db_connection_analytics(self.connection)
+        self.connection = self.cursor = None
+        logger.info("Snowflake session returned to the pool")
     
     def get_storage_integration(self) -> str:
         return 'AWS_S3_CK_DATAPIPELINE_NON_PROD_INC' if self.env != 'prod' else 'aws_s3_billdesk'
 
-    def table_refresh(self, year: int, month: int, staging_bucket: str, payer_ids: List[str], app: str):
+    def table_refresh(self, year: int, month: int, staging_bucket: str, payer_ids: List[str], app: str,
+                      run_id: Optional[str] = None, compaction_id: Optional[str] = None, schema_cache=None,
+                      schema_fingerprint: Optional[str] = None):
         if not self.connection or not self.cursor:
             raise ValueError("Snowflake connection not established.")
         if self.module == 'analytics':
-            self._process_analytics_module(year, month, staging_bucket, payer_ids, app)
+            self._process_analytics_module(year, month, staging_bucket, payer_ids, app, run_id, compaction_id,
+                                           schema_cache, schema_fingerprint)
         else:
             raise ValueError(f"Unsupported module for table refresh: {self.module}")
 
-    def _process_analytics_module(self, year: int, month: int, staging_bucket: str, payer_ids: List[str], app: str):
-        """Process analytics module - create stage, infer schema, create external table, and run queries."""
-        stage_name = 'wastage_analytics_stage_application'
-        stage_url = f's3://{staging_bucket}/{app}/{self.module}/{self.env}/year={year}/month={month}/'
+    def _process_analytics_module(self, year: int, month: int, staging_bucket: str, payer_ids: List[str], app: str,
+                                  run_id: Optional[str] = None, compaction_id: Optional[str] = None, schema_cache=None,
+                                  schema_fingerprint: Optional[str] = None):
+        """
+        Process analytics module - create stage, infer schema, create external table, and run queries.
+        With a run_id (versioned staging), the stage points at that run's prefix only; with a compaction_id,
+        it points at that generation of the compacted copy of the staged files.
+        INFER_SCHEMA is skipped when schema_cache holds columns for schema_fingerprint, and the stage and
+        external table are only recreated when their DDL changed; otherwise the table is just refreshed.
+        """
+        table_name, load_columns = self.prepare_external_table(year, month, staging_bucket, payer_ids, app, run_id,
+                                                               compaction_id, schema_cache, schema_fingerprint)
+        self.run_analytics(year, month, payer_ids, table_name, load_columns)
+
+    def prepare_external_table(self, year: int, month: int, staging_bucket: str, payer_ids: List[str], app: str,
+                               run_id: Optional[str] = None, compaction_id: Optional[str] = None, schema_cache=None,
+                               schema_fingerprint: Optional[str] = None) -> Tuple[str, List[str]]:
+        """
+        Creates (or refreshes) the stage and the month's external table; see _process_analytics_module.
+        Returns the table name and the column definitions an internal load of it needs.
+        """
+        stage_name = ANALYTICS_STAGE_NAME
+        if ANALYTICS_LOAD_MODE == 'internal':
+            self.drop_stale_load_tables()
+        stage_root = f'{app}/{self.module}/{self.env}/' + (f'{COMPACTION_OUTPUT_DIR}/' if compaction_id else '')
+        stage_url = f's3://{staging_bucket}/{stage_root}year={year}/month={month}/'
+        if run_id:
+            stage_url += f'run={run_id}/'
+        if compaction_id:
+            stage_url += f'gen={compaction_id}/'
         storage_integration = self.get_storage_integration()
         
         create_stage_query = f"""
@@ -182,90 +282,341 @@ class SnowflakeExternalTableManager:
         FILE_FORMAT = (TYPE = 'PARQUET', COMPRESSION = 'SNAPPY');
         """
 
-        logger.info(f"stage_query: {create_stage_query}")
-        logger.info(f"Creating analytics stage '{stage_name}' with URL: {stage_url}")
-        self.cursor.execute(create_stage_query)
-        logger.info("Analytics stage created successfully.")
-
-        
-        query = f'''SELECT COLUMN_NAME,TYPE,EXPRESSION,COLUMN_NAME || ' ' || TYPE || ' AS ' || '(' || EXPRESSION || ')' FROM TABLE(
-                                INFER_SCHEMA(
-                                LOCATION=> '@{stage_name}',
-                                file_format => 'parquet_working_format'
-                                                ));'''
-
-
-        self.cursor.execute(query)
-        cur_schema: list = self.cursor.fetchall()
-        cur_columns: list = [x[3].lower() for x in cur_schema]
-
-        logger.info(f"query stage name: {query}")
-
-
-        logger.info("🔍 Inferring schema from Parquet files...")
-        columns_result: str = ", ".join(cur_columns)
+        # Like the external table below, the stage carries a hash of its DDL in its comment, so a change of
+        # URL, storage integration or file format recreates it.
+        stage_comment = "ddl_sha256=" + hashlib.sha256(create_stage_query.encode('utf-8')).hexdigest()
+        stage_current = self._show_value(f"SHOW STAGES LIKE '{_like_literal(stage_name)}'", 'comment',
+                                         'stage') == stage_comment
+        if stage_current:
+            logger.info(f"Analytics stage '{stage_name}' is unchanged (URL {stage_url}); keeping it.")
+        else:
+            logger.info(f"stage_query: {create_stage_query}")
+            logger.info(f"Creating analytics stage '{stage_name}' with URL: {stage_url}")
+            self._execute(create_stage_query.rstrip().rstrip(';') + f"\n        COMMENT = '{stage_comment}';", 'stage')
+            logger.info("Analytics stage created successfully.")
+
+        cur_columns = schema_cache.get(schema_fingerprint) if schema_cache and schema_fingerprint else None
+        if cur_columns is not None:
+            logger.info(f"Staged schema fingerprint {schema_fingerprint[:12]} is unchanged; reusing cached columns "
+                        f"instead of INFER_SCHEMA.")
+        else:
+            query = f'''SELECT COLUMN_NAME,TYPE,EXPRESSION,COLUMN_NAME || ' ' || TYPE || ' AS ' || '(' || EXPRESSION || ')' FROM TABLE(
+                                    INFER_SCHEMA(
+                                    LOCATION=> '@{stage_name}',
+                                    file_format => 'parquet_working_format'
+                                                    ));'''
+
+            logger.info("🔍 Inferring schema from Parquet files...")
+            logger.info(f"query stage name: {query}")
+            self._execute(query, 'infer_schema')
+            cur_schema: list = self.cursor.fetchall()
+            cur_columns = [x[3].lower() for x in cur_schema]
+            if schema_cache and schema_fingerprint:
+                schema_cache.put(schema_fingerprint, cur_columns)
+
+        projected_columns = self._project_columns(year, month, payer_ids, cur_columns)
+        columns_result: str = ", ".join(projected_columns)
 
         table_name = f"analytics_application_table_{year}_{month}"
+        partition_column = f"{PAYER_PARTITION_COLUMN} varchar AS ({PAYER_PARTITION_EXPRESSION})"
+        product_columns = ", ".join(f"{column} varchar AS ({product_attribute_expression('value:product', key)})"
+                                    for column, key in PRODUCT_ATTRIBUTE_COLUMNS.items())
         create_external_table = f'''CREATE OR REPLACE EXTERNAL TABLE {table_name}
-                                ({columns_result})
+                                ({columns_result}, {product_columns}, {partition_column})
+                                PARTITION BY ({PAYER_PARTITION_COLUMN})
                                 LOCATION = @{stage_name},
-                                FILE_FORMAT = (TYPE = 'PARQUET' COMPRESSION = 'SNAPPY');'''
-        
-        self.cursor.execute(create_external_table)
-
-
-
+                                FILE_FORMAT = (TYPE = 'PARQUET' COMPRESSION = 'SNAPPY')'''
+        # The DDL hash is kept in the table comment, so an identical table can be refreshed instead of rebuilt.
+        ddl_comment = "ddl_sha256=" + hashlib.sha256((create_stage_query + create_external_table).encode('utf-8')).hexdigest()
+
+        if stage_current and self._show_value(f"SHOW EXTERNAL TABLES LIKE '{_like_literal(table_name)}'", 'comment',
+                                              'external_table') == ddl_comment:
+            logger.info(f"External table '{table_name}' DDL is unchanged; refreshing it instead of recreating it.")
+            self._execute(f"ALTER EXTERNAL TABLE {table_name} REFRESH", 'external_table')
+            logger.info(f"External table '{table_name}' refreshed.")
+        else:
+            create_external_table += f"\n                                COMMENT = '{ddl_comment}';"
+            logger.info(f"Creating external table: {create_external_table}")
+            self._execute(create_external_table, 'external_table')
+            logger.info(f"External table '{table_name}' created successfully with inferred schema.")
+
+        product_source = [column for column in cur_columns if _column_name(column) == PRODUCT_SOURCE_COLUMN]
+        return table_name, projected_columns + product_source
+
+    def refresh_payer_paths(self, table_name: str, payer_ids: List[str]):
+        """Registers the files staged under each payer's payer-{id}/ subpath with the external table."""
+        for payer_id in payer_ids:
+            self._execute(f"ALTER EXTERNAL TABLE {table_name} REFRESH 'payer-{payer_id}/'", 'external_table')
+        logger.info(f"External table '{table_name}' refreshed for payers {payer_ids}.")
+
+    def run_analytics(self, year: int, month: int, payer_ids: List[str], table_name: str, load_columns: List[str],
+                      asynchronous: bool = False):
+        """
+        Runs the analytics script for the payers over the external table, or over a transient load of it in
+        ANALYTICS_LOAD_MODE 'internal'. With asynchronous, the script is submitted with execute_async and its
+        query ID polled until it finishes.
+        """
+        load_table = None
+        if ANALYTICS_LOAD_MODE == 'internal':
+            load_table = self._load_internal_table(ANALYTICS_STAGE_NAME, year, month, load_columns, payer_ids)
+        try:
+            self._run_analytics_queries(year, month, payer_ids, load_table or table_name, asynchronous)
+        finally:
+            if load_table:
+                self._execute(f"DROP TABLE IF EXISTS {load_table}", 'load')
 
+    def _project_columns(self, year: int, month: int, payer_ids: List[str], cur_columns: List[str]) -> List[str]:
+        """
+        The inferred column definitions the analytics script reads (see column_projection); all of them if the
+        script is missing. Raises ValueError if the script reads a column the staged files don't have.
+        """
+        template = self._read_analytics_script()
+        if template is None:
+            return cur_columns
+        definitions = {_column_name(column): column for column in cur_columns}
+        rendered = self._render_analytics_script(template, year, month, payer_ids,
+                                                 watermarks_sql=self._watermarks_sql(year, month, payer_ids, {}))
+        projected = project_columns(rendered, definitions, derived=[*PRODUCT_ATTRIBUTE_COLUMNS, PAYER_PARTITION_COLUMN],
+                                    cache_key=script_hash(template))
+        logger.info(f"Projecting {len(projected)} of {len(cur_columns)} staged columns read by the analytics script.")
+        return [definitions[name] for name in projected]
+
+    def _load_internal_table(self, stage_name: str, year: int, month: int, columns: List[str],
+                             payer_ids: List[str]) -> Optional[str]:
+        """
+        Loads the run's payers from the stage into a new transient table holding only the given columns, sorted by
+        payer and usage hour so that micro-partitions line up with payers without background clustering.
+        Returns the table name, or None if the load failed and the script should read the external table.
+        """
+        definitions = {}
+        for column in columns:
+            match = _COLUMN_DEFINITION_RE.match(column.strip())
+            if match:
+                definitions[match.group(1)] = (match.group(2), match.group(3))
+        product_source = definitions.pop(PRODUCT_SOURCE_COLUMN, None)
+        if product_source is None:
+            logger.warning(f"Staged files have no '{PRODUCT_SOURCE_COLUMN}' column; product attributes will be NULL.")
+
+        load_table = f"{ANALYTICS_LOAD_TABLE_PREFIX}{year}_{month}_{uuid.uuid4().hex[:8]}"
+        column_ddl = ", ".join(f"{name} {column_type}" for name, (column_type, _) in definitions.items())
+        create_load_table = f'''CREATE TRANSIENT TABLE {load_table}
+                                ({column_ddl}, {", ".join(f"{column} varchar" for column in PRODUCT_ATTRIBUTE_COLUMNS)},
+                                 {PAYER_PARTITION_COLUMN} varchar)
+                                DATA_RETENTION_TIME_IN_DAYS = 0'''
+        selected = [f"{expression} AS {name}" for name, (_, expression) in definitions.items()]
+        selected += [f"{product_attribute_expression(product_source[1], key) if product_source else 'NULL'} AS {column}"
+                     for column, key in PRODUCT_ATTRIBUTE_COLUMNS.items()]
+        selected.append(f"{PAYER_PARTITION_EXPRESSION} AS {PAYER_PARTITION_COLUMN}")
+        sort_keys = [PAYER_PARTITION_COLUMN] + [name for name in ('line_item_usage_start_date',) if name in definitions]
+        payer_pattern = "|".join(re.escape(payer_id) for payer_id in payer_ids) if payer_ids else ''
+        insert_sorted = f'''INSERT INTO {load_table} ({", ".join(definitions)}, {", ".join(PRODUCT_ATTRIBUTE_COLUMNS)}, {PAYER_PARTITION_COLUMN})
+                        SELECT {", ".join(selected)}
+                        FROM @{stage_name} (PATTERN => '.*payer-({payer_pattern})/.*')
+                        ORDER BY {", ".join(sort_keys)}'''
+        try:
+            logger.info(f"Loading {len(payer_ids)} payers into transient table '{load_table}'.")
+            self._execute(create_load_table, 'load')
+            self._execute(insert_sorted, 'load')
+            row = self.cursor.fetchone()
+            logger.info(f"Loaded {row[0] if row else 0} rows into '{load_table}'.")
+            return load_table
+        except Exception as e:
+            logger.error(f"Loading '{load_table}' failed; the analytics script will read the external table: {e}")
+            try:
+                self._execute(f"DROP TABLE IF EXISTS {load_table}", 'load')
+            except Exception as drop_error:
+                logger.warning(f"Could not drop '{load_table}': {drop_error}")
+            return None
 
+    def drop_stale_load_tables(self):
+        """
+        Drops load tables left behind by runs that crashed before their cleanup, i.e. those older than
+        ANALYTICS_LOAD_TABLE_STALE_HOURS. Younger ones may belong to a run that is still going.
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=ANALYTICS_LOAD_TABLE_STALE_HOURS)
+        try:
+            self._execute(f"SHOW TABLES LIKE '{_like_literal(ANALYTICS_LOAD_TABLE_PREFIX)}%'", 'load')
+            names = [description[0].lower() for description in self.cursor.description]
+            stale = []
+            for row in self.cursor.fetchall():
+                table = dict(zip(names, row))
+                created_on = table['created_on']
+                if created_on.tzinfo is None:
+                    created_on = created_on.replace(tzinfo=timezone.utc)
+                if created_on < cutoff:
+                    stale.append(table['name'])
+            for name in stale:
+                self._execute(f"DROP TABLE IF EXISTS {name}", 'load')
+            if stale:
+                logger.info(f"Dropped {len(stale)} stale load tables: {stale}")
+        except Exception as e:
+            logger.warning(f"Could not clean up stale load tables: {e}")
 
+    def _execute(self, query: str, section: str, params=None):
+        """Executes on the manager's cursor, tagged and recorded by the profiler when one is set."""
+        if self.profiler:
+            return self.profiler.execute(self.cursor, query, section, params=params)
+        return self.cursor.execute(query, params) if params is not None else self.cursor.execute(query)
 
-        logger.info(f"Creating external table: {create_external_table}")
-        # self.cursor.execute(create_external_table)
-        logger.info(f"External table '{table_name}' created successfully with inferred schema.")
+    def _execute_and_poll(self, query: str, section: str):
+        """
+        Submits query with execute_async and polls its query ID every SNOWFLAKE_ASYNC_POLL_SECONDS. Raises the
+        query's error if it failed, and cancels it after SNOWFLAKE_ASYNC_TIMEOUT_SECONDS.
+        """
+        if self.profiler:
+            query_id = self.profiler.execute_async(self.cursor, query, section)
+        else:
+            self.cursor.execute_async(query)
+            query_id = self.cursor.sfqid
+        logger.info(f"Submitted {section} as query {query_id}.")
+        deadline = time.monotonic() + SNOWFLAKE_ASYNC_TIMEOUT_SECONDS
+        while self.connection.is_still_running(self.connection.get_query_status_throw_if_error(query_id)):
+            if time.monotonic() > deadline:
+                self.cursor.execute("SELECT SYSTEM$CANCEL_QUERY(%s)", (query_id,))
+                raise TimeoutError(f"Query {query_id} ({section}) still running after "
+                                   f"{SNOWFLAKE_ASYNC_TIMEOUT_SECONDS}s; cancelled.")
+            time.sleep(SNOWFLAKE_ASYNC_POLL_SECONDS)
+        logger.info(f"Query {query_id} ({section}) finished.")
+
+    def _show_value(self, show_query: str, column: str, section: str) -> Optional[str]:
+        """Runs a SHOW ... LIKE command and returns one column of its first row, or None if nothing matched."""
+        self._execute(show_query, section)
+        row = self.cursor.fetchone()
+        if not row:
+            return None
+        names = [description[0].lower() for description in self.cursor.description]
+        return row[names.index(column)] if column in names else None
 
-        logger.info(f"Refreshing external table: {table_name}")
+    def get_payer_watermarks(self, year: int, month: int, payer_ids: List[str]) -> Dict[str, datetime]:
+        """
+        Latest LINEITEM_USAGESTARTDATE per payer already in the month's wastage rows, taking the earliest
+        across the payer's products so that no product is left behind. Payers without rows are omitted,
+        and so is every payer if the lookup fails.
+        """
+        if not payer_ids:
+            return {}
+        query = f"""
+        SELECT BILL_PAYERACCOUNTID, MIN(MAX_STARTDATE) FROM (
+            SELECT BILL_PAYERACCOUNTID, PRODUCT_NAME, MAX(LINEITEM_USAGESTARTDATE) AS MAX_STARTDATE
+            FROM CK_ANALYTICS_APPLICATION_RI_WASTAGE_HOURLY
+            WHERE MYCLOUD_STARTYEAR = %s AND MYCLOUD_STARTMONTH = %s
+            AND BILL_PAYERACCOUNTID IN ({', '.join(['%s'] * len(payer_ids))})
+            GROUP BY 1, 2)
+        GROUP BY 1
+        """
+        try:
+            self._execute(query, 'watermarks', (year, month, *payer_ids))
+            watermarks = {str(payer_id): max_startdate for payer_id, max_startdate in self.cursor.fetchall() if max_startdate}
+        except Exception as e:
+            logger.warning(f"Could not read payer watermarks, rebuilding the whole month: {e}")
+            return {}
+        logger.info(f"Incremental mode: {len(watermarks)}/{len(payer_ids)} payers already have rows for {year}-{month:02}.")
+        return watermarks
 
-        self._run_analytics_queries(year, month, payer_ids)
+    @staticmethod
+    def _watermarks_sql(year: int, month: int, payer_ids: List[str], watermarks: Dict[str, datetime]) -> str:
+        """
+        A (payer_id, watermark) relation for #payer_watermarks: the hour each payer's rows are rebuilt from.
+        Payers without a watermark (all of them in 'full' mode) start at the beginning of the month.
+        """
+        month_start = datetime(year, month, 1)
+        month_end = datetime(year + month // 12, month % 12 + 1, 1) - timedelta(hours=1)
+        rows = []
+        for payer_id in payer_ids or ['']:
+            watermark = month_start
+            if payer_id in watermarks:
+                rebuild_from = watermarks[payer_id].replace(tzinfo=None, minute=0, second=0, microsecond=0)
+                watermark = min(max(rebuild_from - timedelta(hours=ANALYTICS_INCREMENTAL_LOOKBACK_HOURS), month_start), month_end)
+                logger.info(f"Payer {payer_id}: rebuilding wastage rows from {watermark}.")
+            rows.append(f"('{payer_id}', '{watermark:%Y-%m-%d %H:%M:%S}')")
+        return f"(select column1 as payer_id, column2::timestamp_ntz as watermark from values {', '.join(rows)})"
+
+    @staticmethod
+    def _read_analytics_script() -> Optional[str]:
+        if not os.path.exists(ANALYTICS_SCRIPT_PATH):
+            logger.warning(f"Analytics query file not found: {ANALYTICS_SCRIPT_PATH}. Skipping.")
+            return None
+        with open(ANALYTICS_SCRIPT_PATH, "r") as f:
+            return f.read()
 
-    def _run_analytics_queries(self, year: int, month: int, payer_ids: List[str]):
-        query_file_path = "analytics_wastage_queries.sql"
-        if not os.path.exists(query_file_path):
-            logger.warning(f"Analytics query file not found: {query_file_path}. Skipping.")
+    @staticmethod
+    def _render_analytics_script(query_sql: str, year: int, month: int, payer_ids: List[str],
+                                 source_table: Optional[str] = None, watermarks_sql: str = '',
+                                 scope_total_units: bool = False) -> str:
+        """
+        Substitutes the script's placeholders. With scope_total_units, the final total-units UPDATE only touches
+        the payers' rows from their watermarks on; otherwise it recomputes the whole month, as in 'full' mode.
+        """
+        payer_ids_sql_str = ",".join([f"'{p}'" for p in payer_ids]) if payer_ids else "''"
+
+        if source_table:
+            query_sql = query_sql.replace(ANALYTICS_SOURCE_TABLE_TEMPLATE, source_table)
+        query_sql = query_sql.replace('#total_units_watermarks_from',
+                                      'from #payer_watermarks w' if scope_total_units else '')
+        query_sql = query_sql.replace('#total_units_watermarks_filter',
+                                      'and bill_payeraccountid = w.payer_id and lineitem_usagestartdate >= w.watermark'
+                                      if scope_total_units else '')
+        query_sql = query_sql.replace('#payer_watermarks', watermarks_sql)
+        query_sql = query_sql.replace('#startyear', str(year))
+        query_sql = query_sql.replace('#startmonth', str(month))
+        query_sql = query_sql.replace('(#payers_ids)', f"({payer_ids_sql_str})")
+        query_sql = query_sql.replace('(#payers_id)', f"({payer_ids_sql_str})")
+        return query_sql
+
+    def _run_analytics_queries(self, year: int, month: int, payer_ids: List[str], source_table: Optional[str] = None,
+                               asynchronous: bool = False):
+        query_sql = self._read_analytics_script()
+        if query_sql is None:
             return
 
-        logger.info(f"Attempting to run analytics queries from: {query_file_path}")
+        logger.info(f"Attempting to run analytics queries from: {ANALYTICS_SCRIPT_PATH}")
         try:
-            with open(query_file_path, "r") as f:
-                query_sql = f.read()
-            
-            payer_ids_sql_str = ",".join([f"'{p}'" for p in payer_ids]) if payer_ids else "''"
-            
-            query_sql = query_sql.replace('#startyear', str(year))
-            query_sql = query_sql.replace('#startmonth', str(month))
-            query_sql = query_sql.replace('(#payers_ids)', f"({payer_ids_sql_str})")
-            query_sql = query_sql.replace('(#payers_id)', f"({payer_ids_sql_str})")
-            
+            watermarks = self.get_payer_watermarks(year, month, payer_ids) if ANALYTICS_SQL_MODE == 'incremental' else {}
+            # Concurrent pipelined groups and incremental runs only own their payers' rows from the watermarks on.
+            query_sql = self._render_analytics_script(query_sql, year, month, payer_ids, source_table,
+                                                      self._watermarks_sql(year, month, payer_ids, watermarks),
+                                                      scope_total_units=ANALYTICS_SQL_MODE == 'incremental' or asynchronous)
+
             logger.info("--- EXECUTING FINAL SNOWFLAKE SCRIPT ---")
             logger.info(query_sql[:1000] + "...")
             logger.info("-----------------------------------------")
 
-            self.cursor.execute(query_sql)
+            if asynchronous:
+                self._execute_and_poll(self.profiler.tag_script(query_sql) if self.profiler else query_sql,
+                                       'analytics_script')
+            elif SQL_PARALLEL_ENABLED:
+                SqlScriptRunner(self.analytics_session, profiler=self.profiler).run(query_sql)
+            else:
+                self._execute(query_sql, 'analytics_script')
             logger.info("All analytics queries/script executed successfully.")
+        except SqlScriptError:
+            # Chains of the parallel runner failed: the run's analytics are incomplete, so the run must fail.
+            raise
         except Exception as e:
+            if asynchronous:
+                # A pipelined group whose script failed must be reported as failed, not as processed.
+                logger.error(f"Analytics script failed for payers {payer_ids}: {e}")
+                raise
             logger.error(f"A NON-FATAL ERROR occurred while executing analytics queries: {e}")
 
 
 def create_external_table_and_process(env: str, module: str, year: int, month: int,
-                                    staging_bucket: str, payer_ids: List[str], app: str):
+                                    staging_bucket: str, payer_ids: List[str], app: str,
+                                    run_id: Optional[str] = None, compaction_id: Optional[str] = None, schema_cache=None,
+                                    schema_fingerprint: Optional[str] = None, profiler=None):
     snowflake_manager = None
     try:
         snowflake_manager = SnowflakeExternalTableManager(env, module)
+        snowflake_manager.profiler = profiler
         snowflake_manager.connect()
-        snowflake_manager.table_refresh(year, month, staging_bucket, payer_ids, app)
+        snowflake_manager.table_refresh(year, month, staging_bucket, payer_ids, app, run_id, compaction_id,
+                                        schema_cache, schema_fingerprint)
         return True
     except Exception as e:
         logger.error(f"Failed to create external table and process data: {e}", exc_info=True)
         raise
     finally:
         if snowflake_manager:
+            if profiler and snowflake_manager.cursor:
+                profiler.harvest(snowflake_manager.cursor)
             snowflake_manager.close_connection()
\ No newline at end of file
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Pipelined Snowflake processing: payer groups are refreshed and analysed while other payers are still copying.
+
+The copy pipeline reports each payer whose files are fully staged. Once SNOWFLAKE_PIPELINE_GROUP_SIZE of
+them are ready, the group is handed to a worker. The first group creates (or refreshes) the stage and the
+month's external table; every group then refreshes the table for its payers' payer-{id}/ subpaths and
+submits its analytics script with execute_async, polling the query ID until it finishes. Each group runs
+on its own pooled session, so the temp tables of concurrent scripts don't collide. The table is set up
+from the payers staged when the first group gets there, so once every group is done its schema is checked
+against the whole month again (see _recheck_schema).
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Optional, Tuple
+
+from config import SNOWFLAKE_PIPELINE_GROUP_SIZE, SNOWFLAKE_PIPELINE_MAX_GROUPS
+from copy_pipeline import PayerCopyProgress
+from snowflake_external_table import SnowflakeExternalTableManager
+
+logger = logging.getLogger(__name__)
+
+
+class PipelinedSnowflakeProcessor:
+    """
+    Groups staged payers and processes each group in the background.
+    payer_staged() is the StreamingCopyPipeline on_payer_complete callback; finish() waits for every group,
+    and cancel() drops the groups not yet started when the run fails before it gets to finish().
+    """
+
+    def __init__(self, env: str, module: str, year: int, month: int, staging_bucket: str, app: str,
+                 schema_cache=None, stage_prefix: Optional[str] = None, profiler=None,
+                 group_size: int = SNOWFLAKE_PIPELINE_GROUP_SIZE, max_groups: int = SNOWFLAKE_PIPELINE_MAX_GROUPS):
+        """With schema_cache, the stage_prefix (the staged month) is fingerprinted when the table is first set up."""
+        self.env = env
+        self.module = module
+        self.year = year
+        self.month = month
+        self.staging_bucket = staging_bucket
+        self.app = app
+        self.schema_cache = schema_cache
+        self.stage_prefix = stage_prefix
+        self.profiler = profiler
+        self.group_size = max(1, group_size)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_groups), thread_name_prefix="sf-group")
+        self._lock = threading.Lock()
+        self._setup_lock = threading.Lock()
+        self._pending: List[str] = []
+        self._submitted: List[str] = []
+        self._groups: List[Tuple[List[str], Future]] = []
+        self._table: Optional[Tuple[str, List[str]]] = None
+        self._schema_fingerprint: Optional[str] = None
+        self.finished = False
+
+    def payer_staged(self, progress: PayerCopyProgress):
+        """
+        Queues a payer whose files are all staged. Payers with failed copies, a failed listing or nothing
+        staged are left out.
+        """
+        if progress.failed or progress.analysis_failed or not (progress.queued or progress.skipped):
+            return
+        with self._lock:
+            if progress.payer_id in self._submitted or progress.payer_id in self._pending:
+                return
+            self._pending.append(progress.payer_id)
+            if len(self._pending) < self.group_size:
+                return
+            group, self._pending = self._pending, []
+            self._submit(group)
+
+    def finish(self, payer_ids: List[str], failed_payer_ids: List[str]) -> List[str]:
+        """
+        Submits the staged payers not yet in a group (payers recovered by the copy retry pass among them) and
+        waits for every group. failed_payer_ids (failed copies or analysis) are never submitted. Returns the
+        payers whose group failed.
+        """
+        with self._lock:
+            remaining = [payer_id for payer_id in self._pending + payer_ids
+                         if payer_id not in self._submitted and payer_id not in failed_payer_ids]
+            self._pending = []
+            if remaining:
+                self._submit(list(dict.fromkeys(remaining)))
+            groups = list(self._groups)
+            self.finished = True
+        self._executor.shutdown(wait=True)
+
+        failed = []
+        for group, future in groups:
+            error = future.exception()
+            if error:
+                logger.error(f"Snowflake processing failed for payer group {group}: {error}")
+                failed.extend(group)
+        if len(groups) > 1:
+            processed = [payer_id for group, _ in groups for payer_id in group if payer_id not in failed]
+            if not self._recheck_schema(processed):
+                failed.extend(processed)
+        logger.info(f"Pipelined Snowflake processing finished: {len(groups)} groups, {len(failed)} payers failed.")
+        return failed
+
+    def cancel(self):
+        """Cancels the groups that have not started and waits for the running ones. Does nothing after finish()."""
+        with self._lock:
+            if self.finished:
+                return
+            self.finished = True
+            self._pending = []
+        logger.warning(f"Cancelling pipelined Snowflake processing ({len(self._groups)} payer groups submitted).")
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def harvest(self):
+        """Reads the profiler's query history on a pooled session."""
+        if not self.profiler:
+            return
+        manager = SnowflakeExternalTableManager(self.env, self.module)
+        try:
+            manager.connect()
+            self.profiler.harvest(manager.cursor)
+        except Exception as e:
+            logger.warning(f"Could not harvest query history: {e}")
+        finally:
+            manager.close_connection()
+
+    def _submit(self, group: List[str]):
+        """Caller holds self._lock."""
+        self._submitted.extend(group)
+        logger.info(f"Payers {group} are staged; starting their Snowflake processing "
+                    f"({len(self._submitted)} payers submitted so far).")
+        self._groups.append((group, self._executor.submit(self._process_group, group)))
+
+    def _process_group(self, group: List[str]):
+        manager = SnowflakeExternalTableManager(self.env, self.module)
+        manager.profiler = self.profiler
+        try:
+            manager.connect()
+            table_name, load_columns = self._prepare_table(manager, group)
+            manager.refresh_payer_paths(table_name, group)
+            manager.run_analytics(self.year, self.month, group, table_name, load_columns, asynchronous=True)
+        finally:
+            manager.close_connection()
+
+    def _prepare_table(self, manager: SnowflakeExternalTableManager, group: List[str]) -> Tuple[str, List[str]]:
+        """Sets the stage and external table up once, on the first group that gets here; later groups reuse it."""
+        with self._setup_lock:
+            if self._table is None:
+                schema_fingerprint = None
+                if self.schema_cache and self.stage_prefix:
+                    schema_fingerprint = self.schema_cache.fingerprint(self.stage_prefix)
+                self._table = manager.prepare_external_table(self.year, self.month, self.staging_bucket, group,
+                                                             self.app, schema_cache=self.schema_cache,
+                                                             schema_fingerprint=schema_fingerprint)
+                self._schema_fingerprint = schema_fingerprint
+            return self._table
+
+    def _recheck_schema(self, payer_ids: List[str]) -> bool:
+        """
+        Sets the table up again now that every payer is staged, unless the staged schemas still have the
+        fingerprint they had at setup. If the columns changed (a later payer's files add or retype one), the
+        payers analysed against the old table are analysed again. Returns False if that failed.
+        """
+        if self._table is None or not payer_ids:
+            return True
+        schema_fingerprint = None
+        if self.schema_cache and self.stage_prefix:
+            schema_fingerprint = self.schema_cache.fingerprint(self.stage_prefix)
+            if schema_fingerprint and schema_fingerprint == self._schema_fingerprint:
+                return True
+        logger.info("Re-checking the external table against every staged payer.")
+        manager = SnowflakeExternalTableManager(self.env, self.module)
+        manager.profiler = self.profiler
+        try:
+            manager.connect()
+            table_name, load_columns = manager.prepare_external_table(self.year, self.month, self.staging_bucket,
+                                                                      payer_ids, self.app, schema_cache=self.schema_cache,
+                                                                      schema_fingerprint=schema_fingerprint)
+            if load_columns != self._table[1]:
+                logger.warning(f"Staged schema changed after the table was set up; re-running the analytics "
+                               f"for {len(payer_ids)} payers.")
+                manager.run_analytics(self.year, self.month, payer_ids, table_name, load_columns, asynchronous=True)
+            self._table, self._schema_fingerprint = (table_name, load_columns), schema_fingerprint
+            return True
+        except Exception as e:
+            logger.error(f"Re-checking the external table schema failed: {e}")
+            return False
+        finally:
+            manager.close_connection()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Process-wide pool of authenticated Snowflake sessions, keyed by credential profile.
+
+Config fetching, the timestamp lookups and the table refresh all borrow sessions from the
+module-level `snowflake_sessions` pool instead of each opening their own. Returned sessions stay
+open, up to SNOWFLAKE_POOL_SIZE idle per profile, so later steps of the run skip the login
+handshake. Sessions are opened with client_session_keep_alive so their tokens don't expire
+between steps. A session that sat idle for longer than SNOWFLAKE_POOL_VALIDATE_AFTER_SECONDS
+is checked with `SELECT 1` before it is handed out again. Secrets Manager lookups share one
+client and are cached for SNOWFLAKE_SECRET_TTL_SECONDS.
+
+Pooled sessions keep their session state: temp tables and session parameters. The QUERY_TAG is
+unset when a session is returned, and a session whose with-block raised is closed instead of pooled.
+Callers that change other session state must not rely on getting a fresh session.
+"""
+import json
+import time
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Tuple
+
+import boto3
+import snowflake.connector
+
+from config import (SNOWFLAKE_POOL_SIZE, SNOWFLAKE_POOL_VALIDATE_AFTER_SECONDS, SNOWFLAKE_KEEPALIVE_HEARTBEAT_SECONDS,
+                    SNOWFLAKE_SECRET_TTL_SECONDS)
+
+logger = logging.getLogger(__name__)
+
+
+class SnowflakeSessionManager:
+    """Idle sessions per credential profile, plus a TTL cache of the secrets they are opened with."""
+
+    def __init__(self, pool_size: int = SNOWFLAKE_POOL_SIZE,
+                 validate_after: float = SNOWFLAKE_POOL_VALIDATE_AFTER_SECONDS,
+                 secret_ttl: float = SNOWFLAKE_SECRET_TTL_SECONDS):
+        self.pool_size = pool_size
+        self.validate_after = validate_after
+        self.secret_ttl = secret_ttl
+        self._idle: Dict[str, List[Tuple[Any, float]]] = {}
+        self._secrets: Dict[str, Tuple[Dict[str, Any], float]] = {}
+        self._secrets_client = None
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+
+    def get_secret(self, secret_id: str, region_name: str = 'us-east-1') -> Dict[str, Any]:
+        """Returns a JSON secret from Secrets Manager, cached for secret_ttl seconds. Callers get their own copy."""
+        with self._lock:
+            cached = self._secrets.get(secret_id)
+            if cached and time.monotonic() - cached[1] < self.secret_ttl:
+                return dict(cached[0])
+            if self._secrets_client is None:
+                self._secrets_client = boto3.client('secretsmanager', region_name=region_name)
+            client = self._secrets_client
+        secret = json.loads(client.get_secret_value(SecretId=secret_id)['SecretString'])
+        with self._lock:
+            self._secrets[secret_id] = (secret, time.monotonic())
+        return dict(secret)
+
+    def acquire(self, profile: str, connect_params: Callable[[], Dict[str, Any]]):
+        """
+        Returns an open session for the profile: an idle pooled one if available, otherwise a new one
+        opened with connect_params(). connect_params is only called when a session must be opened.
+        """
+        while True:
+            with self._lock:
+                idle = self._idle.get(profile)
+                if not idle:
+                    break
+                connection, released_at = idle.pop()
+            if self._usable(connection, released_at):
+                with self._lock:
+                    self.reused += 1
+                logger.debug(f"Reusing pooled Snowflake session for profile '{profile}'.")
+                return connection
+            self._close_quietly(connection)
+
+        params = dict(connect_params())
+        params.setdefault('client_session_keep_alive', True)
+        params.setdefault('client_session_keep_alive_heartbeat_frequency', SNOWFLAKE_KEEPALIVE_HEARTBEAT_SECONDS)
+        connection = snowflake.connector.connect(**params)
+        with self._lock:
+            self.opened += 1
+        logger.info(f"Opened Snowflake session for profile '{profile}' ({self.opened} opened, {self.reused} reused).")
+        return connection
+
+    def release(self, profile: str, connection):
+        """Returns a session to the pool, or closes it when the pool for the profile is full."""
+        if connection is None or connection.is_closed():
+            return
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("ALTER SESSION UNSET QUERY_TAG")
+        except Exception as e:
+            logger.info(f"Discarding Snowflake session that could not be reset: {e}")
+            self._close_quietly(connection)
+            return
+        with self._lock:
+            idle = self._idle.setdefault(profile, [])
+            if len(idle) < self.pool_size:
+                idle.append((connection, time.monotonic()))
+                return
+        self._close_quietly(connection)
+
+    @contextmanager
+    def session(self, profile: str, connect_params: Callable[[], Dict[str, Any]]):
+        """
+        Borrows a session for the duration of a with-block. If the block raised, the session may be mid-transaction
+        or broken, so it is closed instead of returned to the pool.
+        """
+        connection = self.acquire(profile, connect_params)
+        try:
+            yield connection
+        except BaseException:
+            self._close_quietly(connection)
+            raise
+        self.release(profile, connection)
+
+    def close_all(self):
+        with self._lock:
+            connections = [connection for idle in self._idle.values() for connection, _ in idle]
+            self._idle.clear()
+        for connection in connections:
+            self._close_quietly(connection)
+        if connections:
+            logger.info(f"Closed {len(connections)} pooled Snowflake sessions.")
+
+    def _usable(self, connection, released_at: float) -> bool:
+        if connection.is_closed():
+            return False
+        if time.monotonic() - released_at < self.validate_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except Exception as e:
+            logger.info(f"Discarding stale pooled Snowflake session: {e}")
+            return False
+
+    @staticmethod
+    def _close_quietly(connection):
+        try:
+            connection.close()
+        except Exception as e:
+            logger.debug(f"Error closing Snowflake session: {e}")
+
+
+# Global instance shared by every Snowflake call site in the process
+snowflake_sessions = SnowflakeSessionManager()
+atexit.register(snowflake_sessions.close_all)
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Dependency-aware execution of multi-statement Snowflake SQL scripts.
+
+The analytics script is a series of independent per-product chains. Each chain creates temp
+tables, then deletes and reinserts its slice of a shared table. SqlScriptRunner splits the script
+into statements and groups them into chains by the temp tables they create and read: temp tables
+are session-scoped, so a chain always runs on one session. Each DELETE is paired with the next
+INSERT into the same table, and the pair runs inside BEGIN ... COMMIT, so a product's rows are
+replaced atomically.
+
+Other writes to a permanent table (UPDATE, MERGE, unpaired DML) and statements the runner cannot
+classify are barriers. Everything before a barrier finishes first, and the barrier runs alone.
+Between barriers, chains run concurrently on separate sessions.
+"""
+import re
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, ContextManager, Dict, List, Optional, Set
+
+from config import SQL_SCRIPT_MAX_SESSIONS
+
+logger = logging.getLogger(__name__)
+
+_CREATE_TEMP_RE = re.compile(r'^create\s+(?:or\s+replace\s+)?(?:local\s+|global\s+)?(?:temporary|temp)\s+table\s+'
+                             r'(?:if\s+not\s+exists\s+)?([\w$.]+)', re.IGNORECASE)
+_DML_RE = re.compile(r'^(delete\s+from|insert\s+(?:overwrite\s+)?into|update|merge\s+into)\s+([\w$.]+)', re.IGNORECASE)
+_SCRIPT_BLOCK_RE = re.compile(r'^\s*begin\b(?!\s+transaction)(.*)\bend\s*;?\s*$', re.IGNORECASE | re.DOTALL)
+# Section banners such as `------ EC2 hourly wastage -------` name the product section of the statements below them.
+_SECTION_RE = re.compile(r'^\s*-{3,}\s*([^-\s][^-]*?)\s*-*\s*$', re.MULTILINE)
+
+
+class SqlScriptError(Exception):
+    """Raised when one or more units of a script failed; independent chains still ran to completion."""
+
+
+class SqlStatement:
+    """One statement of a script and what it touches."""
+
+    def __init__(self, index: int, sql: str):
+        self.index = index
+        self.sql = sql
+        body = strip_leading_comments(sql)
+        self.creates: Optional[str] = None
+        self.dml: Optional[str] = None
+        self.target: Optional[str] = None
+        self.reads: Set[str] = set()
+        self.section: Optional[str] = None
+
+        create = _CREATE_TEMP_RE.match(body)
+        dml = _DML_RE.match(body)
+        if create:
+            self.creates = create.group(1).lower()
+        elif dml:
+            self.dml = dml.group(1).split()[0].lower()
+            self.target = dml.group(2).lower()
+
+    @property
+    def summary(self) -> str:
+        return ' '.join(strip_leading_comments(self.sql).split())[:80]
+
+
+def strip_leading_comments(sql: str) -> str:
+    sql = sql.lstrip()
+    while sql.startswith('--') or sql.startswith('/*'):
+        end = sql.find('\n') if sql.startswith('--') else sql.find('*/') + 1
+        if end <= 0:
+            return ''
+        sql = sql[end + 1:].lstrip()
+    return sql
+
+
+def split_statements(script: str) -> List[str]:
+    """
+    Splits a script on semicolons outside quotes and comments. A surrounding Snowflake Scripting
+    `begin ... end;` block is unwrapped, and comment-only fragments are dropped.
+    """
+    block = _SCRIPT_BLOCK_RE.match(script)
+    if block:
+        script = block.group(1)
+
+    statements, current = [], []
+    i, length = 0, len(script)
+    while i < length:
+        char = script[i]
+        if char == "'":
+            end = i + 1
+            while end < length:
+                if script[end] == "'" and script[end + 1:end + 2] == "'":
+                    end += 2
+                elif script[end] == "'":
+                    break
+                else:
+                    end += 1
+            current.append(script[i:end + 1])
+            i = end + 1
+        elif script.startswith('--', i):
+            end = script.find('\n', i)
+            end = length if end == -1 else end
+            current.append(script[i:end])
+            i = end
+        elif script.startswith('/*', i):
+            end = script.find('*/', i + 2)
+            end = length if end == -1 else end + 2
+            current.append(script[i:end])
+            i = end
+        elif char == ';':
+            statements.append(''.join(current))
+            current = []
+            i += 1
+        else:
+            current.append(char)
+            i += 1
+    statements.append(''.join(current))
+    return [statement.strip() for statement in statements if strip_leading_comments(statement)]
+
+
+def assign_sections(statements: List[SqlStatement]):
+    """
+    Names each statement's section after the nearest banner comment above it. Statements that write
+    a permanent table outside a DELETE/INSERT pair are named after the write instead, e.g. the final UPDATE.
+    """
+    section = 'script'
+    paired = pair_delete_inserts(statements)
+    for statement in statements:
+        leading = statement.sql[:len(statement.sql) - len(strip_leading_comments(statement.sql))]
+        banners = _SECTION_RE.findall(leading)
+        if banners:
+            section = banners[-1]
+        if statement.dml and statement.index not in paired:
+            statement.section = f"{statement.dml} {statement.target}"
+        else:
+            statement.section = section
+
+
+def pair_delete_inserts(statements: List[SqlStatement]) -> Dict[int, int]:
+    """Maps each DELETE to the next INSERT into the same table, and back."""
+    paired: Dict[int, int] = {}
+    open_deletes: Dict[str, int] = {}
+    for statement in statements:
+        if statement.dml == 'delete':
+            open_deletes[statement.target] = statement.index
+        elif statement.dml == 'insert' and statement.target in open_deletes:
+            delete_index = open_deletes.pop(statement.target)
+            paired[delete_index] = statement.index
+            paired[statement.index] = delete_index
+    return paired
+
+
+class SqlScriptRunner:
+    """
+    Runs a script's independent chains concurrently.
+    session() must return a context manager yielding a DB-API connection (one Snowflake session) that
+    no other chain is using, e.g. a session borrowed from the pool in snowflake_session.py.
+    """
+
+    def __init__(self, session: Callable[[], ContextManager], max_sessions: int = SQL_SCRIPT_MAX_SESSIONS,
+                 profiler=None):
+        self.session = session
+        self.max_sessions = max_sessions
+        self.profiler = profiler
+
+    def run(self, script: str):
+        statements = [SqlStatement(index, sql) for index, sql in enumerate(split_statements(script))]
+        assign_sections(statements)
+        phases = self.plan(statements)
+        if phases is None:
+            logger.warning("Temp tables are shared across a barrier statement; running the script sequentially.")
+            phases = [[self._units(statements)]]
+        failures = []
+        for phase_number, chains in enumerate(phases, 1):
+            if failures:
+                skipped = sum(len(unit) for chain in chains for unit in chain)
+                logger.error(f"Skipping {skipped} remaining statements after earlier failures.")
+                break
+            logger.info(f"SQL phase {phase_number}/{len(phases)}: {len(chains)} chains, "
+                        f"{sum(len(unit) for chain in chains for unit in chain)} statements.")
+            workers = max(1, min(self.max_sessions, len(chains)))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sql-chain") as executor:
+                for error in executor.map(self._run_chain, chains):
+                    if error:
+                        failures.append(error)
+        if failures:
+            raise SqlScriptError(f"{len(failures)} SQL chains failed: " + "; ".join(failures))
+
+    def plan(self, statements: List[SqlStatement]) -> Optional[List[List[List[List[SqlStatement]]]]]:
+        """
+        Groups statements into phases of independent chains; each chain is a list of units, and a unit
+        (one statement, or a DELETE/INSERT pair) runs as one transaction. Returns None if the script
+        cannot be split safely.
+        """
+        temp_tables = {statement.creates for statement in statements if statement.creates}
+        for statement in statements:
+            body = statement.sql.lower()
+            statement.reads = {name for name in temp_tables
+                               if name != statement.creates and re.search(rf'(?<![\w$.]){re.escape(name)}(?![\w$])', body)}
+
+        paired = pair_delete_inserts(statements)
+        phases, current = [], []
+        created_in_phase: Dict[str, int] = {}
+        for statement in statements:
+            is_barrier = not statement.creates and statement.index not in paired
+            if any(created_in_phase.get(name, len(phases)) != len(phases) for name in statement.reads):
+                return None
+            if is_barrier:
+                if current:
+                    phases.append(self._chains(current, paired))
+                phases.append([[[statement]]])
+                if statement.reads:
+                    return None
+                current = []
+            else:
+                if statement.creates:
+                    created_in_phase[statement.creates] = len(phases)
+                current.append(statement)
+        if current:
+            phases.append(self._chains(current, paired))
+        return phases
+
+    def _chains(self, statements: List[SqlStatement], paired: Dict[int, int]) -> List[List[List[SqlStatement]]]:
+        """Union-find over temp table use and DELETE/INSERT pairs; each component is one chain."""
+        parent = {statement.index: statement.index for statement in statements}
+
+        def find(index: int) -> int:
+            while parent[index] != index:
+                parent[index] = parent[parent[index]]
+                index = parent[index]
+            return index
+
+        def union(a: int, b: int):
+            parent[find(a)] = find(b)
+
+        creator: Dict[str, int] = {}
+        for statement in statements:
+            for name in statement.reads:
+                if name in creator:
+                    union(statement.index, creator[name])
+            if statement.creates:
+                if statement.creates in creator:
+                    union(statement.index, creator[statement.creates])
+                creator[statement.creates] = statement.index
+            if statement.index in paired and paired[statement.index] in parent:
+                union(statement.index, paired[statement.index])
+
+        components: Dict[int, List[SqlStatement]] = {}
+        for statement in statements:
+            components.setdefault(find(statement.index), []).append(statement)
+        return [self._units(chain) for chain in components.values()]
+
+    @staticmethod
+    def _units(statements: List[SqlStatement]) -> List[List[SqlStatement]]:
+        """Groups a chain's statements into transaction units, keeping DELETE/INSERT pairs together."""
+        units, pending_delete = [], {}
+        for statement in statements:
+            if statement.dml == 'delete':
+                pending_delete[statement.target] = statement
+                continue
+            if statement.dml == 'insert' and statement.target in pending_delete:
+                units.append([pending_delete.pop(statement.target), statement])
+                continue
+            units.append([statement])
+        units.extend([delete] for delete in pending_delete.values())
+        units.sort(key=lambda unit: unit[0].index)
+        return units
+
+    def _run_chain(self, units: List[List[SqlStatement]]) -> Optional[str]:
+        """Runs one chain on its own session. Returns an error description, or None on success."""
+        first = units[0][0]
+        label = f"chain starting at statement {first.index} ({first.summary})"
+        try:
+            with self.session() as connection, connection.cursor() as cursor:
+                for unit in units:
+                    self._run_unit(cursor, unit)
+            logger.info(f"Finished {label}: {sum(len(unit) for unit in units)} statements "
+                        f"on thread {threading.current_thread().name}.")
+            return None
+        except Exception as e:
+            logger.error(f"SQL {label} failed: {e}")
+            return f"{label}: {e}"
+
+    def _run_unit(self, cursor, unit: List[SqlStatement]):
+        if len(unit) == 1:
+            self._execute(cursor, unit[0])
+            return
+        cursor.execute("BEGIN")
+        try:
+            for statement in unit:
+                self._execute(cursor, statement)
+            cursor.execute("COMMIT")
+        except Exception:
+            try:
+                cursor.execute("ROLLBACK")
+            except Exception as rollback_error:
+                logger.error(f"ROLLBACK after statement {unit[0].index} failed: {rollback_error}")
+            raise
+
+    def _execute(self, cursor, statement: SqlStatement):
+        if self.profiler:
+            self.profiler.execute(cursor, statement.sql, statement.section, statement.index)
+        else:
+            cursor.execute(statement.sql)